@@ -0,0 +1,31 @@
+import hmac
+import os
+from functools import wraps
+from sanic.exceptions import Forbidden
+from sanic.request import Request
+from typing import Callable
+
+
+def is_admin(request: Request) -> bool:
+    """
+    Checks the `X-Admin-Token` header against `ADMIN_TOKEN` environment variable. Admin access is disabled when the
+    variable is not set.
+
+    :param request: `Request` object
+    :return: True for admin requests
+    """
+    token: str = os.environ.get("ADMIN_TOKEN", "")
+    return bool(token) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token)
+
+
+def admin_only(handler: Callable) -> Callable:
+    """
+    View decorator rejecting non-admin requests with 403.
+    """
+    @wraps(handler)
+    def wrapped_handler(request: Request, *args, **kwargs):
+        if not is_admin(request):
+            raise Forbidden("Admin token required")
+        return handler(request, *args, **kwargs)
+
+    return wrapped_handler
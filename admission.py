@@ -0,0 +1,191 @@
+import asyncio
+import os
+import time
+from collections import deque
+from metrics import LATENCY_BUCKETS, registry, route_label
+from routes.streaming import defer_to_stream_end
+from sanic.exceptions import ServiceUnavailable
+from sanic.request import Request
+from typing import Deque, Dict, Optional
+
+# Route classes of the GET requests that are not cheap lookups, every other read is a lookup and every other method
+# is a write
+ROUTE_CLASSES: Dict[str, str] = {
+    '/people/<pk:str>': 'detail',
+    '/organizations/<pk:str>': 'detail',
+    '/people': 'export',
+    '/organizations': 'export',
+    '/addresses': 'export',
+    '/emails': 'export',
+    '/phones': 'export',
+    '/memberships': 'export',
+    '/memberships/headcount': 'export',
+    '/organizations/<pk:str>/subtree': 'export',
+    '/organizations/<pk:str>/memberships': 'export',
+    '/organizations/<pk:str>/stats': 'export',
+}
+
+# Default concurrency and queue length per class; SQLite serializes writers, so writes get few slots
+DEFAULT_LIMITS: Dict[str, Dict[str, int]] = {
+    'lookup': {'concurrency': 32, 'queue': 256},
+    'detail': {'concurrency': 8, 'queue': 64},
+    'write': {'concurrency': 4, 'queue': 64},
+    'export': {'concurrency': 2, 'queue': 8},
+}
+
+# Long-lived websocket connections would hold their slot for their whole lifetime
+EXEMPT_PREFIXES = ('/metrics', '/admin/', '/ws/')
+
+
+class Overloaded(ServiceUnavailable):
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        self.headers: Dict[str, str] = {'Retry-After': str(retry_after)}
+
+
+class ConcurrencyLimiter:
+    """
+    Semaphore with a bounded FIFO wait queue. A request that finds every slot taken waits in the queue; when the
+    queue is full, or the request waited longer than `timeout`, it is rejected instead of piling up behind the
+    database.
+    """
+
+    def __init__(self, concurrency: int, max_queue: int, timeout: float) -> None:
+        self.concurrency: int = concurrency
+        self.max_queue: int = max_queue
+        self.timeout: float = timeout
+        self.in_flight: int = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.admitted: int = 0
+        self.rejected: Dict[str, int] = {'queue_full': 0, 'timeout': 0}
+
+    async def acquire(self) -> bool:
+        """
+        Takes a slot, waiting in the queue when necessary.
+
+        :return: False when the request is rejected
+        """
+        if self.in_flight < self.concurrency and not self.waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        if len(self.waiters) >= self.max_queue:
+            self.rejected['queue_full'] += 1
+            return False
+        waiter: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected['timeout'] += 1
+            return self._abandon(waiter)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        # The slot is handed over to the next waiter directly, so in_flight only drops when nobody waits
+        while self.waiters:
+            waiter: asyncio.Future = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _abandon(self, waiter: asyncio.Future) -> bool:
+        if waiter.done():
+            # The slot was handed over while the waiter gave up, pass it on
+            self.release()
+        else:
+            self.waiters.remove(waiter)
+        return False
+
+
+class AdmissionController:
+    """
+    Per route class concurrency limits, so a burst of expensive requests can only exhaust the slots of its own class
+    and cheap lookups keep being served.
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, int]], timeout: float, retry_after: int) -> None:
+        self.limiters: Dict[str, ConcurrencyLimiter] = {
+            name: ConcurrencyLimiter(limit['concurrency'], limit['queue'], timeout) for name, limit in limits.items()
+        }
+        self.retry_after: int = retry_after
+
+    @staticmethod
+    def route_class(request: Request) -> Optional[str]:
+        """
+        Class of the request, None for requests exempt from admission control.
+        """
+        route: str = route_label(request)
+        if route == 'unmatched' or route.startswith(EXEMPT_PREFIXES) or request.method == 'OPTIONS':
+            return None
+        if request.method not in ('GET', 'HEAD'):
+            return 'write'
+        return ROUTE_CLASSES.get(route, 'lookup')
+
+
+def _limits_from_env() -> Dict[str, Dict[str, int]]:
+    return {
+        name: {
+            key: int(os.environ.get(f'ADMISSION_{name.upper()}_{key.upper()}', value)) for key, value in limit.items()
+        }
+        for name, limit in DEFAULT_LIMITS.items()
+    }
+
+
+admission_controller = AdmissionController(
+    limits=_limits_from_env(),
+    timeout=float(os.environ.get('ADMISSION_QUEUE_TIMEOUT_MS', 5000)) / 1000,
+    retry_after=int(os.environ.get('ADMISSION_RETRY_AFTER', 1)),
+)
+
+registry.histogram(
+    'admission_wait_seconds', 'Time admitted requests waited for a slot per route class.', LATENCY_BUCKETS
+)
+registry.gauge('admission_in_flight', 'Requests holding a slot per route class.', lambda: {
+    (('class', name),): limiter.in_flight for name, limiter in admission_controller.limiters.items()
+})
+registry.gauge('admission_queue_depth', 'Requests waiting for a slot per route class.', lambda: {
+    (('class', name),): len(limiter.waiters) for name, limiter in admission_controller.limiters.items()
+})
+registry.counter('admission_admitted_total', 'Requests admitted per route class.', lambda: {
+    (('class', name),): limiter.admitted for name, limiter in admission_controller.limiters.items()
+})
+registry.counter('admission_rejected_total', 'Requests rejected with 503 per route class and reason.', lambda: {
+    (('class', name), ('reason', reason)): count
+    for name, limiter in admission_controller.limiters.items()
+    for reason, count in limiter.rejected.items()
+})
+
+
+def _release(request: Request) -> None:
+    limiter: Optional[ConcurrencyLimiter] = getattr(request.ctx, 'admission_limiter', None)
+    if limiter is not None:
+        del request.ctx.admission_limiter
+        request.ctx.admission_task.remove_done_callback(request.ctx.admission_callback)
+        limiter.release()
+
+
+async def admit_request(request: Request) -> None:
+    route_class: Optional[str] = admission_controller.route_class(request)
+    if route_class is None:
+        return
+    limiter: ConcurrencyLimiter = admission_controller.limiters[route_class]
+    started: float = time.perf_counter()
+    if not await limiter.acquire():
+        raise Overloaded(f'Too many {route_class} requests, try again later', admission_controller.retry_after)
+    registry.observe('admission_wait_seconds', (('class', route_class),), time.perf_counter() - started)
+    request.ctx.admission_limiter = limiter
+    # Response middleware does not run when the client disconnects and the connection task is cancelled
+    request.ctx.admission_task = asyncio.current_task()
+    request.ctx.admission_callback = lambda task: _release(request)
+    request.ctx.admission_task.add_done_callback(request.ctx.admission_callback)
+
+
+async def release_request(request: Request, response) -> None:
+    if not defer_to_stream_end(request, release_request, response):
+        _release(request)
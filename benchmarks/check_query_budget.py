@@ -0,0 +1,237 @@
+"""
+Pins the number of SQL statements every route of the Sanic `app` may execute.
+
+Serves the app in-process against a small dataset from `generate_dataset`, sends one request per route and method,
+and counts the statements of each request with `QueryCounter`. Exits with status 1 when a request exceeds its
+budget, fails, or a route has no budget at all, so added round-trips and per-row queries are caught before merging.
+When a change reduces the statement count, lower the budget in `BUDGETS` as well.
+
+Usage: python -m benchmarks.check_query_budget [--verbose]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+from benchmarks.generate_dataset import generate_dataset, map_id, organization_id, person_id
+from benchmarks.load_test import HttpClient, free_port
+from query_budget import QueryCounter, count_queries
+from routes.streaming import defer_to_stream_end
+from sqlalchemy import create_engine
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+ADMIN_TOKEN: str = 'query-budget'
+
+
+class Case(NamedTuple):
+    method: str
+    route: str
+    path: str
+    budget: int
+    body: Optional[Any] = None
+    status: int = 200
+
+
+def _map_cases(route: str, table: str) -> List[Case]:
+    item: Dict[str, Any] = {'id': map_id(table, 0), 'name': f'Renamed {table}', 'valid_flag': 'Y', 'created_by': 'test'}
+    return [
+        Case('GET', f'/{route}/<pk:str>', f'/{route}/{map_id(table, 0)}', 1),
+        Case('PATCH', f'/{route}/<pk:str>', f'/{route}/{map_id(table, 0)}', 4, {'description': 'Updated'}),
+        Case('GET', f'/{route}', f'/{route}', 1),
+        # one upsert per posted item, then the reload of the table
+        Case('POST', f'/{route}', f'/{route}', 4, {'data': [item]}),
+    ]
+
+
+def _contact_cases(route: str, prefix: str, row: Dict[str, Any]) -> List[Case]:
+    return [
+        Case('GET', f'/{route}/<pk:str>', f'/{route}/{prefix}-000000000001', 1),
+        Case('PATCH', f'/{route}/<pk:str>', f'/{route}/{prefix}-000000000001', 4, row),
+        Case('GET', f'/{route}', f'/{route}', 1),
+        Case('POST', f'/{route}', f'/{route}', 3, {
+            'id': f'{prefix}-budget', 'person_id': person_id(1), 'created_by': 'test', **row
+        }),
+    ]
+
+
+def _detail_payload(key: str, values: Dict[str, Any]) -> Dict[str, Any]:
+    # one item per related list, every item costs its own UPDATE
+    return {
+        key: values, 'address': [{'city': 'Budget'}], 'email': [{'skype': 'Y'}], 'phone': [{'viber': 'Y'}],
+        'membership': [{'notes': 'Budget'}],
+    }
+
+
+# Every committed write that invalidates cache entries adds one INSERT into cache_invalidation, and every write adds
+# one INSERT into change_log
+BUDGETS: List[Case] = [
+    *_map_cases('genders', 'gender'),
+    *_map_cases('membership-fee-categories', 'membership_fee_category'),
+    *_map_cases('address-types', 'address_type'),
+    *_map_cases('phone-types', 'phone_type'),
+    *_map_cases('email-types', 'email_type'),
+    Case('GET', '/person-mappings', '/person-mappings', 5),
+    Case('GET', '/organization-mappings', '/organization-mappings', 4),
+    Case('GET', '/mappings', '/mappings', 5),
+    Case('GET', '/people/<pk:str>', f'/people/{person_id(1)}', 10),
+    Case('PATCH', '/people/<pk:str>', f'/people/{person_id(1)}', 20, _detail_payload(
+        'person', {'notes': 'Budget', 'membership_fee_category_id': map_id('membership_fee_category', 1)}
+    )),
+    Case('GET', '/people', '/people?page=1', 2),
+    # numbers are issued by the sequences only
+    Case('POST', '/people', '/people', 0, {
+        'id': 'person-budget', 'registration_number': 999999, 'membership_id': 'M-budget', 'name': 'Budget Person',
+        'membership_fee_category_id': map_id('membership_fee_category', 0), 'created_by': 'test',
+    }, status=400),
+    # the first person numbered by the sequences creates them: a seeding insert, an update and a read for each
+    Case('POST', '/people', '/people', 8, {
+        'id': 'person-budget-numbered', 'name': 'Numbered Person',
+        'membership_fee_category_id': map_id('membership_fee_category', 0), 'created_by': 'test',
+    }),
+    Case('GET', '/organizations/<pk:str>', f'/organizations/{organization_id(1)}', 9),
+    Case('PATCH', '/organizations/<pk:str>', f'/organizations/{organization_id(3)}', 20, _detail_payload(
+        'organization', {'notes': 'Budget', 'organization_parent_id': organization_id(2)}
+    )),
+    Case('GET', '/organizations', '/organizations', 2),
+    Case('POST', '/organizations', '/organizations', 4, {
+        'id': 'organization-budget', 'name': 'Budget Organization', 'organization_parent_id': organization_id(0),
+        'accepts_members_flag': 'Y', 'establishment_date': '2020-01-01', 'created_by': 'test',
+    }),
+    Case('GET', '/organizations/<pk:str>/subtree', f'/organizations/{organization_id(0)}/subtree', 1),
+    Case('GET', '/organizations/<pk:str>/ancestors', f'/organizations/{organization_id(5)}/ancestors', 1),
+    Case('GET', '/organizations/<pk:str>/memberships', f'/organizations/{organization_id(0)}/memberships', 1),
+    Case('GET', '/organizations/<pk:str>/stats', f'/organizations/{organization_id(0)}/stats?rollup=Y', 1),
+    *_contact_cases('addresses', 'address', {
+        'address_type_id': map_id('address_type', 0), 'zip': '1000', 'city': 'Budget', 'address_1': 'Budget street'
+    }),
+    *_contact_cases('emails', 'email', {
+        'email_type_id': map_id('email_type', 0), 'email': 'budget@example.com', 'messenger': 'N', 'skype': 'N'
+    }),
+    *_contact_cases('phones', 'phone', {
+        'phone_type_id': map_id('phone_type', 0), 'phone_number': '+3600000000', 'messenger': 'N', 'skype': 'N',
+        'viber': 'N', 'whatsapp': 'N'
+    }),
+    Case('GET', '/memberships/<pk:str>', '/memberships/membership-000000000001', 1),
+    Case('PATCH', '/memberships/<pk:str>', '/memberships/membership-000000000001', 7, {'active_flag': 'N'}),
+    Case('GET', '/memberships', '/memberships', 1),
+    Case('POST', '/memberships', '/memberships', 5, {
+        'id': 'membership-budget', 'person_id': person_id(1), 'organization_id': organization_id(0),
+        'active_flag': 'Y', 'event_date': '2020-01-01', 'created_by': 'test',
+    }),
+    # invalid payloads are rejected before the session is used
+    Case('POST', '/memberships', '/memberships', 0, {'active_flag': 'X', 'event_date': 'never'}, 400),
+    Case('GET', '/memberships/status', f'/memberships/status?person_id={person_id(1)}', 1),
+    Case('GET', '/memberships/headcount', '/memberships/headcount', 1),
+    Case('GET', '/changes', '/changes', 1),
+    # the change log, then one query per entity written by the cases above
+    Case('GET', '/changes', '/changes?since=0', 12),
+    Case('POST', '/batch', '/batch', 8, {'operations': [
+        {'method': 'PATCH', 'path': '/memberships/membership-000000000002', 'body': {'active_flag': 'N'}},
+        {'method': 'GET', 'path': '/memberships/$0.id'},
+    ]}),
+    Case('POST', '/jobs', '/jobs', 2, {'kind': 'rebuild_organization_closure'}, status=202),
+    Case('GET', '/jobs/<pk:str>', '/jobs/unknown-job', 1, status=404),
+    Case('GET', '/jobs/<pk:str>/result', '/jobs/unknown-job/result', 1, status=404),
+    Case('GET', '/metrics', '/metrics', 0),
+    Case('GET', '/admin/slow-queries', '/admin/slow-queries', 0),
+    Case('DELETE', '/admin/slow-queries', '/admin/slow-queries', 0, status=204),
+    Case('GET', '/admin/cache', '/admin/cache', 0),
+    Case('DELETE', '/admin/cache', '/admin/cache', 0, status=204),
+    Case('GET', '/admin/profiles', '/admin/profiles', 0),
+    Case('PUT', '/admin/profiles', '/admin/profiles', 0, {'rate': 0}),
+    Case('DELETE', '/admin/profiles', '/admin/profiles', 0, status=204),
+    Case('GET', '/admin/profiles/<pk:int>', '/admin/profiles/1', 0),
+]
+
+
+def route_methods(app) -> Set[Tuple[str, str]]:
+    """
+    Every (method, route label) pair served by the app, apart from the generated OPTIONS and HEAD handlers and the
+    websocket routes.
+    """
+    return {
+        (method, f'/{route.path}')
+        for route in app.router.routes
+        for method in route.methods
+        if method not in ('OPTIONS', 'HEAD') and not getattr(route.handler, 'is_websocket', False)
+    }
+
+
+async def run_cases(app, port: int) -> Dict[int, Tuple[int, Any]]:
+    counters: Dict[int, QueryCounter] = {}
+
+    async def start_counter(request) -> None:
+        request.ctx.query_counter = QueryCounter().__enter__()
+
+    async def stop_counter(request, response) -> None:
+        if hasattr(request.ctx, 'query_counter') and not defer_to_stream_end(request, stop_counter, response):
+            request.ctx.query_counter.__exit__(None, None, None)
+            counters[int(request.headers['X-Budget-Case'])] = request.ctx.query_counter
+
+    app.register_middleware(start_counter, 'request')
+    app.register_middleware(stop_counter, 'response')
+    server = await app.create_server(host='127.0.0.1', port=port, return_asyncio_server=True, access_log=False)
+    await server.startup()
+    await server.before_start()
+    await server.after_start()
+    results: Dict[int, Tuple[int, Any]] = {}
+    client = HttpClient('127.0.0.1', port)
+    try:
+        for i, case in enumerate(BUDGETS):
+            headers: Dict[str, str] = {'X-Budget-Case': str(i), 'X-Admin-Token': ADMIN_TOKEN}
+            if case.route == '/admin/profiles/<pk:int>':
+                headers['X-Profile'] = 'sample'
+                await client.request('GET', '/mappings', headers=headers)
+            status, _ = await client.request(case.method, case.path, case.body, headers)
+            results[i] = (status, counters.get(i))
+    finally:
+        await client.close()
+        await server.before_stop()
+        await server.close()
+        await server.after_stop()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--verbose', action='store_true', help='list the statements of every request')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path: str = os.path.join(tmp_dir, 'query_budget.db')
+        generate_dataset(create_engine(f'sqlite:///{db_path}'), 50, 10, 60, 100)
+        os.environ.update({
+            'DATABASE_URL': f'sqlite+aiosqlite:///{db_path}', 'SQL_ECHO': 'N', 'ADMIN_TOKEN': ADMIN_TOKEN
+        })
+        # server reads the database settings at import time
+        from server import app, bind
+
+        count_queries(bind)
+        results: Dict[int, Tuple[int, Any]] = asyncio.run(run_cases(app, free_port()))
+
+    failures: int = 0
+    for i, case in enumerate(BUDGETS):
+        status, counter = results[i]
+        count: int = counter.count if counter is not None else -1
+        if status != case.status:
+            verdict = f'FAILED with status {status}'
+        elif count > case.budget:
+            verdict = 'OVER BUDGET'
+        elif count < case.budget:
+            verdict = 'ok, budget can be lowered'
+        else:
+            verdict = 'ok'
+        failures += verdict.startswith(('FAILED', 'OVER'))
+        print(f'{case.method:<7} {case.route:<40} {count:>3} / {case.budget:<3} {verdict}')
+        if counter is not None and (args.verbose or verdict == 'OVER BUDGET'):
+            print(''.join(f'          {statement}\n' for statement in counter.statements), end='')
+
+    missing: Set[Tuple[str, str]] = route_methods(app) - {(case.method, case.route) for case in BUDGETS}
+    for method, route in sorted(missing, key=lambda pair: (pair[1], pair[0])):
+        print(f'{method:<7} {route:<40} no query budget')
+    if failures or missing:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""
+Generates a consistent synthetic database for scale testing.
+
+Every foreign key and check constraint of `models/models.py` is respected, rows are written with bulk Core inserts
+in chunks and the content only depends on `--seed`. Indexes are created after loading and the closure and
+statistics tables are rebuilt at the end.
+
+Usage: python -m benchmarks.generate_dataset --url sqlite:///scale.db --people 1000000 --organizations 10000 \
+           --contacts 3000000 --memberships 10000000 --depth 12
+"""
+import argparse
+import datetime
+import random
+import time
+from hierarchy import clear_closure_stmt, rebuild_closure_stmt
+from membership_statistics import clear_statistics_stmt, rebuild_statistics_stmt
+from models.models import (
+    Address, AddressType, Base, Email, EmailType, Gender, Membership, MembershipFeeCategory, Organization, Person,
+    Phone, PhoneType
+)
+from sqlalchemy import create_engine, insert
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import Index
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+MAP_NAMES: Dict[str, List[str]] = {
+    'gender': ['Female', 'Male', 'Other'],
+    'membership_fee_category': ['Full', 'Reduced', 'Student', 'Senior', 'Honorary'],
+    'address_type': ['Home', 'Mailing', 'Work', 'Seat'],
+    'phone_type': ['Mobile', 'Home', 'Work', 'Fax'],
+    'email_type': ['Private', 'Work', 'Notification'],
+}
+YN = ('Y', 'N')
+
+
+def person_id(i: int) -> str:
+    return f'person-{i:012d}'
+
+
+def organization_id(i: int) -> str:
+    return f'organization-{i:08d}'
+
+
+def map_id(table: str, i: int) -> str:
+    return f'{table}-{i:04d}'
+
+
+def chunked(rows: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk: List[Dict[str, Any]] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class DatasetGenerator:
+    """
+    Generates the rows of every table. Row generators are deterministic given the seed and the sizes.
+    """
+
+    def __init__(
+            self, people: int, organizations: int, contacts: int, memberships: int, depth: int, seed: int
+    ) -> None:
+        self.people: int = people
+        self.organizations: int = organizations
+        self.contacts: int = contacts
+        self.memberships: int = memberships
+        self.depth: int = depth
+        self.rng: random.Random = random.Random(seed)
+        self.created_on: datetime.datetime = datetime.datetime(2022, 1, 1)
+        self.accepting: List[int] = []
+
+    def _common(self) -> Dict[str, Any]:
+        return {'created_on': self.created_on, 'created_by': 'generator'}
+
+    def map_rows(self, table: str) -> Iterator[Dict[str, Any]]:
+        for i, name in enumerate(MAP_NAMES[table]):
+            yield {
+                'id': map_id(table, i), 'name': name, 'description': f'{name} {table.replace("_", " ")}',
+                'valid_flag': 'N' if i == len(MAP_NAMES[table]) - 1 and i > 1 else 'Y', **self._common(),
+            }
+
+    def organization_rows(self) -> Iterator[Dict[str, Any]]:
+        """
+        Each organization hangs below one of the recent organizations that is not yet at maximum depth, which yields
+        long chains with branching instead of a shallow bushy tree.
+        """
+        rng = self.rng
+        depths: List[int] = []
+        roots: int = max(self.organizations // 1000, 1)
+        for i in range(self.organizations):
+            parent: Optional[int] = None
+            if i >= roots:
+                parent = rng.randrange(max(0, i - 50), i)
+                if depths[parent] >= self.depth:
+                    parent = rng.randrange(roots)
+            depths.append(0 if parent is None else depths[parent] + 1)
+            established = datetime.date(1950, 1, 1) + datetime.timedelta(days=rng.randrange(25000))
+            terminated = established + datetime.timedelta(days=rng.randrange(1, 5000)) if rng.random() < 0.05 else None
+            accepts: str = 'Y' if rng.random() < 0.8 else 'N'
+            if accepts == 'Y' and terminated is None:
+                self.accepting.append(i)
+            yield {
+                'id': organization_id(i), 'name': f'Organization {i:08d}',
+                'organization_parent_id': None if parent is None else organization_id(parent),
+                'description': None, 'accepts_members_flag': accepts, 'establishment_date': established,
+                'termination_date': terminated, 'notes': None, **self._common(),
+            }
+        if not self.accepting:
+            self.accepting.append(0)
+
+    def person_rows(self) -> Iterator[Dict[str, Any]]:
+        rng = self.rng
+        genders: int = len(MAP_NAMES['gender'])
+        categories: int = len(MAP_NAMES['membership_fee_category'])
+        for i in range(self.people):
+            yield {
+                'id': person_id(i), 'registration_number': i + 1, 'membership_id': f'M{i + 1:010d}',
+                'name': f'Person {i:09d}',
+                'birthdate': datetime.date(1930, 1, 1) + datetime.timedelta(days=rng.randrange(30000)),
+                'mother_name': f'Mother {i:09d}' if rng.random() < 0.7 else None,
+                'gender_id': map_id('gender', rng.randrange(genders)) if rng.random() < 0.95 else None,
+                'identity_card_number': f'{rng.randrange(10 ** 8):08d}AB' if rng.random() < 0.6 else None,
+                'membership_fee_category_id': map_id('membership_fee_category', rng.randrange(categories)),
+                'notes': None, **self._common(),
+            }
+
+    def _owner(self) -> Dict[str, Optional[str]]:
+        if self.rng.random() < 0.9 or not self.organizations:
+            return {'person_id': person_id(self.rng.randrange(self.people)), 'organization_id': None}
+        return {'person_id': None, 'organization_id': organization_id(self.rng.randrange(self.organizations))}
+
+    def address_rows(self, count: int) -> Iterator[Dict[str, Any]]:
+        rng = self.rng
+        types: int = len(MAP_NAMES['address_type'])
+        for i in range(count):
+            yield {
+                'id': f'address-{i:012d}', **self._owner(),
+                'address_type_id': map_id('address_type', rng.randrange(types)),
+                'zip': f'{rng.randrange(1000, 10000)}', 'city': f'City {rng.randrange(3000)}',
+                'address_1': f'{rng.randrange(1, 300)} Street {rng.randrange(10000)}',
+                'address_2': f'Floor {rng.randrange(10)}' if rng.random() < 0.2 else None, **self._common(),
+            }
+
+    def email_rows(self, count: int) -> Iterator[Dict[str, Any]]:
+        rng = self.rng
+        types: int = len(MAP_NAMES['email_type'])
+        for i in range(count):
+            yield {
+                'id': f'email-{i:012d}', **self._owner(),
+                'email_type_id': map_id('email_type', rng.randrange(types)),
+                'email': f'user{i}@example.com', 'messenger': rng.choice(YN), 'skype': rng.choice(YN),
+                **self._common(),
+            }
+
+    def phone_rows(self, count: int) -> Iterator[Dict[str, Any]]:
+        rng = self.rng
+        types: int = len(MAP_NAMES['phone_type'])
+        for i in range(count):
+            yield {
+                'id': f'phone-{i:012d}', **self._owner(),
+                'phone_type_id': map_id('phone_type', rng.randrange(types)),
+                'phone_number': f'+36{rng.randrange(10 ** 9):09d}',
+                'phone_extension': f'{rng.randrange(1000)}' if rng.random() < 0.1 else None,
+                'messenger': rng.choice(YN), 'skype': rng.choice(YN), 'viber': rng.choice(YN),
+                'whatsapp': rng.choice(YN), **self._common(),
+            }
+
+    def membership_rows(self) -> Iterator[Dict[str, Any]]:
+        """
+        Events are generated person by person as alternating join/leave sequences in increasing date order.
+        """
+        rng = self.rng
+        written: int = 0
+        for i in range(self.people):
+            count: int = self.memberships * (i + 1) // self.people - written
+            organization: int = rng.choice(self.accepting)
+            event_date: datetime.date = datetime.date(1990, 1, 1) + datetime.timedelta(days=rng.randrange(8000))
+            for j in range(count):
+                if rng.random() < 0.2:
+                    organization = rng.choice(self.accepting)
+                active: str = 'Y' if j % 2 == 0 else 'N'
+                yield {
+                    'id': f'membership-{written:012d}', 'person_id': person_id(i),
+                    'organization_id': organization_id(organization), 'active_flag': active,
+                    'inactivity_status_id': None, 'event_date': event_date,
+                    'notes': None, **self._common(),
+                }
+                event_date += datetime.timedelta(days=rng.randrange(1, 400))
+                written += 1
+
+
+def load(conn: Connection, model, rows: Iterator[Dict[str, Any]], chunk_size: int,
+         progress: Callable[[str, int], None]) -> None:
+    total: int = 0
+    for chunk in chunked(rows, chunk_size):
+        conn.execute(insert(model), chunk)
+        total += len(chunk)
+        progress(model.__tablename__, total)
+
+
+def generate_dataset(
+        engine: Engine, people: int, organizations: int, contacts: int, memberships: int, depth: int = 12,
+        seed: int = 42, chunk_size: int = 50000, progress: Callable[[str, int], None] = lambda table, rows: None
+) -> None:
+    """
+    Creates the schema and loads a synthetic dataset into an empty database.
+
+    :param engine: synchronous `Engine` object of the target database
+    :param people: number of people
+    :param organizations: number of organizations
+    :param contacts: number of addresses, emails and phones together
+    :param memberships: number of membership events
+    :param depth: maximum depth of the organization hierarchy
+    :param seed: random seed, the same seed and sizes always produce the same data
+    :param chunk_size: rows per bulk insert
+    :param progress: callback receiving the table name and the rows loaded so far
+    """
+    Base.metadata.create_all(engine)
+    indexes: List[Index] = [index for table in Base.metadata.sorted_tables for index in table.indexes]
+    generator = DatasetGenerator(people, organizations, contacts, memberships, depth, seed)
+    with engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA synchronous = OFF')
+        with conn.begin():
+            for index in indexes:
+                index.drop(conn)
+            for model in (Gender, MembershipFeeCategory, AddressType, PhoneType, EmailType):
+                load(conn, model, generator.map_rows(model.__tablename__), chunk_size, progress)
+            load(conn, Organization, generator.organization_rows(), chunk_size, progress)
+            load(conn, Person, generator.person_rows(), chunk_size, progress)
+            load(conn, Address, generator.address_rows(contacts // 3), chunk_size, progress)
+            load(conn, Email, generator.email_rows(contacts // 3), chunk_size, progress)
+            load(conn, Phone, generator.phone_rows(contacts - 2 * (contacts // 3)), chunk_size, progress)
+            load(conn, Membership, generator.membership_rows(), chunk_size, progress)
+            for index in indexes:
+                index.create(conn)
+            conn.execute(clear_closure_stmt)
+            conn.execute(rebuild_closure_stmt)
+            conn.execute(clear_statistics_stmt)
+            conn.execute(rebuild_statistics_stmt, {'sign': 1})
+        conn.exec_driver_sql('PRAGMA synchronous = FULL')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='sqlite:///scale.db')
+    parser.add_argument('--people', type=int, default=1000000)
+    parser.add_argument('--organizations', type=int, default=10000)
+    parser.add_argument('--contacts', type=int, default=3000000)
+    parser.add_argument('--memberships', type=int, default=10000000)
+    parser.add_argument('--depth', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    args = parser.parse_args()
+
+    started: float = time.perf_counter()
+
+    def progress(table: str, rows: int) -> None:
+        print(f'\r{time.perf_counter() - started:8.1f}s {table:<25} {rows:>12,d} rows', end='', flush=True)
+
+    engine: Engine = create_engine(args.url)
+    generate_dataset(
+        engine, args.people, args.organizations, args.contacts, args.memberships, args.depth, args.seed,
+        args.chunk_size, progress
+    )
+    print(f'\nDone in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Compares organization subtree lookups through the closure table against a recursive CTE over
+`Organization.organization_parent_id` on a synthetic deep tree.
+
+Usage: python -m benchmarks.hierarchy --organizations 5000 --depth 200 --repeat 50
+"""
+import argparse
+import datetime
+import random
+import timeit
+from hierarchy import clear_closure_stmt, rebuild_closure_stmt
+from models.models import Base, Membership, Organization, OrganizationClosure, Person
+from queries.queries import query_organization_descendant_membership, query_organization_subtree
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql.selectable import CTE, Select
+from typing import Callable, Dict, List
+
+
+def recursive_subtree(organization_id: str) -> Select:
+    tree: CTE = select(Organization.id, Organization.organization_parent_id).where(
+        Organization.id == organization_id
+    ).cte('subtree', recursive=True)
+    tree = tree.union_all(
+        select(Organization.id, Organization.organization_parent_id).join(
+            tree, Organization.organization_parent_id == tree.c.id
+        )
+    )
+    return select(Organization.id, Organization.name).join(tree, tree.c.id == Organization.id)
+
+
+def recursive_descendant_membership(organization_id: str) -> Select:
+    tree: CTE = select(Organization.id).where(Organization.id == organization_id).cte('subtree', recursive=True)
+    tree = tree.union_all(select(Organization.id).join(tree, Organization.organization_parent_id == tree.c.id))
+    return select(
+        Membership.id, Membership.person_id, Person.name, Membership.organization_id, Organization.name
+    ).join(Person).join(Organization).join(tree, tree.c.id == Membership.organization_id)
+
+
+def build_tree(conn: Connection, organizations: int, depth: int, memberships: int, rng: random.Random) -> List[str]:
+    """
+    Inserts a tree made of `depth` long chains hanging from a single root.
+    """
+    ids: List[str] = [f'org-{i:08d}' for i in range(organizations)]
+    rows: List[Dict] = []
+    for i, organization_id in enumerate(ids):
+        parent_id = None if i == 0 else ids[i - 1] if i % depth else ids[0]
+        rows.append({
+            'id': organization_id, 'organization_parent_id': parent_id, 'name': organization_id,
+            'accepts_members_flag': 'Y', 'establishment_date': datetime.date(2000, 1, 1),
+            'created_on': datetime.datetime.now(), 'created_by': 'benchmark',
+        })
+    conn.execute(insert(Organization), rows)
+    conn.execute(clear_closure_stmt)
+    conn.execute(rebuild_closure_stmt)
+    conn.execute(insert(Person), [{
+        'id': f'per-{i:08d}', 'registration_number': i, 'membership_id': str(i), 'name': f'Person {i}',
+        'membership_fee_category_id': 'benchmark', 'created_on': datetime.datetime.now(), 'created_by': 'benchmark',
+    } for i in range(memberships)])
+    conn.execute(insert(Membership), [{
+        'id': f'mem-{i:08d}', 'person_id': f'per-{i:08d}', 'organization_id': rng.choice(ids), 'active_flag': 'Y',
+        'event_date': datetime.date(2020, 1, 1), 'created_on': datetime.datetime.now(), 'created_by': 'benchmark',
+    } for i in range(memberships)])
+    return ids
+
+
+def measure(engine: Engine, name: str, make_stmt: Callable[[str], Select], targets: List[str], repeat: int) -> None:
+    with engine.connect() as conn:
+        rows = sum(len(conn.execute(make_stmt(target)).all()) for target in targets)
+
+        def run() -> None:
+            for target in targets:
+                conn.execute(make_stmt(target)).all()
+
+        elapsed = min(timeit.repeat(run, number=1, repeat=repeat))
+    print(f'{name:<40} {elapsed / len(targets) * 1000:10.3f} ms/query {rows // len(targets):10d} rows/query')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--organizations', type=int, default=5000)
+    parser.add_argument('--depth', type=int, default=200)
+    parser.add_argument('--memberships', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    engine: Engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        ids = build_tree(conn, args.organizations, args.depth, args.memberships, random.Random(args.seed))
+        closure_rows = conn.execute(select(OrganizationClosure.depth)).all()
+    print(f'{len(ids)} organizations, depth {args.depth}, {len(closure_rows)} closure rows')
+
+    targets = {'root': ids[:1], 'mid-chain': ids[1 + args.depth // 2::args.depth][:10]}
+    for label, target_ids in targets.items():
+        print(f'-- subtree of {label} nodes')
+        measure(
+            engine, 'closure table', lambda pk: query_organization_subtree.where(
+                OrganizationClosure.ancestor_id == pk
+            ), target_ids, args.repeat
+        )
+        measure(engine, 'recursive CTE', recursive_subtree, target_ids, args.repeat)
+        print(f'-- descendant memberships of {label} nodes')
+        measure(
+            engine, 'closure table', lambda pk: query_organization_descendant_membership.where(
+                OrganizationClosure.ancestor_id == pk
+            ), target_ids, args.repeat
+        )
+        measure(engine, 'recursive CTE', recursive_descendant_membership, target_ids, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
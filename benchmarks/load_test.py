@@ -0,0 +1,298 @@
+"""
+Load test of the Sanic `app` from `server.py` against a temporary SQLite database filled by `generate_dataset`.
+
+Starts the server in a subprocess, drives a weighted mix of requests from an asyncio load generator with keep-alive
+connections and reports throughput, p50/p95/p99 latency and SQL statements per request (scraped from `/metrics`).
+Results are written as JSON so runs on different commits can be compared with `--baseline`.
+
+Usage: python -m benchmarks.load_test --duration 30 --concurrency 32 --output results.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.generate_dataset import generate_dataset, organization_id, person_id
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from typing import Any, Dict, List, Optional, Tuple
+
+REPO_ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIX: str = "people_list=25,person=30,organization=20,mappings=15,person_patch=10"
+
+
+class HttpClient:
+    """
+    Minimal HTTP/1.1 keep-alive client, enough for the JSON responses of the app.
+    """
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host: str = host
+        self.port: int = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(
+            self, method: str, path: str, body: Optional[Any] = None, headers: Optional[Dict[str, str]] = None
+    ) -> Tuple[int, bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload: bytes = json.dumps(body).encode() if body is not None else b''
+        head: List[str] = [f'{method} {path} HTTP/1.1', f'Host: {self.host}', f'Content-Length: {len(payload)}']
+        if body is not None:
+            head.append('Content-Type: application/json')
+        head += [f'{key}: {value}' for key, value in (headers or {}).items()]
+        self.writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + payload)
+        await self.writer.drain()
+        status_line: bytes = await self.reader.readline()
+        if not status_line:
+            await self.close()
+            raise ConnectionError('Connection closed by server')
+        status: int = int(status_line.split()[1])
+        length: int = 0
+        chunked: bool = False
+        keep_alive: bool = True
+        while True:
+            line: bytes = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+            elif name.lower() == 'transfer-encoding' and value.strip().lower() == 'chunked':
+                chunked = True
+            elif name.lower() == 'connection' and value.strip().lower() == 'close':
+                keep_alive = False
+        if chunked:
+            data: bytes = await self.read_chunks()
+        else:
+            data: bytes = await self.reader.readexactly(length) if length else b''
+        if not keep_alive:
+            await self.close()
+        return status, data
+
+    async def read_chunks(self) -> bytes:
+        # Streamed responses: "<size in hex>\r\n<data>\r\n" until a chunk of size 0 and an empty trailer
+        chunks: List[bytes] = []
+        while True:
+            size: int = int((await self.reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                await self.reader.readline()
+                return b''.join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readexactly(2)
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer, self.reader = None, None
+
+
+def make_request(operation: str, ids: Dict[str, List[str]], rng: random.Random) -> Tuple[str, str, Optional[Any]]:
+    if operation == 'people_list':
+        return 'GET', f'/people?page={rng.randrange(max(len(ids["person"]) // 20, 1))}', None
+    if operation == 'person':
+        return 'GET', f'/people/{rng.choice(ids["person"])}', None
+    if operation == 'organization':
+        return 'GET', f'/organizations/{rng.choice(ids["organization"])}', None
+    if operation == 'mappings':
+        return 'GET', '/mappings', None
+    if operation == 'person_patch':
+        body = {'person': {'notes': f'load test {rng.random()}'}, 'address': [], 'email': [], 'phone': [],
+                'membership': []}
+        return 'PATCH', f'/people/{rng.choice(ids["person"])}', body
+    raise ValueError(f'Unknown operation: {operation}')
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    return {name: float(weight) for name, weight in (item.split('=') for item in mix.split(','))}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered: List[float] = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def scrape_statements(text: str) -> Dict[str, Tuple[float, float]]:
+    """
+    Sum and count of `db_statements_per_request` per method and route from a `/metrics` scrape.
+    """
+    series: Dict[str, List[float]] = {}
+    for match in re.finditer(r'^db_statements_per_request_(sum|count)\{method="(\w+)",route="([^"]+)"\} (\S+)$',
+                             text, re.MULTILINE):
+        kind, method, route, value = match.groups()
+        if route == '/metrics':
+            continue
+        series.setdefault(f'{method} {route}', [0.0, 0.0])[kind == 'count'] = float(value)
+    return {key: (value[0], value[1]) for key, value in series.items()}
+
+
+async def worker(
+        client: HttpClient, mix: Dict[str, float], ids: Dict[str, List[str]], deadline: float, rng: random.Random,
+        latencies: Dict[str, List[float]], errors: Dict[str, int]
+) -> None:
+    operations: List[str] = list(mix)
+    weights: List[float] = list(mix.values())
+    while time.perf_counter() < deadline:
+        operation: str = rng.choices(operations, weights)[0]
+        method, path, body = make_request(operation, ids, rng)
+        started: float = time.perf_counter()
+        try:
+            status, _ = await client.request(method, path, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            status = 599
+        latencies.setdefault(operation, []).append(time.perf_counter() - started)
+        if status >= 400:
+            errors[operation] = errors.get(operation, 0) + 1
+    await client.close()
+
+
+async def run_load(args: argparse.Namespace, port: int, ids: Dict[str, List[str]]) -> Dict[str, Any]:
+    mix: Dict[str, float] = parse_mix(args.mix)
+    metrics_client = HttpClient('127.0.0.1', port)
+    _, before = await metrics_client.request('GET', '/metrics')
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    started: float = time.perf_counter()
+    deadline: float = started + args.duration
+    await asyncio.gather(*(
+        worker(HttpClient('127.0.0.1', port), mix, ids, deadline, random.Random(args.seed + i), latencies, errors)
+        for i in range(args.concurrency)
+    ))
+    elapsed: float = time.perf_counter() - started
+    _, after = await metrics_client.request('GET', '/metrics')
+    await metrics_client.close()
+
+    statements_before = scrape_statements(before.decode())
+    statements: Dict[str, float] = {}
+    for key, (total, count) in scrape_statements(after.decode()).items():
+        previous_total, previous_count = statements_before.get(key, (0.0, 0.0))
+        if count > previous_count:
+            statements[key] = round((total - previous_total) / (count - previous_count), 2)
+
+    total_requests: int = sum(len(values) for values in latencies.values())
+    return {
+        'throughput_rps': round(total_requests / elapsed, 1),
+        'requests': total_requests,
+        'errors': errors,
+        'operations': {
+            operation: {
+                'requests': len(values),
+                'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+            } for operation, values in sorted(latencies.items())
+        },
+        'statements_per_request': statements,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_server(port: int, timeout: float = 30) -> None:
+    deadline: float = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            client = HttpClient('127.0.0.1', port)
+            await client.request('GET', '/metrics')
+            await client.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise TimeoutError('Server did not start')
+
+
+def git_commit() -> str:
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True)
+    return result.stdout.strip()
+
+
+def print_report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    def delta(current: float, previous: Optional[float]) -> str:
+        if not previous:
+            return ''
+        return f' ({(current - previous) / previous * 100:+.1f}%)'
+
+    base_operations: Dict[str, Any] = baseline['results']['operations'] if baseline else {}
+    base_throughput: Optional[float] = baseline['results']['throughput_rps'] if baseline else None
+    print(f'throughput: {results["throughput_rps"]} req/s{delta(results["throughput_rps"], base_throughput)}, '
+          f'errors: {results["errors"] or 0}')
+    for operation, row in results['operations'].items():
+        previous: Dict[str, float] = base_operations.get(operation, {})
+        print(f'{operation:<14} n={row["requests"]:<7} ' + ' '.join(
+            f'{key}={row[key]:.2f}{delta(row[key], previous.get(key))}' for key in ('p50_ms', 'p95_ms', 'p99_ms')
+        ))
+    for route, value in sorted(results['statements_per_request'].items()):
+        print(f'{route:<40} {value} statements/request')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'weighted operations, default: {DEFAULT_MIX}')
+    parser.add_argument('--people', type=int, default=10000)
+    parser.add_argument('--organizations', type=int, default=500)
+    parser.add_argument('--contacts', type=int, default=30000)
+    parser.add_argument('--memberships', type=int, default=30000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path: str = os.path.join(tmp_dir, 'load_test.db')
+        engine: Engine = create_engine(f'sqlite:///{db_path}')
+        generate_dataset(engine, args.people, args.organizations, args.contacts, args.memberships, seed=args.seed)
+        ids: Dict[str, List[str]] = {
+            'person': [person_id(i) for i in range(args.people)],
+            'organization': [organization_id(i) for i in range(args.organizations)],
+        }
+        engine.dispose()
+
+        port: int = free_port()
+        env: Dict[str, str] = {**os.environ, 'DATABASE_URL': f'sqlite+aiosqlite:///{db_path}', 'SQL_ECHO': 'N'}
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'sanic', 'server.app', '--host', '127.0.0.1', '--port', str(port),
+             '--workers', str(args.workers), '--no-access-logs'],
+            cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            asyncio.run(wait_for_server(port))
+            results: Dict[str, Any] = asyncio.run(run_load(args, port, ids))
+        finally:
+            server.terminate()
+            server.wait()
+
+    report: Dict[str, Any] = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'results': results,
+    }
+    baseline: Optional[Dict[str, Any]] = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Measures the per-request cost of the instrumentation in `metrics`: the request/response middleware pair and the
+cursor execute hooks, against the same statements executed on an uninstrumented engine.
+
+Usage: python -m benchmarks.metrics_overhead --requests 2000 --statements 10 --repeat 5
+"""
+import argparse
+import asyncio
+import metrics
+import time
+from models.models import Base, Gender
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from types import SimpleNamespace
+
+
+async def run_requests(engine: AsyncEngine, requests: int, statements: int, instrumented: bool) -> float:
+    stmt = select(Gender.id).where(Gender.id == 'missing')
+    route = SimpleNamespace(path='people/<pk:str>')
+    started: float = time.perf_counter()
+    async with engine.connect() as conn:
+        for _ in range(requests):
+            request = SimpleNamespace(ctx=SimpleNamespace(), route=route, method='GET')
+            if instrumented:
+                await metrics.start_request_metrics(request)
+            for _ in range(statements):
+                await conn.execute(stmt)
+            if instrumented:
+                await metrics.record_request_metrics(request, SimpleNamespace(body=b'{}', status=200))
+    return time.perf_counter() - started
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--statements', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    plain: AsyncEngine = create_async_engine('sqlite+aiosqlite://')
+    instrumented: AsyncEngine = create_async_engine('sqlite+aiosqlite://')
+    metrics.instrument_engine(instrumented)
+    for engine in (plain, instrumented):
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    # Warm up connections and statement caches before measuring
+    await run_requests(plain, 100, args.statements, False)
+    await run_requests(instrumented, 100, args.statements, True)
+    # Alternate the runs and keep the best of each so thread scheduling noise does not dominate the difference
+    baseline: float = float('inf')
+    measured: float = float('inf')
+    for _ in range(args.repeat):
+        baseline = min(baseline, await run_requests(plain, args.requests, args.statements, False))
+        measured = min(measured, await run_requests(instrumented, args.requests, args.statements, True))
+
+    overhead_us: float = (measured - baseline) / args.requests * 1e6
+    print(f'uninstrumented: {baseline / args.requests * 1e6:9.1f} us/request')
+    print(f'instrumented:   {measured / args.requests * 1e6:9.1f} us/request')
+    print(f'overhead:       {overhead_us:9.1f} us/request ({overhead_us / args.statements:.2f} us/statement)')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+"""
+Measures the per-request CPU time of the person detail reads: the ten statements built with `.where()` and executed
+through the session on every request, against the prepared queries executing their compiled form.
+
+Usage: python -m benchmarks.prepared_statements --requests 2000 --repeat 5
+"""
+import argparse
+import asyncio
+import models.models as m
+import queries.queries as q
+import time
+from models.models import Base
+from queries.prepared import fetch, prepare_queries
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+
+
+async def run_requests(engine: AsyncEngine, requests: int, prepared: bool) -> float:
+    started: float = time.perf_counter()
+    for i in range(requests):
+        pk: str = f'person-{i:012d}'
+        async with AsyncSession(engine) as session:
+            async with session.begin():
+                if prepared:
+                    for stmt in (
+                        q.prepared_person(pk=pk), q.prepared_person_address(pk=pk), q.prepared_person_email(pk=pk),
+                        q.prepared_person_phone(pk=pk), q.prepared_person_membership(pk=pk), q.prepared_gender(),
+                        q.prepared_membership_fee_category(), q.prepared_address_type(), q.prepared_email_type(),
+                        q.prepared_phone_type(),
+                    ):
+                        (await fetch(session, stmt)).all()
+                else:
+                    for stmt in (
+                        q.query_person.where(m.Person.id == pk),
+                        q.query_person_address.where(m.Address.person_id == pk),
+                        q.query_person_email.where(m.Email.person_id == pk),
+                        q.query_person_phone.where(m.Phone.person_id == pk),
+                        q.query_person_membership.where(m.Membership.person_id == pk),
+                        q.query_gender, q.query_membership_fee_category, q.query_address_type, q.query_email_type,
+                        q.query_phone_type,
+                    ):
+                        (await session.execute(stmt)).all()
+    return time.perf_counter() - started
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    engine: AsyncEngine = create_async_engine('sqlite+aiosqlite://')
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    prepare_queries(engine)
+
+    # Warm up the connection and the statement cache, so the baseline is measured at steady state
+    await run_requests(engine, 100, False)
+    await run_requests(engine, 100, True)
+    # Alternate the runs and keep the best of each so thread scheduling noise does not dominate the difference
+    baseline: float = float('inf')
+    measured: float = float('inf')
+    for _ in range(args.repeat):
+        baseline = min(baseline, await run_requests(engine, args.requests, False))
+        measured = min(measured, await run_requests(engine, args.requests, True))
+
+    saved_us: float = (baseline - measured) / args.requests * 1e6
+    print(f'built per request: {baseline / args.requests * 1e6:9.1f} us/request')
+    print(f'prepared:          {measured / args.requests * 1e6:9.1f} us/request')
+    print(f'saved:             {saved_us:9.1f} us/request ({saved_us / 10:.2f} us/statement)')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,198 @@
+import os
+import time
+from collections import OrderedDict
+from functools import wraps
+from metrics import registry
+from sanic.request import Request
+from sanic.response import raw, HTTPResponse
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Set
+
+
+class CacheEntry:
+    __slots__ = ('body', 'content_type', 'tags', 'expires')
+
+    def __init__(self, body: bytes, content_type: str, tags: Set[str], expires: float) -> None:
+        self.body: bytes = body
+        self.content_type: str = content_type
+        self.tags: Set[str] = tags
+        self.expires: float = expires
+
+
+class ResponseCache:
+    """
+    In-process LRU cache of serialized responses, bounded by entry count and total body size, with a TTL as a
+    safety net. Every entry carries tags naming the rows it was built from (`person:<id>`, `address:<id>`, ...);
+    invalidating a tag drops every entry built from that row.
+
+    A response computed while one of its tags was invalidated is not stored, so a read racing with a write never
+    puts stale data back into the cache. Each worker process holds its own cache.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float) -> None:
+        self.max_entries: int = max_entries
+        self.max_bytes: int = max_bytes
+        self.ttl: float = ttl
+        self.entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self.tags: Dict[str, Set[str]] = {}
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.invalidations: int = 0
+        self.generation: int = 0
+        self._tag_generations: Dict[str, int] = {}
+        self._generation_floor: int = 0
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        entry: Optional[CacheEntry] = self.entries.get(key)
+        if entry is not None and entry.expires < time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(self, key: str, body: bytes, content_type: str, tags: Set[str], generation: int) -> None:
+        """
+        Stores a response unless one of its tags was invalidated after `generation`, the value of `self.generation`
+        read before the response was computed.
+        """
+        if not self.max_entries or len(body) > self.max_bytes:
+            return
+        if generation < self._generation_floor or any(
+                self._tag_generations.get(tag, 0) > generation for tag in tags
+        ):
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = CacheEntry(body, content_type, tags, time.monotonic() + self.ttl)
+        self.size += len(body)
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(key)
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def invalidate(self, tags: Iterable[str]) -> None:
+        self.generation += 1
+        for tag in tags:
+            self._tag_generations[tag] = self.generation
+            for key in self.tags.pop(tag, ()):
+                if key in self.entries:
+                    self._remove(key)
+                    self.invalidations += 1
+        # Forgetting old tag generations is safe as long as responses started before the cut are not stored
+        if len(self._tag_generations) > 10000:
+            self._tag_generations.clear()
+            self._generation_floor = self.generation
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._generation_floor = self.generation
+        self._tag_generations.clear()
+        self.entries.clear()
+        self.tags.clear()
+        self.size = 0
+
+    def _remove(self, key: str) -> None:
+        entry: CacheEntry = self.entries.pop(key)
+        self.size -= len(entry.body)
+        for tag in entry.tags:
+            keys: Optional[Set[str]] = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 10000)),
+    max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    ttl=float(os.environ.get("RESPONSE_CACHE_TTL", 300)),
+)
+
+registry.counter('response_cache_requests_total', 'Cacheable requests by cache result.', lambda: {
+    (('result', 'hit'),): response_cache.hits, (('result', 'miss'),): response_cache.misses
+})
+registry.counter('response_cache_evictions_total', 'Entries evicted to stay within the size limits.', lambda: {
+    (): response_cache.evictions
+})
+registry.counter('response_cache_invalidations_total', 'Entries dropped by write invalidation.', lambda: {
+    (): response_cache.invalidations
+})
+registry.gauge('response_cache_entries', 'Responses held by the response cache.', lambda: {
+    (): len(response_cache.entries)
+})
+registry.gauge('response_cache_bytes', 'Body bytes held by the response cache.', lambda: {(): response_cache.size})
+
+
+def row_tags(prefix: str, rows: Iterable[Mapping[str, Any]], column: str = 'id') -> List[str]:
+    """
+    Tags of the rows a response was built from.
+
+    :param prefix: tag prefix, the table name
+    :param rows: result rows as mappings
+    :param column: key of the referenced id in the rows
+    :return: list of `<prefix>:<id>` tags
+    """
+    return [f'{prefix}:{row[column]}' for row in rows if row.get(column) is not None]
+
+
+def owner_tags(row: Mapping[str, Any]) -> List[str]:
+    """
+    Tags of the person and organization a contact or membership row belongs to.
+    """
+    return row_tags('person', [row], 'person_id') + row_tags('organization', [row], 'organization_id')
+
+
+def invalidate(session: AsyncSession, *tags: str) -> None:
+    """
+    Schedules the invalidation of the cache entries tagged with `tags` when the current transaction commits.
+
+    :param session: `AsyncSession` object with an open transaction
+    :param tags: tags of the written rows
+    """
+    session.sync_session.info.setdefault('cache_tags', set()).update(tags)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session: Session) -> None:
+    tags: Optional[Set[str]] = session.info.pop('cache_tags', None)
+    if tags:
+        response_cache.invalidate(tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session: Session) -> None:
+    session.info.pop('cache_tags', None)
+
+
+def cached_response(handler: Callable) -> Callable:
+    """
+    View decorator serving GET requests from the response cache. Handlers opt in to caching a response by setting
+    `request.ctx.cache_tags` to the tags of the rows it was built from. Operations of a batch bypass the cache, they
+    may read uncommitted writes of their transaction.
+    """
+    @wraps(handler)
+    async def wrapped_handler(request: Request, *args, **kwargs) -> HTTPResponse:
+        if request.method != 'GET' or getattr(request.ctx, 'in_batch', False):
+            return await handler(request, *args, **kwargs)
+        key: str = f'{request.path}?{request.query_string}' if request.query_string else request.path
+        entry: Optional[CacheEntry] = response_cache.get(key)
+        if entry is not None:
+            return raw(entry.body, content_type=entry.content_type, headers={'X-Cache': 'HIT'})
+        generation: int = response_cache.generation
+        response: HTTPResponse = await handler(request, *args, **kwargs)
+        tags: Optional[Set[str]] = getattr(request.ctx, 'cache_tags', None)
+        if response.status == 200 and tags is not None:
+            response_cache.set(key, response.body, response.content_type, tags, generation)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    return wrapped_handler
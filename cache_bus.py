@@ -0,0 +1,140 @@
+import asyncio
+import datetime
+import os
+import time
+from cache import response_cache
+from metrics import registry
+from models.models import CacheInvalidation
+from sanic import Sanic
+from sanic.log import logger
+from sqlalchemy import bindparam, delete, event, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import Delete
+from sqlalchemy.sql.selectable import Select
+from typing import Optional, Set
+
+query_new_invalidations: Select = select(CacheInvalidation.id, CacheInvalidation.tag).where(
+    CacheInvalidation.id > bindparam('last_id'), CacheInvalidation.origin != bindparam('origin')
+).order_by(CacheInvalidation.id)
+
+query_last_invalidation_id: Select = select(func.coalesce(func.max(CacheInvalidation.id), 0))
+
+prune_invalidations_stmt: Delete = delete(CacheInvalidation).where(
+    CacheInvalidation.created_on < bindparam('cutoff')
+).execution_options(synchronize_session=False)
+
+
+class InvalidationBus:
+    """
+    Cross-worker cache invalidation through the database. Writes publish their cache tags into the
+    `cache_invalidation` table in the same transaction, and every worker polls the rows other workers added since its
+    last poll every `interval` seconds, so a committed write reaches the caches of all workers within one interval
+    (the writing worker has already applied it on commit). Rows older than `retention` seconds are pruned; a worker
+    that could not poll for that long drops its whole cache instead.
+    """
+
+    def __init__(self, interval: float, retention: float) -> None:
+        self.interval: float = interval
+        self.retention: float = retention
+        self.last_id: int = 0
+        self.last_poll: float = 0.0
+        self.received: int = 0
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self, engine: AsyncEngine) -> None:
+        async with engine.connect() as conn:
+            self.last_id = (await conn.execute(query_last_invalidation_id)).scalar()
+        self.last_poll = time.monotonic()
+        self.task = asyncio.get_running_loop().create_task(self.run(engine))
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def poll(self, engine: AsyncEngine) -> None:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(query_new_invalidations, {'last_id': self.last_id, 'origin': os.getpid()})).all()
+            if not rows and self.last_id and (await conn.execute(query_last_invalidation_id)).scalar() < self.last_id:
+                # A table created without AUTOINCREMENT reuses the ids once pruning emptied it, start over
+                self.last_id = 0
+                rows = (await conn.execute(query_new_invalidations, {'last_id': 0, 'origin': os.getpid()})).all()
+        now: float = time.monotonic()
+        if now - self.last_poll > self.retention:
+            response_cache.clear()
+        elif rows:
+            tags: Set[str] = {row.tag for row in rows}
+            response_cache.invalidate(tags)
+            self.received += len(tags)
+        if rows:
+            self.last_id = rows[-1].id
+        self.last_poll = now
+
+    async def prune(self, engine: AsyncEngine) -> None:
+        cutoff: datetime.datetime = datetime.datetime.now() - datetime.timedelta(seconds=self.retention)
+        async with engine.begin() as conn:
+            await conn.execute(prune_invalidations_stmt, {'cutoff': cutoff})
+
+    async def run(self, engine: AsyncEngine) -> None:
+        polls_per_prune: int = max(int(self.retention / 2 / self.interval), 1)
+        polls: int = 0
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll(engine)
+                polls += 1
+                if polls % polls_per_prune == 0:
+                    await self.prune(engine)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Cache invalidation poll failed: %s", e)
+
+
+invalidation_bus = InvalidationBus(
+    interval=float(os.environ.get("CACHE_BUS_INTERVAL_MS", 500)) / 1000,
+    retention=float(os.environ.get("CACHE_BUS_RETENTION", 60)),
+)
+
+registry.counter('cache_bus_invalidations_total', 'Cache tags received from writes of any worker.', lambda: {
+    (): invalidation_bus.received
+})
+
+
+@event.listens_for(Session, 'before_commit')
+def _publish_invalidations(session: Session) -> None:
+    tags: Optional[Set[str]] = session.info.get('cache_tags')
+    if tags and invalidation_bus.interval:
+        now: datetime.datetime = datetime.datetime.now()
+        session.execute(insert(CacheInvalidation), [
+            {'tag': tag, 'origin': os.getpid(), 'created_on': now} for tag in tags
+        ])
+
+
+def connect_invalidation_bus(app: Sanic, engine: AsyncEngine) -> None:
+    """
+    Creates the invalidation table once in the main process and runs the poller in every worker. Setting
+    `CACHE_BUS_INTERVAL_MS` to 0 disables the bus for single worker deployments.
+
+    :param app: `Sanic` application
+    :param engine: `AsyncEngine` object used by the application
+    """
+    if not invalidation_bus.interval:
+        return
+
+    async def create_invalidation_table(app: Sanic, loop) -> None:
+        async with engine.begin() as conn:
+            await conn.run_sync(CacheInvalidation.__table__.create, checkfirst=True)
+        # Workers are forked after this point and must not inherit pooled connections
+        await engine.dispose()
+
+    async def start_invalidation_bus(app: Sanic, loop) -> None:
+        await invalidation_bus.start(engine)
+
+    async def stop_invalidation_bus(app: Sanic, loop) -> None:
+        await invalidation_bus.stop()
+
+    app.register_listener(create_invalidation_table, "main_process_start")
+    app.register_listener(start_invalidation_bus, "after_server_start")
+    app.register_listener(stop_invalidation_bus, "before_server_stop")
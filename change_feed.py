@@ -0,0 +1,124 @@
+import datetime
+import models.models as m
+import sys
+from sqlalchemy import bindparam, create_engine, event, func, insert, select
+from sqlalchemy.engine import Result
+from sanic import Sanic
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.selectable import Select
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# Tables published in the change feed, keyed by the entity name used in the feed
+ENTITY_MODELS: Dict[str, Any] = {
+    model.__tablename__: model for model in (
+        m.Gender, m.MembershipFeeCategory, m.AddressType, m.PhoneType, m.EmailType, m.Person, m.Organization,
+        m.Address, m.Email, m.Phone, m.Membership,
+    )
+}
+
+query_change_head: Select = select(func.coalesce(func.max(m.ChangeLog.id), 0))
+
+query_changes: Select = select(m.ChangeLog.id, m.ChangeLog.entity, m.ChangeLog.entity_id).where(
+    m.ChangeLog.id > bindparam('since')
+).order_by(m.ChangeLog.id).limit(bindparam('limit'))
+
+
+def record_changes(session: AsyncSession, entity: str, *ids: str) -> None:
+    """
+    Records rows written with Core statements in the change log when the current transaction commits. Rows inserted
+    through the ORM are recorded automatically.
+
+    :param session: `AsyncSession` object with an open transaction
+    :param entity: table name of the written rows
+    :param ids: primary keys of the written rows
+    """
+    session.sync_session.info.setdefault('changes', set()).update((entity, pk) for pk in ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed_changes(session: Session, flush_context) -> None:
+    changes: Set[Tuple[str, str]] = {
+        (instance.__tablename__, instance.id)
+        for instance in (*session.new, *session.dirty)
+        if getattr(instance, '__tablename__', None) in ENTITY_MODELS
+    }
+    if changes:
+        session.info.setdefault('changes', set()).update(changes)
+
+
+@event.listens_for(Session, 'before_commit')
+def _write_change_log(session: Session) -> None:
+    # Pending objects are flushed after this hook, flush them now so their ids are known
+    session.flush()
+    changes: Optional[Set[Tuple[str, str]]] = session.info.pop('changes', None)
+    if changes:
+        now: datetime.datetime = datetime.datetime.now()
+        session.execute(insert(m.ChangeLog), [
+            {'entity': entity, 'entity_id': pk, 'created_on': now} for entity, pk in sorted(changes)
+        ])
+        session.info['changes_written'] = True
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session: Session) -> None:
+    session.info.pop('changes', None)
+    session.info.pop('changes_written', None)
+
+
+async def load_changes(session: AsyncSession, since: int, limit: int) -> Dict[str, Any]:
+    """
+    Collects the current state of the rows changed after the `since` token, grouped by entity. Rows changed several
+    times are returned once; rows that no longer match their recorded id are left out.
+
+    :param session: `AsyncSession` object without an open transaction
+    :param since: token returned by the previous call, 0 for the whole log
+    :param limit: maximum number of change log entries consumed by one call
+    :return: dict with the next token, whether more changes are pending, and the changed rows per entity
+    """
+    async with session.begin():
+        entries: List[Any] = (await session.execute(query_changes, {'since': since, 'limit': limit + 1})).all()
+        has_more: bool = len(entries) > limit
+        entries = entries[:limit]
+        ids: Dict[str, Set[str]] = {}
+        for entry in entries:
+            ids.setdefault(entry.entity, set()).add(entry.entity_id)
+        changes: Dict[str, List[Dict[str, Any]]] = {}
+        for entity, entity_ids in sorted(ids.items()):
+            model = ENTITY_MODELS[entity]
+            result: Result = await session.execute(model.select_columns().where(model.id.in_(entity_ids)))
+            changes[entity] = model.row_dicts(result)
+    return {
+        'token': str(entries[-1].id if entries else since),
+        'has_more': has_more,
+        'changes': changes,
+    }
+
+
+async def change_head(session: AsyncSession) -> str:
+    """
+    Token of the latest change, the starting point of clients that have just downloaded the full data.
+    """
+    async with session.begin():
+        return str((await session.execute(query_change_head)).scalar())
+
+
+def connect_change_log(app: Sanic, engine: AsyncEngine) -> None:
+    """
+    Creates the change log table once in the main process, before any worker commits a write.
+
+    :param app: `Sanic` application
+    :param engine: `AsyncEngine` object used by the application
+    """
+    async def create_change_log_table(app: Sanic, loop) -> None:
+        async with engine.begin() as conn:
+            await conn.run_sync(m.ChangeLog.__table__.create, checkfirst=True)
+        # Workers are forked after this point and must not inherit pooled connections
+        await engine.dispose()
+
+    app.register_listener(create_change_log_table, "main_process_start")
+
+
+if __name__ == '__main__':
+    db_engine = create_engine(sys.argv[1] if len(sys.argv) > 1 else "sqlite:///dev.db")
+    m.ChangeLog.__table__.create(bind=db_engine, checkfirst=True)
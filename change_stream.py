@@ -0,0 +1,191 @@
+import asyncio
+import json
+import models.models as m
+import os
+from change_feed import query_change_head, query_changes
+from metrics import registry
+from sanic import Sanic
+from sanic.log import logger
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+# Entities whose rows belong to an organization, used by the organization filter of the subscriptions
+ORGANIZATION_COLUMNS: Dict[str, Any] = {
+    'address': m.Address, 'email': m.Email, 'phone': m.Phone, 'membership': m.Membership,
+}
+
+POLL_BATCH: int = 1000
+
+# (version, entity, id, organization id)
+ChangeEvent = Tuple[int, str, str, Optional[str]]
+
+
+class Subscriber:
+    """
+    A websocket client of the change stream with its filters and a bounded send queue. When the client cannot keep
+    up and the queue fills, the queued events are replaced with a single reset message carrying the last version
+    the client was sent; the client then catches up through `/changes?since=<version>`.
+    """
+
+    def __init__(self, entities: FrozenSet[str], organizations: FrozenSet[str], queue_size: int) -> None:
+        self.entities: FrozenSet[str] = entities
+        self.organizations: FrozenSet[str] = organizations
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.sent_version: int = 0
+
+    def matches(self, change: ChangeEvent) -> bool:
+        _, entity, _, organization_id = change
+        return (not self.entities or entity in self.entities) and (
+            not self.organizations or organization_id in self.organizations
+        )
+
+    def push(self, change: ChangeEvent) -> bool:
+        """
+        Queues an event without waiting.
+
+        :return: False when the queue overflowed and was reset
+        """
+        try:
+            self.queue.put_nowait({'entity': change[1], 'id': change[2], 'version': change[0]})
+            return True
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'type': 'reset', 'version': self.sent_version})
+            return False
+
+    async def send_all(self, ws) -> None:
+        while True:
+            message: Dict[str, Any] = await self.queue.get()
+            await ws.send(json.dumps(message, separators=(',', ':')))
+            if 'entity' in message:
+                self.sent_version = message['version']
+
+
+class ChangeStream:
+    """
+    Fans the change log out to the websocket subscribers of this worker. Every worker follows the change log, so
+    writes of all workers reach all clients; commits of this worker wake the poller right away, other workers are
+    picked up within `interval` seconds.
+    """
+
+    def __init__(self, interval: float, queue_size: int) -> None:
+        self.interval: float = interval
+        self.queue_size: int = queue_size
+        self.subscribers: Set[Subscriber] = set()
+        self.version: int = 0
+        self.sent: int = 0
+        self.resets: int = 0
+        self.task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    async def start(self, engine: AsyncEngine) -> None:
+        async with engine.connect() as conn:
+            self.version = (await conn.execute(query_change_head)).scalar()
+        self._wake = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self.run(engine))
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def wake(self) -> None:
+        if self._wake is not None:
+            self._wake.set()
+
+    async def poll(self, engine: AsyncEngine) -> None:
+        async with engine.connect() as conn:
+            while True:
+                rows = (await conn.execute(query_changes, {'since': self.version, 'limit': POLL_BATCH})).all()
+                if not rows:
+                    return
+                self.version = rows[-1].id
+                if self.subscribers:
+                    self.publish(await self._organizations(conn, rows), rows)
+                if len(rows) < POLL_BATCH:
+                    return
+
+    async def _organizations(self, conn, rows) -> Dict[Tuple[str, str], Optional[str]]:
+        # Organization of every changed row, looked up only when a subscriber filters by organization
+        organizations: Dict[Tuple[str, str], Optional[str]] = {}
+        if not any(subscriber.organizations for subscriber in self.subscribers):
+            return organizations
+        ids: Dict[str, Set[str]] = {}
+        for row in rows:
+            if row.entity == 'organization':
+                organizations[('organization', row.entity_id)] = row.entity_id
+            elif row.entity in ORGANIZATION_COLUMNS:
+                ids.setdefault(row.entity, set()).add(row.entity_id)
+        for entity, entity_ids in ids.items():
+            model = ORGANIZATION_COLUMNS[entity]
+            result = await conn.execute(select(model.id, model.organization_id).where(model.id.in_(entity_ids)))
+            organizations.update({(entity, pk): organization_id for pk, organization_id in result})
+        return organizations
+
+    def publish(self, organizations: Dict[Tuple[str, str], Optional[str]], rows) -> None:
+        changes: List[ChangeEvent] = [
+            (row.id, row.entity, row.entity_id, organizations.get((row.entity, row.entity_id))) for row in rows
+        ]
+        for subscriber in list(self.subscribers):
+            for change in changes:
+                if subscriber.matches(change):
+                    if subscriber.push(change):
+                        self.sent += 1
+                    else:
+                        self.resets += 1
+
+    async def run(self, engine: AsyncEngine) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.poll(engine)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Change stream poll failed: %s", e)
+
+
+change_stream = ChangeStream(
+    interval=float(os.environ.get("CHANGE_STREAM_INTERVAL_MS", 250)) / 1000,
+    queue_size=int(os.environ.get("CHANGE_STREAM_QUEUE_SIZE", 256)),
+)
+
+registry.gauge('change_stream_subscribers', 'Websocket clients subscribed to the change stream.', lambda: {
+    (): len(change_stream.subscribers)
+})
+registry.counter('change_stream_events_sent_total', 'Change events queued for websocket clients.', lambda: {
+    (): change_stream.sent
+})
+registry.counter('change_stream_resets_total', 'Send queue overflows of slow websocket clients.', lambda: {
+    (): change_stream.resets
+})
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_change_stream(session: Session) -> None:
+    if session.info.pop('changes_written', False):
+        change_stream.wake()
+
+
+def connect_change_stream(app: Sanic, engine: AsyncEngine) -> None:
+    """
+    Runs the change log poller of the change stream in every worker.
+
+    :param app: `Sanic` application
+    :param engine: `AsyncEngine` object used by the application
+    """
+    async def start_change_stream(app: Sanic, loop) -> None:
+        await change_stream.start(engine)
+
+    async def stop_change_stream(app: Sanic, loop) -> None:
+        await change_stream.stop()
+
+    app.register_listener(start_change_stream, "after_server_start")
+    app.register_listener(stop_change_stream, "before_server_stop")
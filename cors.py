@@ -10,7 +10,8 @@ def _add_cors_headers(response, methods: Iterable[str]) -> None:
         "Access-Control-Allow-Methods": ",".join(allow_methods),
         "Access-Control-Allow-Origin": os.environ.get("FRONTEND_HOSTNAME", ""),
         "Access-Control-Allow-Credentials": "false",
-        "Access-Control-Allow-Headers": "origin, content-type, accept, authorization, x-xsrf-token, x-request-id",
+        "Access-Control-Allow-Headers":
+            "origin, content-type, accept, authorization, x-xsrf-token, x-request-id, idempotency-key",
     }
     response.headers.extend(headers)
 
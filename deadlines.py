@@ -0,0 +1,145 @@
+import asyncio
+import os
+from admission import admission_controller
+from contextvars import ContextVar
+from functools import wraps
+from inspect import isawaitable
+from metrics import registry, route_label
+from sanic import Sanic
+from sanic.exceptions import SanicException
+from sanic.log import logger
+from sanic.request import Request
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from typing import Any, Callable, Dict, Optional, Set
+
+# Default time budget per route class in milliseconds, 0 disables the deadline of the class
+DEFAULT_DEADLINES_MS: Dict[str, int] = {'lookup': 5000, 'detail': 10000, 'write': 15000, 'export': 30000}
+
+# Time an interrupted handler gets to fail on its own before it is cancelled
+INTERRUPT_GRACE: float = 0.5
+
+
+class DeadlineExceeded(SanicException):
+    status_code = 504
+    quiet = True
+
+
+class Deadline:
+    """
+    Driver connections with a statement of the current request in flight. They are collected by the engine event
+    hooks, so the statements can be interrupted when the request runs out of time.
+    """
+    __slots__ = ('connections',)
+
+    def __init__(self) -> None:
+        self.connections: Set[Any] = set()
+
+    async def interrupt(self) -> None:
+        # sqlite3 interrupt is thread safe, aiosqlite calls it directly instead of queueing it behind the statement
+        for connection in list(self.connections):
+            await connection.interrupt()
+
+
+deadlines: Dict[str, float] = {
+    name: float(os.environ.get(f'DEADLINE_{name.upper()}_MS', value)) / 1000
+    for name, value in DEFAULT_DEADLINES_MS.items()
+}
+
+registry.counter('deadline_exceeded_total', 'Requests cancelled at their deadline per route.')
+
+_deadline_ctx: ContextVar[Optional[Deadline]] = ContextVar('deadline', default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    deadline: Optional[Deadline] = _deadline_ctx.get()
+    if deadline is not None:
+        deadline.connections.add(conn.connection.driver_connection)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    deadline: Optional[Deadline] = _deadline_ctx.get()
+    if deadline is not None:
+        deadline.connections.discard(conn.connection.driver_connection)
+
+
+def _handle_error(exception_context) -> None:
+    deadline: Optional[Deadline] = _deadline_ctx.get()
+    if deadline is not None and exception_context.connection is not None:
+        deadline.connections.discard(exception_context.connection.connection.driver_connection)
+
+
+def interrupt_on_deadline(engine: AsyncEngine) -> None:
+    """
+    Hooks deadline tracking into the engine, so statements running past the deadline of their request are
+    interrupted.
+
+    :param engine: `AsyncEngine` object used by the application
+    """
+    event.listen(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine.sync_engine, 'handle_error', _handle_error)
+
+
+async def _stop_handler(task: asyncio.Task, deadline: Deadline) -> None:
+    # An interrupted statement raises OperationalError, so the handler unwinds through its usual error path and the
+    # session rolls back cleanly. Cancelling a statement in flight would invalidate its connection instead.
+    await deadline.interrupt()
+    done, _ = await asyncio.wait({task}, timeout=INTERRUPT_GRACE)
+    if not done:
+        task.cancel()
+        await asyncio.wait({task})
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug("Handler stopped at its deadline: %s", task.exception())
+
+
+async def _run_handler(deadline: Deadline, handler: Callable, request: Request, args, kwargs) -> Any:
+    _deadline_ctx.set(deadline)
+    response = handler(request, *args, **kwargs)
+    if isawaitable(response):
+        response = await response
+    return response
+
+
+def with_deadline(handler: Callable) -> Callable:
+    """
+    Runs the handler as a separate task with the deadline of its route class. At the deadline, or when the client
+    disconnects, the SQLite statements of the request are interrupted and the handler is stopped; requests past
+    their deadline fail with 504.
+    """
+    @wraps(handler)
+    async def wrapped_handler(request: Request, *args, **kwargs):
+        route_class: Optional[str] = admission_controller.route_class(request)
+        timeout: float = deadlines.get(route_class, 0) if route_class is not None else 0
+        if not timeout:
+            response = handler(request, *args, **kwargs)
+            return await response if isawaitable(response) else response
+        deadline = Deadline()
+        task: asyncio.Task = asyncio.get_running_loop().create_task(
+            _run_handler(deadline, handler, request, args, kwargs)
+        )
+        # Sampled by the profiler of the request, the request task itself only waits for the handler
+        request.ctx.handler_task = task
+        try:
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+        except asyncio.CancelledError:
+            # The client went away, stop its work as well
+            await _stop_handler(task, deadline)
+            raise
+        if done:
+            return task.result()
+        await _stop_handler(task, deadline)
+        registry.inc('deadline_exceeded_total', (('method', request.method), ('route', route_label(request))))
+        raise DeadlineExceeded(f'Request exceeded its deadline of {timeout:g}s')
+
+    return wrapped_handler
+
+
+def apply_deadlines(app: Sanic, _) -> None:
+    """
+    Wraps every route handler except websockets with `with_deadline`. Registered after the listener adding the
+    OPTIONS routes.
+    """
+    for route in app.router.routes:
+        if not getattr(route.handler, 'is_websocket', False):
+            route.handler = with_deadline(route.handler)
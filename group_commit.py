@@ -0,0 +1,277 @@
+import asyncio
+import os
+from cache import response_cache
+from change_stream import change_stream
+from metrics import registry
+from sanic import Sanic
+from sanic.log import logger
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+from sqlalchemy.util import EMPTY_DICT
+from typing import List, Optional, Set
+
+
+class GroupAborted(Exception):
+    pass
+
+
+class _Turn:
+    """
+    Place of one `session.begin()` block in the queue of the writer.
+    """
+    __slots__ = ('granted', 'released', 'committed', 'tags')
+
+    def __init__(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.granted: asyncio.Future = loop.create_future()
+        self.released: asyncio.Future = loop.create_future()
+        self.committed: asyncio.Future = loop.create_future()
+        self.tags: Set[str] = set()
+
+    def release(self) -> None:
+        if not self.released.done():
+            self.released.set_result(None)
+
+
+class GroupCommitWriter:
+    """
+    Single writer applying the write transactions of concurrent requests in one SQLite transaction, so N requests
+    share one commit and one fsync instead of queueing for the write lock N times. Requests take turns on the
+    connection of the writer, each inside its own savepoint: a failing request rolls back its savepoint only, the
+    others are unaffected. The writer keeps serving the requests that queued up meanwhile, up to `max_batch`, then
+    commits; every request of the group is resolved once the commit is done, and fails when it fails.
+
+    Write requests of a worker are capped by the admission control of the write class, which also caps the size of
+    the groups; raise `ADMISSION_WRITE_CONCURRENCY` along with enabling group commit.
+    """
+
+    def __init__(self, enabled: bool, max_batch: int) -> None:
+        self.enabled: bool = enabled
+        self.max_batch: int = max_batch
+        self.queue: Optional[asyncio.Queue] = None
+        self.batches: int = 0
+        self.writes: int = 0
+        self.failures: int = 0
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self, engine: AsyncEngine) -> None:
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self.run(engine))
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self, engine: AsyncEngine) -> None:
+        while True:
+            turns: List[_Turn] = [await self.queue.get()]
+            try:
+                await self.apply(engine, turns)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Group commit failed: %s", e)
+                self.failures += 1
+                for turn in turns:
+                    turn.release()
+                    for future in (turn.granted, turn.committed):
+                        if not future.done():
+                            future.set_exception(e)
+            else:
+                self.batches += 1
+                self.writes += len(turns)
+                # The savepoints of the requests already invalidated their tags, before the data was committed
+                tags: Set[str] = set().union(*(turn.tags for turn in turns))
+                if tags:
+                    response_cache.invalidate(tags)
+                change_stream.wake()
+                for turn in turns:
+                    if not turn.committed.done():
+                        turn.committed.set_result(None)
+
+    async def apply(self, engine: AsyncEngine, turns: List[_Turn]) -> None:
+        async with engine.connect() as conn:
+            await conn.begin()
+            # pysqlite defers BEGIN to the first write; without it the release of the first savepoint would commit
+            await conn.exec_driver_sql('BEGIN IMMEDIATE')
+            while True:
+                await self._serve(conn, turns[-1])
+                if len(turns) >= self.max_batch or self.queue.empty():
+                    break
+                turns.append(self.queue.get_nowait())
+            await conn.commit()
+
+    @staticmethod
+    async def _serve(conn: AsyncConnection, turn: _Turn) -> None:
+        if turn.granted.cancelled():
+            turn.release()
+            return
+        savepoint = await conn.begin_nested()
+        turn.granted.set_result(conn)
+        await turn.released
+        if savepoint.is_active:
+            await savepoint.rollback()
+        # An interrupted statement makes SQLite roll back the whole transaction, taking the earlier turns with it
+        if not conn.sync_connection.connection.driver_connection.in_transaction:
+            raise GroupAborted("The group transaction was rolled back by SQLite")
+
+    async def turn(self) -> _Turn:
+        turn = _Turn()
+        self.queue.put_nowait(turn)
+        try:
+            await turn.granted
+        except asyncio.CancelledError:
+            turn.release()
+            raise
+        return turn
+
+
+group_commit_writer = GroupCommitWriter(
+    enabled=os.environ.get("GROUP_COMMIT", "N") == "Y",
+    max_batch=int(os.environ.get("GROUP_COMMIT_MAX_BATCH", 64)),
+)
+
+registry.counter('group_commit_batches_total', 'Group transactions committed by the writer.', lambda: {
+    (): group_commit_writer.batches
+})
+registry.counter('group_commit_writes_total', 'Request transactions committed in a group.', lambda: {
+    (): group_commit_writer.writes
+})
+registry.counter('group_commit_failures_total', 'Group transactions that failed to commit.', lambda: {
+    (): group_commit_writer.failures
+})
+registry.gauge('group_commit_queue_depth', 'Request transactions waiting for the writer.', lambda: {
+    (): group_commit_writer.queue.qsize() if group_commit_writer.queue is not None else 0
+})
+
+
+class _GroupCommitBlock:
+    """
+    `session.begin()` block of a write request. Reads run in a deferred transaction on a pooled connection of their
+    own, so a block that only reads never waits for the writer. The first write of the block, a DML statement or a
+    flush of pending objects, ends that read transaction and takes a turn of the writer; from then on the block runs
+    in a savepoint of the group transaction. Such a block is left once the group has committed, so the request sees
+    its writes committed just like with a transaction of its own.
+    """
+
+    def __init__(self, session: 'GroupCommitSession', **kw) -> None:
+        self.session: GroupCommitSession = session
+        self.kw = kw
+        self.turn: Optional[_Turn] = None
+        self.reads: Optional[AsyncConnection] = None
+        self.bind = session.sync_session.bind
+
+    async def __aenter__(self) -> '_GroupCommitBlock':
+        self.session.block = self
+        return self
+
+    async def read_connection(self) -> AsyncConnection:
+        if self.reads is None:
+            self.reads = await self.session.bind.connect()
+            await self.reads.begin()
+        return self.reads
+
+    async def take_turn(self) -> None:
+        # The read transaction must not hold the SQLite shared lock the commit of the group waits for
+        await self._end_reads()
+        self.turn = await group_commit_writer.turn()
+        try:
+            self.session.sync_session.bind = self.turn.granted.result().sync_connection
+            # Adding objects begins the transaction of the session already, it connects to the writer on first use
+            if not self.session.in_transaction():
+                await AsyncSession.begin(self.session, **self.kw)
+        except BaseException:
+            self._leave()
+            raise
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> bool:
+        try:
+            if self.turn is None and exc_type is None and self.session.has_pending_writes():
+                await self.take_turn()
+        finally:
+            self.session.block = None
+            await self._end_reads()
+        if self.turn is None:
+            return False
+        try:
+            self.turn.tags = set(self.session.sync_session.info.get('cache_tags', ()))
+            if exc_type is None:
+                await self.session.commit()
+            else:
+                await self.session.rollback()
+        except BaseException:
+            self.turn.committed.cancel()
+            raise
+        finally:
+            self._leave()
+        if exc_type is None:
+            await self.turn.committed
+        else:
+            self.turn.committed.cancel()
+        return False
+
+    async def _end_reads(self) -> None:
+        if self.reads is not None:
+            reads, self.reads = self.reads, None
+            await reads.close()
+
+    def _leave(self) -> None:
+        self.session.sync_session.bind = self.bind
+        self.turn.release()
+
+
+class GroupCommitSession(AsyncSession):
+    """
+    Session of write requests when group commit is enabled: the writes of its `session.begin()` blocks are applied
+    by the group commit writer, their reads run on a connection of their own.
+    """
+    block: Optional[_GroupCommitBlock] = None
+
+    def begin(self, **kw):
+        return _GroupCommitBlock(self, **kw)
+
+    def has_pending_writes(self) -> bool:
+        return bool(self.sync_session.new or self.sync_session.dirty or self.sync_session.deleted)
+
+    def _reading(self) -> bool:
+        return self.block is not None and self.block.turn is None
+
+    async def execute(self, statement, params=None, execution_options=EMPTY_DICT, **kw):
+        if self._reading():
+            if not getattr(statement, 'is_dml', False) and not self.has_pending_writes():
+                conn: AsyncConnection = await self.block.read_connection()
+                return await conn.execute(statement, params, execution_options=execution_options)
+            await self.block.take_turn()
+        return await super().execute(statement, params, execution_options=execution_options, **kw)
+
+    async def flush(self, objects=None) -> None:
+        if self._reading() and self.has_pending_writes():
+            await self.block.take_turn()
+        await super().flush(objects)
+
+    async def connection(self, **kw) -> AsyncConnection:
+        if self._reading() and not self.has_pending_writes():
+            return await self.block.read_connection()
+        if self._reading():
+            await self.block.take_turn()
+        return await super().connection(**kw)
+
+
+def connect_group_commit(app: Sanic, engine: AsyncEngine) -> None:
+    """
+    Runs the group commit writer in every worker when `GROUP_COMMIT` is enabled.
+
+    :param app: `Sanic` application
+    :param engine: `AsyncEngine` object used by the application
+    """
+    if not group_commit_writer.enabled:
+        return
+
+    async def start_group_commit(app: Sanic, loop) -> None:
+        await group_commit_writer.start(engine)
+
+    async def stop_group_commit(app: Sanic, loop) -> None:
+        await group_commit_writer.stop()
+
+    app.register_listener(start_group_commit, "after_server_start")
+    app.register_listener(stop_group_commit, "before_server_stop")
@@ -0,0 +1,133 @@
+import sys
+from models.models import Organization, OrganizationClosure
+from sanic import Sanic
+from sanic.exceptions import InvalidUsage
+from sqlalchemy import bindparam, create_engine, delete, insert, literal, select, union_all
+from sqlalchemy.engine import Result
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.sql.dml import Delete, Insert
+from sqlalchemy.sql.selectable import CTE, Select
+from typing import Optional
+
+closure_super = OrganizationClosure.__table__.alias('closure_super')
+closure_sub = OrganizationClosure.__table__.alias('closure_sub')
+
+# Self row of the new node plus one row for every ancestor of its parent
+insert_node_stmt: Insert = insert(OrganizationClosure).from_select(
+    ['ancestor_id', 'descendant_id', 'depth'],
+    union_all(
+        select(bindparam('organization_id'), bindparam('organization_id'), literal(0)),
+        select(
+            OrganizationClosure.ancestor_id, bindparam('organization_id'), OrganizationClosure.depth + 1
+        ).where(OrganizationClosure.descendant_id == bindparam('parent_id')),
+    )
+)
+
+subtree_ids: Select = select(OrganizationClosure.descendant_id).where(
+    OrganizationClosure.ancestor_id == bindparam('organization_id')
+)
+
+# Removes the links between the subtree of the node and its former ancestors, keeping the subtree itself intact
+detach_subtree_stmt: Delete = delete(OrganizationClosure).where(
+    OrganizationClosure.descendant_id.in_(subtree_ids),
+    OrganizationClosure.ancestor_id.not_in(subtree_ids),
+).execution_options(synchronize_session=False)
+
+# Links every ancestor of the new parent to every node of the subtree
+attach_subtree_stmt: Insert = insert(OrganizationClosure).from_select(
+    ['ancestor_id', 'descendant_id', 'depth'],
+    select(
+        closure_super.c.ancestor_id, closure_sub.c.descendant_id, closure_super.c.depth + closure_sub.c.depth + 1
+    ).select_from(
+        closure_super.join(closure_sub, closure_sub.c.ancestor_id == bindparam('organization_id'))
+    ).where(closure_super.c.descendant_id == bindparam('parent_id'))
+)
+
+query_is_descendant: Select = select(OrganizationClosure.depth).where(
+    OrganizationClosure.ancestor_id == bindparam('organization_id'),
+    OrganizationClosure.descendant_id == bindparam('parent_id'),
+)
+
+organization_tree: CTE = select(
+    Organization.id.label('ancestor_id'),
+    Organization.id.label('descendant_id'),
+    literal(0).label('depth'),
+).cte('organization_tree', recursive=True)
+organization_tree = organization_tree.union_all(
+    select(organization_tree.c.ancestor_id, Organization.id, organization_tree.c.depth + 1).join(
+        Organization, Organization.organization_parent_id == organization_tree.c.descendant_id
+    )
+)
+
+clear_closure_stmt: Delete = delete(OrganizationClosure).execution_options(synchronize_session=False)
+
+rebuild_closure_stmt: Insert = insert(OrganizationClosure).from_select(
+    ['ancestor_id', 'descendant_id', 'depth'],
+    select(organization_tree.c.ancestor_id, organization_tree.c.descendant_id, organization_tree.c.depth)
+)
+
+
+async def insert_organization_node(session: AsyncSession, organization_id: str, parent_id: Optional[str]) -> None:
+    """
+    Registers a newly inserted organization in the closure table. Must run inside the inserting transaction.
+
+    :param session: `AsyncSession` object with an open transaction
+    :param organization_id: primary key of the new organization
+    :param parent_id: primary key of the parent organization or None for a root
+    """
+    await session.execute(insert_node_stmt, {'organization_id': organization_id, 'parent_id': parent_id})
+
+
+async def move_organization_node(session: AsyncSession, organization_id: str, parent_id: Optional[str]) -> None:
+    """
+    Re-parents an organization together with its whole subtree in the closure table.
+
+    :param session: `AsyncSession` object with an open transaction
+    :param organization_id: primary key of the moved organization
+    :param parent_id: primary key of the new parent organization or None to make it a root
+    """
+    params = {'organization_id': organization_id, 'parent_id': parent_id}
+    if parent_id is not None:
+        result: Result = await session.execute(query_is_descendant, params)
+        if result.first() is not None:
+            raise InvalidUsage("An organization cannot be moved under itself or one of its sub-organizations")
+    await session.execute(detach_subtree_stmt, params)
+    if parent_id is not None:
+        await session.execute(attach_subtree_stmt, params)
+
+
+async def rebuild_organization_closure(session: AsyncSession) -> None:
+    """
+    Recomputes the whole closure table from `Organization.organization_parent_id`.
+
+    :param session: `AsyncSession` object with an open transaction
+    """
+    await session.execute(clear_closure_stmt)
+    await session.execute(rebuild_closure_stmt)
+
+
+def connect_organization_closure(app: Sanic, engine: AsyncEngine) -> None:
+    """
+    Creates the closure table once in the main process and rebuilds it from `Organization.organization_parent_id`,
+    so it matches the organizations even when they were written without maintaining it.
+
+    :param app: `Sanic` application
+    :param engine: `AsyncEngine` object used by the application
+    """
+    async def create_closure_table(app: Sanic, loop) -> None:
+        async with engine.begin() as conn:
+            await conn.run_sync(OrganizationClosure.__table__.create, checkfirst=True)
+            await conn.execute(clear_closure_stmt)
+            await conn.execute(rebuild_closure_stmt)
+        # Workers are forked after this point and must not inherit pooled connections
+        await engine.dispose()
+
+    app.register_listener(create_closure_table, "main_process_start")
+
+
+if __name__ == '__main__':
+    db_engine = create_engine(sys.argv[1] if len(sys.argv) > 1 else "sqlite:///dev.db")
+    OrganizationClosure.__table__.create(bind=db_engine, checkfirst=True)
+    with db_engine.begin() as conn:
+        conn.execute(clear_closure_stmt)
+        conn.execute(rebuild_closure_stmt)
@@ -0,0 +1,296 @@
+import asyncio
+import datetime
+import hashlib
+import os
+from functools import wraps
+from inspect import isawaitable
+from metrics import registry
+from models.models import IdempotencyKey
+from routes.streaming import defer_to_stream_end
+from sanic import Sanic
+from sanic.exceptions import InvalidUsage, SanicException
+from sanic.log import logger
+from sanic.request import Request
+from sanic.response import raw, HTTPResponse
+from sqlalchemy import and_, bindparam, delete, select, update
+from sqlalchemy.dialects.sqlite import insert as upsert, Insert
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.sql.dml import Delete, Update
+from sqlalchemy.sql.selectable import Select
+from typing import Any, Callable, Dict, Optional
+
+HEADER: str = 'Idempotency-Key'
+MAX_KEY_LENGTH: int = 255
+
+# Administrative endpoints are not creates and must not be answered from the store
+EXEMPT_PREFIXES = ('/admin/',)
+
+query_idempotency_key: Select = select(
+    IdempotencyKey.request_hash, IdempotencyKey.status, IdempotencyKey.content_type, IdempotencyKey.body,
+    IdempotencyKey.expires_on,
+).where(IdempotencyKey.key == bindparam('key'))
+
+# Inserts the claim, or takes over the row of an expired claim or response; changes no row while the key is in use
+_claim_key: Insert = upsert(IdempotencyKey)
+claim_key_stmt: Insert = _claim_key.on_conflict_do_update(
+    index_elements=['key'],
+    set_={
+        'request_hash': _claim_key.excluded.request_hash, 'status': None, 'content_type': None, 'body': None,
+        'expires_on': _claim_key.excluded.expires_on,
+    },
+    where=IdempotencyKey.expires_on <= bindparam('now'),
+)
+
+release_key_stmt: Delete = delete(IdempotencyKey).where(
+    and_(IdempotencyKey.key == bindparam('key'), IdempotencyKey.status.is_(None))
+).execution_options(synchronize_session=False)
+
+# Sets the columns passed along with `idempotency_key`
+store_response_stmt: Update = update(IdempotencyKey).where(
+    IdempotencyKey.key == bindparam('idempotency_key')
+).execution_options(synchronize_session=False)
+
+purge_keys_stmt: Delete = delete(IdempotencyKey).where(
+    IdempotencyKey.expires_on < bindparam('now')
+).execution_options(synchronize_session=False)
+
+
+class KeyReused(SanicException):
+    status_code = 422
+    quiet = True
+
+
+class RequestInProgress(SanicException):
+    status_code = 409
+    quiet = True
+
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        self.headers: Dict[str, str] = {'Retry-After': str(retry_after)}
+
+
+def request_hash(request: Request) -> str:
+    digest = hashlib.sha256()
+    for part in (request.method.encode(), request.path.encode(), request.query_string.encode(), request.body or b''):
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class IdempotentSession(AsyncSession):
+    """
+    Session of a POST request with a claimed `Idempotency-Key`. The request owns the transaction: the
+    `session.begin()` blocks of the view only flush, and the transaction is committed together with the stored
+    response once the view has returned, or rolled back when it failed. Its writes bypass group commit.
+    """
+
+    def begin(self, **kw):
+        return _FlushInRequestTransaction(self)
+
+
+class _FlushInRequestTransaction:
+
+    def __init__(self, session: AsyncSession) -> None:
+        self.session: AsyncSession = session
+
+    async def __aenter__(self) -> '_FlushInRequestTransaction':
+        if not self.session.in_transaction():
+            await AsyncSession.begin(self.session)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> bool:
+        if exc_type is None:
+            await self.session.flush()
+        return False
+
+
+class IdempotencyStore:
+    """
+    Responses of POST requests carrying an `Idempotency-Key` header, kept in the `idempotency_key` table so a retry
+    reaching any worker gets the original response instead of creating the rows again. A request claims its key
+    before the handler runs; a retry arriving while the claim is held gets 409, and a retry with the same key but a
+    different request gets 422. A successful response is stored in the transaction of the writes of the request, so
+    either both are committed or neither; failed and cancelled requests release their claim, so they can be retried
+    with the same key. Successful responses are kept for `ttl` seconds; claims of requests that never finished expire
+    after `claim_timeout` seconds. Every worker purges expired rows every `purge_interval` seconds.
+    """
+
+    def __init__(self, ttl: float, claim_timeout: float, purge_interval: float) -> None:
+        self.ttl: float = ttl
+        self.claim_timeout: float = claim_timeout
+        self.purge_interval: float = purge_interval
+        self.replays: int = 0
+        self.conflicts: int = 0
+        self.purged: int = 0
+        self.task: Optional[asyncio.Task] = None
+
+    async def claim(self, engine: AsyncEngine, request: Request, key: str) -> Optional[HTTPResponse]:
+        """
+        Claims the key for the request.
+
+        :return: stored response of an earlier request with the same key, None when the key was claimed
+        """
+        digest: str = request_hash(request)
+        now: datetime.datetime = datetime.datetime.now()
+        async with engine.begin() as conn:
+            # The upsert takes the SQLite write lock first, so concurrent claims of a key are serialized and the
+            # row read after a conflict is the one that won
+            result = await conn.execute(claim_key_stmt, {
+                'key': key, 'request_hash': digest, 'now': now,
+                'expires_on': now + datetime.timedelta(seconds=self.claim_timeout),
+            })
+            if result.rowcount:
+                return None
+            row = (await conn.execute(query_idempotency_key, {'key': key})).first()
+        if row.request_hash != digest:
+            self.conflicts += 1
+            raise KeyReused(f"{HEADER} {key!r} was used for a different request")
+        if row.status is None:
+            self.conflicts += 1
+            raise RequestInProgress(f"A request with {HEADER} {key!r} is in progress", 1)
+        self.replays += 1
+        return raw(row.body or b'', status=row.status, content_type=row.content_type,
+                   headers={'Idempotent-Replayed': 'true'})
+
+    async def store(self, session: AsyncSession, key: str, response: HTTPResponse) -> None:
+        """
+        Stores a successful response for replays and commits it together with the writes of the request.
+        """
+        await session.execute(store_response_stmt, {
+            'idempotency_key': key, 'status': response.status, 'content_type': response.content_type,
+            'body': response.body, 'expires_on': datetime.datetime.now() + datetime.timedelta(seconds=self.ttl),
+        })
+        await session.commit()
+
+    async def release(self, engine: AsyncEngine, session: Optional[AsyncSession], key: str) -> None:
+        """
+        Rolls back the writes of a failed request and releases its claim.
+        """
+        if session is not None:
+            # Frees the SQLite write lock the writes may hold
+            await session.rollback()
+        async with engine.begin() as conn:
+            await conn.execute(release_key_stmt, {'key': key})
+
+    async def purge(self, engine: AsyncEngine) -> None:
+        async with engine.begin() as conn:
+            result = await conn.execute(purge_keys_stmt, {'now': datetime.datetime.now()})
+        self.purged += result.rowcount
+
+    async def start(self, engine: AsyncEngine) -> None:
+        self.task = asyncio.get_running_loop().create_task(self.run(engine))
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self, engine: AsyncEngine) -> None:
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                await self.purge(engine)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Idempotency key purge failed: %s", e)
+
+
+idempotency_store = IdempotencyStore(
+    ttl=float(os.environ.get("IDEMPOTENCY_TTL", 86400)),
+    claim_timeout=float(os.environ.get("IDEMPOTENCY_CLAIM_TIMEOUT", 60)),
+    purge_interval=float(os.environ.get("IDEMPOTENCY_PURGE_INTERVAL", 300)),
+)
+
+registry.counter('idempotency_replays_total', 'Retried POST requests answered with the stored response.', lambda: {
+    (): idempotency_store.replays
+})
+registry.counter('idempotency_conflicts_total', 'Retries rejected as in progress or changed.', lambda: {
+    (): idempotency_store.conflicts
+})
+registry.counter('idempotency_purged_total', 'Expired idempotency keys deleted.', lambda: {
+    (): idempotency_store.purged
+})
+
+
+def _forget_claim(request: Request) -> Optional[str]:
+    key: Optional[str] = getattr(request.ctx, 'idempotency_key', None)
+    if key is not None:
+        del request.ctx.idempotency_key
+        request.ctx.idempotency_task.remove_done_callback(request.ctx.idempotency_callback)
+    return key
+
+
+def connect_idempotency_keys(app: Sanic, engine: AsyncEngine) -> None:
+    """
+    Honors the `Idempotency-Key` header of POST requests. Creates the key table once in the main process, registers
+    the middleware replaying stored responses, wraps the route handlers so a successful response is stored in the
+    transaction of the request, and runs the purge in every worker. Requests with a claimed key get an
+    `IdempotentSession` as their session.
+
+    :param app: `Sanic` application
+    :param engine: `AsyncEngine` object used by the application
+    """
+    async def create_idempotency_table(app: Sanic, loop) -> None:
+        async with engine.begin() as conn:
+            await conn.run_sync(IdempotencyKey.__table__.create, checkfirst=True)
+        # Workers are forked after this point and must not inherit pooled connections
+        await engine.dispose()
+
+    async def start_purge(app: Sanic, loop) -> None:
+        await idempotency_store.start(engine)
+
+    async def stop_purge(app: Sanic, loop) -> None:
+        await idempotency_store.stop()
+
+    async def replay_idempotent_request(request: Request) -> Optional[HTTPResponse]:
+        key: Optional[str] = request.headers.get(HEADER)
+        if key is None or request.method != 'POST' or request.path.startswith(EXEMPT_PREFIXES):
+            return None
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise InvalidUsage(f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters long")
+        response: Optional[HTTPResponse] = await idempotency_store.claim(engine, request, key)
+        if response is None:
+            request.ctx.idempotency_key = key
+            # Response middleware does not run when the client disconnects and the connection task is cancelled
+            request.ctx.idempotency_task = asyncio.current_task()
+            request.ctx.idempotency_callback = lambda task: task.get_loop().create_task(release_claim(request))
+            request.ctx.idempotency_task.add_done_callback(request.ctx.idempotency_callback)
+        return response
+
+    def with_idempotency(handler: Callable) -> Callable:
+        @wraps(handler)
+        async def idempotent_handler(request: Request, *args, **kwargs) -> Any:
+            response = handler(request, *args, **kwargs)
+            if isawaitable(response):
+                response = await response
+            key: Optional[str] = getattr(request.ctx, 'idempotency_key', None)
+            if key is not None and isinstance(response, HTTPResponse) and 200 <= response.status < 300:
+                # A failing commit fails the request, and the response middleware releases the claim
+                await idempotency_store.store(request.ctx.session, key, response)
+                _forget_claim(request)
+            return response
+
+        return idempotent_handler
+
+    def apply_idempotency(app: Sanic, _) -> None:
+        # Registered before the deadlines, so the response is stored within the deadline of the handler
+        for route in app.router.routes:
+            if not getattr(route.handler, 'is_websocket', False):
+                route.handler = with_idempotency(route.handler)
+
+    async def release_claim(request: Request) -> None:
+        key: Optional[str] = _forget_claim(request)
+        if key is not None:
+            await idempotency_store.release(engine, getattr(request.ctx, 'session', None), key)
+
+    async def release_failed_request(request: Request, response: HTTPResponse) -> None:
+        if not defer_to_stream_end(request, release_failed_request, response):
+            await release_claim(request)
+
+    app.register_listener(create_idempotency_table, "main_process_start")
+    app.register_listener(start_purge, "after_server_start")
+    app.register_listener(stop_purge, "before_server_stop")
+    app.register_listener(apply_idempotency, "before_server_start")
+    app.register_middleware(replay_idempotent_request, "request")
+    app.register_middleware(release_failed_request, "response")
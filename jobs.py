@@ -0,0 +1,387 @@
+import asyncio
+import datetime
+import json
+import os
+import time
+import uuid
+from cache import invalidate, owner_tags
+from change_feed import ENTITY_MODELS
+from concurrent.futures import ThreadPoolExecutor
+from hierarchy import rebuild_organization_closure
+from membership_statistics import add_member_statistics, MemberPair, rebuild_membership_statistics
+from metrics import registry
+from models.models import Address, Email, Job, Membership, Person, Phone
+from routes.streaming import read_chunks
+from sanic import Sanic
+from sanic.log import logger
+from sequences import fill_sequence_columns
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.sql.dml import Insert, Update
+from sqlalchemy.sql.selectable import Select
+from typing import Any, Awaitable, Callable, Dict, IO, List, Optional, Set
+from validation import validate_insert_rows
+
+# Rows per progress update of exports and per transaction of imports
+EXPORT_CHUNK: int = 1000
+IMPORT_CHUNK: int = 500
+
+# Minimum seconds between progress updates outside of a checkpoint
+PROGRESS_INTERVAL: float = 0.5
+
+# Upper bound of the backoff between retries of the final status update of a job
+FINISH_RETRY_MAX_DELAY: float = 30.0
+
+# Tables accepted by imports: new people, numbered by the sequences, and rows hanging off a person or
+# organization, which only touch the caches of their owners
+IMPORT_MODELS: Dict[str, Any] = {
+    'person': Person, 'address': Address, 'email': Email, 'phone': Phone, 'membership': Membership
+}
+
+query_job: Select = select(
+    Job.id, Job.kind, Job.status, Job.progress_done, Job.progress_total, Job.result, Job.error, Job.created_on,
+    Job.started_on, Job.finished_on,
+).where(Job.id == bindparam('job_id'))
+
+query_claimed_job: Select = select(Job.id, Job.kind, Job.params, Job.progress_done).where(
+    Job.owner == bindparam('worker'), Job.status == 'running'
+)
+
+enqueue_job_stmt: Insert = insert(Job)
+
+# Takes the oldest queued job in a single statement, so concurrent runners of all workers never take the same one
+claim_job_stmt: Update = update(Job).where(
+    Job.id == select(Job.id).where(Job.status == 'queued').order_by(Job.created_on).limit(1).scalar_subquery()
+).values(
+    status='running', owner=bindparam('worker'), started_on=bindparam('now')
+).execution_options(synchronize_session=False)
+
+# Sets the columns passed along with `job_id`
+update_job_stmt: Update = update(Job).where(Job.id == bindparam('job_id')).execution_options(
+    synchronize_session=False
+)
+
+requeue_jobs_stmt: Update = update(Job).where(Job.status == 'running').values(
+    status='queued', owner=None
+).execution_options(synchronize_session=False)
+
+JobFunction = Callable[['JobContext', Dict[str, Any]], Awaitable[Any]]
+
+JOB_KINDS: Dict[str, JobFunction] = {}
+
+
+def job_kind(name: str) -> Callable[[JobFunction], JobFunction]:
+    """
+    Registers a job function under the kind name clients enqueue it with. The function gets the `JobContext` and the
+    params of the job and returns the JSON result of the job. Interrupted jobs are run again after a restart, from
+    their last checkpoint, so job functions must be safe to repeat.
+    """
+    def register(function: JobFunction) -> JobFunction:
+        JOB_KINDS[name] = function
+        return function
+
+    return register
+
+
+class JobContext:
+    """
+    Handle of a running job: its id, the checkpoint to continue from, the engine and the thread pool of the runner
+    for CPU-heavy steps.
+    """
+
+    def __init__(self, runner: 'JobRunner', engine: AsyncEngine, job_id: str, done: int) -> None:
+        self.runner: JobRunner = runner
+        self.engine: AsyncEngine = engine
+        self.job_id: str = job_id
+        self.done: int = done
+        self._reported: float = 0.0
+
+    def session(self) -> AsyncSession:
+        return AsyncSession(self.engine, expire_on_commit=False)
+
+    async def run_in_thread(self, function: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.runner.executor, function, *args)
+
+    async def progress(self, done: int, total: Optional[int], session: Optional[AsyncSession] = None) -> None:
+        """
+        Records the progress of the job. Written with the transaction of `session`, it is a checkpoint committed
+        together with the work it counts, and a resumed job continues from it; otherwise it is written on its own,
+        at most every `PROGRESS_INTERVAL` seconds.
+        """
+        self.done = done
+        params: Dict[str, Any] = {'job_id': self.job_id, 'progress_done': done, 'progress_total': total}
+        if session is not None:
+            await session.execute(update_job_stmt, params)
+            return
+        now: float = time.monotonic()
+        if done != total and now - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = now
+        async with self.engine.begin() as conn:
+            await conn.execute(update_job_stmt, params)
+
+
+class JobRunner:
+    """
+    Runs background jobs from the `job` table. Every worker runs `concurrency` runners, each taking the oldest queued
+    job, so a job runs in one worker only; jobs enqueued by the worker itself start right away, jobs of other workers
+    are picked up within `poll_interval` seconds. CPU-heavy steps of the jobs run on a pool of `threads` threads
+    instead of the event loop.
+
+    Jobs still running when the server stops are queued again when it starts, and continue from their checkpoint.
+    """
+
+    def __init__(self, concurrency: int, threads: int, poll_interval: float, directory: str) -> None:
+        self.concurrency: int = concurrency
+        self.threads: int = threads
+        self.poll_interval: float = poll_interval
+        self.directory: str = directory
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.tasks: List[asyncio.Task] = []
+        self.running: int = 0
+        self.finished: Dict[str, int] = {'succeeded': 0, 'failed': 0}
+        self._wake: Optional[asyncio.Event] = None
+
+    async def start(self, engine: AsyncEngine) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.executor = ThreadPoolExecutor(self.threads, thread_name_prefix='job')
+        self._wake = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self.tasks = [loop.create_task(self.work(engine, f'{os.getpid()}-{slot}')) for slot in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def wake(self) -> None:
+        if self._wake is not None:
+            self._wake.set()
+
+    async def enqueue(self, session: AsyncSession, kind: str, params: Dict[str, Any]) -> str:
+        """
+        Adds a job to the queue of the current transaction; call `wake` once it is committed.
+
+        :param session: `AsyncSession` object with an open transaction
+        :param kind: name the job function was registered with
+        :param params: JSON params of the job
+        :return: job id
+        """
+        job_id: str = str(uuid.uuid4())
+        await session.execute(enqueue_job_stmt, {
+            'id': job_id, 'kind': kind, 'params': json.dumps(params), 'status': 'queued', 'progress_done': 0,
+            'created_on': datetime.datetime.now(),
+        })
+        return job_id
+
+    @staticmethod
+    async def claim(engine: AsyncEngine, worker: str) -> Optional[Any]:
+        async with engine.begin() as conn:
+            result = await conn.execute(claim_job_stmt, {'worker': worker, 'now': datetime.datetime.now()})
+            if not result.rowcount:
+                return None
+            return (await conn.execute(query_claimed_job, {'worker': worker})).first()
+
+    async def work(self, engine: AsyncEngine, worker: str) -> None:
+        while True:
+            try:
+                job = await self.claim(engine, worker)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Job claim failed: %s", e)
+                job = None
+            if job is not None:
+                try:
+                    await self.execute(engine, job)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # The job stays running and is resumed at the next start
+                    logger.error("Job %s could not be finished: %s", job.id, e)
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def execute(self, engine: AsyncEngine, job: Any) -> None:
+        context = JobContext(self, engine, job.id, job.progress_done)
+        self.running += 1
+        try:
+            result: Any = await JOB_KINDS[job.kind](context, json.loads(job.params))
+        except asyncio.CancelledError:
+            # The server is stopping, the job is resumed at the next start
+            raise
+        except Exception as e:
+            logger.exception("Job %s (%s) failed: %s", job.id, job.kind, e)
+            await self.finish(engine, job.id, 'failed', {'error': f'{type(e).__name__}: {e}'})
+        else:
+            await self.finish(engine, job.id, 'succeeded', {'result': json.dumps(result, default=str)})
+        finally:
+            self.running -= 1
+
+    async def finish(self, engine: AsyncEngine, job_id: str, status: str, values: Dict[str, Any]) -> None:
+        # A lost final update would leave the job running in this live worker until the next start, so transient
+        # errors like "database is locked" under write load are retried with backoff
+        delay: float = self.poll_interval
+        while True:
+            try:
+                async with engine.begin() as conn:
+                    await conn.execute(update_job_stmt, {
+                        'job_id': job_id, 'status': status, 'owner': None, 'finished_on': datetime.datetime.now(),
+                        **values
+                    })
+                break
+            except Exception as e:
+                logger.error("Job %s could not be marked %s, retrying in %.1f s: %s", job_id, status, delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, FINISH_RETRY_MAX_DELAY)
+        self.finished[status] += 1
+
+
+job_runner = JobRunner(
+    concurrency=int(os.environ.get("JOBS_CONCURRENCY", 2)),
+    threads=int(os.environ.get("JOBS_THREADS", 2)),
+    poll_interval=float(os.environ.get("JOBS_POLL_INTERVAL_MS", 1000)) / 1000,
+    directory=os.environ.get("JOBS_DIR", "jobs"),
+)
+
+registry.gauge('jobs_running', 'Background jobs running in this worker.', lambda: {(): job_runner.running})
+registry.counter('jobs_finished_total', 'Background jobs finished by status.', lambda: {
+    (('status', status),): count for status, count in job_runner.finished.items()
+})
+
+
+async def load_job(session: AsyncSession, job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Status, progress and result of a job.
+
+    :param session: `AsyncSession` object without an open transaction
+    :param job_id: job id
+    :return: job data, None when the job does not exist
+    """
+    async with session.begin():
+        row = (await session.execute(query_job, {'job_id': job_id})).first()
+    if row is None:
+        return None
+    job: Dict[str, Any] = dict(row._mapping)
+    job['progress'] = {'done': job.pop('progress_done'), 'total': job.pop('progress_total')}
+    job['result'] = json.loads(job['result']) if job['result'] is not None else None
+    return job
+
+
+def export_path(job_id: str) -> str:
+    return os.path.join(job_runner.directory, f'{job_id}.jsonl')
+
+
+def _write_rows(file: IO[str], rows: List[Dict[str, Any]]) -> None:
+    file.write(''.join(json.dumps(row, default=str, separators=(',', ':')) + '\n' for row in rows))
+
+
+@job_kind('export')
+async def export_rows(context: JobContext, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Writes every row of the `entity` table as JSON lines, downloaded from `/jobs/<id>/result`. Starts over when
+    resumed.
+    """
+    entity: Optional[str] = params.get('entity')
+    if entity not in ENTITY_MODELS:
+        raise ValueError(f"entity must be one of {', '.join(sorted(ENTITY_MODELS))}")
+    table = ENTITY_MODELS[entity].__table__
+    path: str = export_path(context.job_id)
+    done: int = 0
+    async with context.session() as session:
+        async with session.begin():
+            total: int = (await session.execute(select(func.count()).select_from(table))).scalar()
+        await context.progress(0, total)
+        file: IO[str] = await context.run_in_thread(open, f'{path}.part', 'w')
+        try:
+            # Every chunk is read in a short transaction of its own, the progress writes never wait for a read lock
+            async for keys, rows in read_chunks(session, select(table), size=EXPORT_CHUNK):
+                await context.run_in_thread(_write_rows, file, [dict(zip(keys, row)) for row in rows])
+                done += len(rows)
+                await context.progress(done, total)
+        finally:
+            await context.run_in_thread(file.close)
+    os.replace(f'{path}.part', path)
+    return {'entity': entity, 'rows': done}
+
+
+@job_kind('import')
+async def import_rows(context: JobContext, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Inserts `rows` into the `entity` table, `IMPORT_CHUNK` rows per transaction. Every transaction checkpoints the
+    progress, so a resumed import skips the rows already inserted.
+    """
+    entity: Optional[str] = params.get('entity')
+    rows: Any = params.get('rows')
+    if entity not in IMPORT_MODELS:
+        raise ValueError(f"entity must be one of {', '.join(sorted(IMPORT_MODELS))}")
+    model = IMPORT_MODELS[entity]
+    rows = validate_insert_rows(model, rows, 'rows')
+    for start in range(context.done, len(rows), IMPORT_CHUNK):
+        chunk: List[Dict[str, Any]] = rows[start:start + IMPORT_CHUNK]
+        async with context.session() as session:
+            await fill_sequence_columns(session, model, chunk)
+            pairs: Set[MemberPair] = set()
+            if model is Membership:
+                pairs = {(row['organization_id'], row['person_id']) for row in chunk}
+            async with session.begin():
+                await add_member_statistics(session, pairs, -1)
+                instances: List[Any] = [model(**row) for row in chunk]
+                session.add_all(instances)
+                invalidate(session, *(tag for row in chunk for tag in owner_tags(row)))
+                if pairs:
+                    await session.flush()
+                    await add_member_statistics(session, pairs)
+                await context.progress(start + len(chunk), len(rows), session)
+    return {'entity': entity, 'rows': len(rows)}
+
+
+@job_kind('rebuild_membership_statistics')
+async def rebuild_statistics(context: JobContext, params: Dict[str, Any]) -> None:
+    async with context.session() as session:
+        async with session.begin():
+            await rebuild_membership_statistics(session)
+            await context.progress(1, 1, session)
+
+
+@job_kind('rebuild_organization_closure')
+async def rebuild_closure(context: JobContext, params: Dict[str, Any]) -> None:
+    async with context.session() as session:
+        async with session.begin():
+            await rebuild_organization_closure(session)
+            await context.progress(1, 1, session)
+
+
+def connect_job_runner(app: Sanic, engine: AsyncEngine) -> None:
+    """
+    Creates the job table and queues the jobs interrupted by the last stop once in the main process, and runs the
+    job runner in every worker.
+
+    :param app: `Sanic` application
+    :param engine: `AsyncEngine` object used by the application
+    """
+    async def resume_jobs(app: Sanic, loop) -> None:
+        async with engine.begin() as conn:
+            await conn.run_sync(Job.__table__.create, checkfirst=True)
+            result = await conn.execute(requeue_jobs_stmt)
+        if result.rowcount:
+            logger.info("Resuming %s interrupted jobs", result.rowcount)
+        # Workers are forked after this point and must not inherit pooled connections
+        await engine.dispose()
+
+    async def start_job_runner(app: Sanic, loop) -> None:
+        await job_runner.start(engine)
+
+    async def stop_job_runner(app: Sanic, loop) -> None:
+        await job_runner.stop()
+
+    app.register_listener(resume_jobs, "main_process_start")
+    app.register_listener(start_job_runner, "after_server_start")
+    app.register_listener(stop_job_runner, "before_server_stop")
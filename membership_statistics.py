@@ -0,0 +1,155 @@
+import sys
+from models.models import Membership, MembershipStatistic, Person
+from sanic import Sanic
+from sqlalchemy import bindparam, case, create_engine, delete, func, insert, inspect, select, true, tuple_
+from sqlalchemy.dialects.sqlite import insert as upsert, Insert
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.sql.dml import Delete
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.sql.selectable import Select, Subquery
+from typing import Any, Dict, Set, Tuple
+
+# (organization_id, person_id) of a member; its events decide its state together
+MemberPair = Tuple[str, str]
+
+
+def _member_counts(criteria: ColumnElement) -> Select:
+    """
+    Signed member counts grouped by the statistic key. Every (organization, person) pair matching `criteria` is
+    counted once, in the state and month of its latest event; `criteria` must select all events of a pair. `sign` is
+    +1 when adding the pairs and -1 when removing them.
+    """
+    latest_events: Subquery = select(
+        Membership.organization_id,
+        Membership.person_id,
+        Membership.active_flag,
+        Membership.event_date,
+        func.row_number().over(
+            partition_by=(Membership.organization_id, Membership.person_id),
+            order_by=(Membership.event_date.desc(), Membership.created_on.desc()),
+        ).label('event_rank'),
+    ).where(criteria).subquery('latest_events')
+    event_month: ColumnElement = func.strftime('%Y-%m', latest_events.c.event_date)
+    return select(
+        latest_events.c.organization_id,
+        Person.membership_fee_category_id,
+        event_month.label('event_month'),
+        func.sum(case((latest_events.c.active_flag == 'Y', bindparam('sign')), else_=0)).label('active_count'),
+        func.sum(case((latest_events.c.active_flag == 'N', bindparam('sign')), else_=0)).label('inactive_count'),
+    ).join(Person, Person.id == latest_events.c.person_id).where(latest_events.c.event_rank == 1).group_by(
+        latest_events.c.organization_id, Person.membership_fee_category_id, event_month
+    )
+
+
+clear_statistics_stmt: Delete = delete(MembershipStatistic).execution_options(synchronize_session=False)
+
+rebuild_statistics_stmt = insert(MembershipStatistic).from_select(
+    ['organization_id', 'membership_fee_category_id', 'event_month', 'active_count', 'inactive_count'],
+    _member_counts(true()),
+)
+
+
+def _apply_counts_stmt(criteria: ColumnElement) -> Insert:
+    stmt: Insert = upsert(MembershipStatistic).from_select(
+        ['organization_id', 'membership_fee_category_id', 'event_month', 'active_count', 'inactive_count'],
+        _member_counts(criteria),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=['organization_id', 'membership_fee_category_id', 'event_month'],
+        set_={
+            'active_count': MembershipStatistic.active_count + stmt.excluded.active_count,
+            'inactive_count': MembershipStatistic.inactive_count + stmt.excluded.inactive_count,
+        }
+    )
+
+
+apply_pair_counts_stmt: Insert = _apply_counts_stmt(
+    tuple_(Membership.organization_id, Membership.person_id).in_(bindparam('pairs', expanding=True))
+)
+apply_person_counts_stmt: Insert = _apply_counts_stmt(Membership.person_id == bindparam('person_id'))
+
+query_membership_pair: Select = select(Membership.organization_id, Membership.person_id).where(
+    Membership.id == bindparam('membership_id')
+)
+
+
+async def membership_pairs(session: AsyncSession, membership_id: str, values: Dict[str, Any]) -> Set[MemberPair]:
+    """
+    Members whose counts change when the membership event is updated with `values`: the member it belongs to and the
+    member it is moved to by a new `organization_id` or `person_id`.
+
+    :param session: `AsyncSession` object with an open transaction
+    :param membership_id: primary key of membership table
+    :param values: new column values of the membership
+    :return: set of (organization_id, person_id) pairs
+    """
+    pairs: Set[MemberPair] = set()
+    for organization_id, person_id in await session.execute(query_membership_pair, {'membership_id': membership_id}):
+        pairs.add((organization_id, person_id))
+        pairs.add((values.get('organization_id', organization_id), values.get('person_id', person_id)))
+    return pairs
+
+
+async def add_member_statistics(session: AsyncSession, pairs: Set[MemberPair], sign: int = 1) -> None:
+    """
+    Adds (or with `sign=-1` removes) the counts of members. Removal must run before their membership events are
+    written, addition after it, both inside the writing transaction.
+
+    :param session: `AsyncSession` object with an open transaction
+    :param pairs: (organization_id, person_id) pairs of the members
+    :param sign: +1 to add the members to the statistics, -1 to remove them
+    """
+    if pairs:
+        await session.execute(apply_pair_counts_stmt, {'pairs': sorted(pairs), 'sign': sign})
+
+
+async def add_person_statistics(session: AsyncSession, person_id: str, sign: int = 1) -> None:
+    """
+    Adds (or with `sign=-1` removes) the counts of every membership of a person, used when the membership fee
+    category of the person changes.
+
+    :param session: `AsyncSession` object with an open transaction
+    :param person_id: primary key of person table
+    :param sign: +1 to add the members to the statistics, -1 to remove them
+    """
+    await session.execute(apply_person_counts_stmt, {'person_id': person_id, 'sign': sign})
+
+
+async def rebuild_membership_statistics(session: AsyncSession) -> None:
+    """
+    Recomputes the whole statistics table from the membership events.
+
+    :param session: `AsyncSession` object with an open transaction
+    """
+    await session.execute(clear_statistics_stmt)
+    await session.execute(rebuild_statistics_stmt, {'sign': 1})
+
+
+def connect_membership_statistics(app: Sanic, engine: AsyncEngine) -> None:
+    """
+    Creates the statistics table once in the main process and fills it when it is new. An existing table is kept,
+    recomputing it takes a scan of all membership events (the `rebuild_membership_statistics` job).
+
+    :param app: `Sanic` application
+    :param engine: `AsyncEngine` object used by the application
+    """
+    async def create_statistics_table(app: Sanic, loop) -> None:
+        async with engine.begin() as conn:
+            exists: bool = await conn.run_sync(
+                lambda sync_conn: inspect(sync_conn).has_table(MembershipStatistic.__tablename__)
+            )
+            if not exists:
+                await conn.run_sync(MembershipStatistic.__table__.create)
+                await conn.execute(rebuild_statistics_stmt, {'sign': 1})
+        # Workers are forked after this point and must not inherit pooled connections
+        await engine.dispose()
+
+    app.register_listener(create_statistics_table, "main_process_start")
+
+
+if __name__ == '__main__':
+    db_engine = create_engine(sys.argv[1] if len(sys.argv) > 1 else "sqlite:///dev.db")
+    MembershipStatistic.__table__.create(bind=db_engine, checkfirst=True)
+    with db_engine.begin() as conn:
+        conn.execute(clear_statistics_stmt)
+        conn.execute(rebuild_statistics_stmt, {'sign': 1})
@@ -0,0 +1,190 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from routes.streaming import defer_to_stream_end
+from sanic.request import Request
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS: Tuple[float, ...] = (0, 1, 2, 5, 10, 15, 20, 50, 100)
+SIZE_BUCKETS: Tuple[float, ...] = (128, 512, 2048, 8192, 32768, 131072, 524288, 2097152)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    Cumulative histogram rendered in Prometheus text format. Observing is a bisect and two additions.
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets: Sequence[float] = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    """
+    Database activity of a single request, filled in by the engine event hooks.
+    """
+    __slots__ = ('route', 'started', 'statements', 'db_time')
+
+    def __init__(self, route: str) -> None:
+        self.route: str = route
+        self.started: float = time.perf_counter()
+        self.statements: int = 0
+        self.db_time: float = 0.0
+
+
+class MetricsRegistry:
+    """
+    Process local metric store. Every metric family is a dict keyed by its label values.
+    """
+
+    def __init__(self) -> None:
+        self.histograms: Dict[str, Tuple[str, Sequence[float], Dict[Labels, Histogram]]] = {}
+        self.counters: Dict[str, Tuple[str, Dict[Labels, float], Optional[Callable[[], Dict[Labels, float]]]]] = {}
+        self.gauges: Dict[str, Tuple[str, Callable[[], Dict[Labels, float]]]] = {}
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float]) -> None:
+        self.histograms[name] = (help_text, buckets, {})
+
+    def counter(
+            self, name: str, help_text: str, collect: Optional[Callable[[], Dict[Labels, float]]] = None
+    ) -> None:
+        """
+        Registers a counter. Counters maintained elsewhere pass `collect`, which is called at render time.
+        """
+        self.counters[name] = (help_text, {}, collect)
+
+    def gauge(self, name: str, help_text: str, collect: Callable[[], Dict[Labels, float]]) -> None:
+        """
+        Registers a gauge whose values are collected by calling `collect` at render time.
+        """
+        self.gauges[name] = (help_text, collect)
+
+    def observe(self, name: str, labels: Labels, value: float) -> None:
+        _, buckets, series = self.histograms[name]
+        histogram: Optional[Histogram] = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = Histogram(buckets)
+        histogram.observe(value)
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        series: Dict[Labels, float] = self.counters[name][1]
+        series[labels] = series.get(labels, 0) + value
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for name, (help_text, series, collect) in self.counters.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            values: Dict[Labels, float] = collect() if collect is not None else series
+            lines += [f'{name}{_format_labels(labels)} {value}' for labels, value in values.items()]
+        for name, (help_text, collect) in self.gauges.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+            lines += [f'{name}{_format_labels(labels)} {value}' for labels, value in collect().items()]
+        for name, (help_text, buckets, series) in self.histograms.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, bucket_count in zip((*buckets, '+Inf'), histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+registry = MetricsRegistry()
+registry.histogram('http_request_duration_seconds', 'Request latency per route.', LATENCY_BUCKETS)
+registry.histogram('http_response_size_bytes', 'Response body size per route.', SIZE_BUCKETS)
+registry.histogram('db_statements_per_request', 'SQL statements executed per request.', STATEMENT_BUCKETS)
+registry.histogram('db_time_per_request_seconds', 'Time spent in SQL statements per request.', LATENCY_BUCKETS)
+registry.counter('http_requests_total', 'Requests per route and status code.')
+registry.counter('db_statements_total', 'SQL statements executed, including the ones outside of requests.')
+registry.counter('db_time_seconds_total', 'Time spent in SQL statements, including the ones outside of requests.')
+
+_request_stats_ctx: ContextVar[Optional[RequestStats]] = ContextVar('request_stats', default=None)
+
+
+def route_label(request: Request) -> str:
+    """
+    Low cardinality route name of a request: the URI template of the matched route.
+    """
+    route = getattr(request, 'route', None)
+    return f'/{route.path}' if route is not None else 'unmatched'
+
+
+def current_route() -> Optional[str]:
+    """
+    Route label of the request being served in the current context, None outside of requests.
+    """
+    stats: Optional[RequestStats] = _request_stats_ctx.get()
+    return stats.route if stats is not None else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed: float = time.perf_counter() - conn.info['query_start_time'].pop()
+    registry.inc('db_statements_total')
+    registry.inc('db_time_seconds_total', value=elapsed)
+    stats: Optional[RequestStats] = _request_stats_ctx.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += elapsed
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Hooks statement counting and timing into the engine.
+
+    :param engine: `AsyncEngine` object used by the application
+    """
+    event.listen(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+async def start_request_metrics(request: Request) -> None:
+    request.ctx.request_stats = RequestStats(route_label(request))
+    request.ctx.request_stats_ctx_token = _request_stats_ctx.set(request.ctx.request_stats)
+
+
+async def record_request_metrics(request: Request, response) -> None:
+    if not hasattr(request.ctx, 'request_stats'):
+        return
+    if defer_to_stream_end(request, record_request_metrics, response):
+        return
+    stats: RequestStats = request.ctx.request_stats
+    try:
+        _request_stats_ctx.reset(request.ctx.request_stats_ctx_token)
+    except ValueError:
+        # The end of a streamed response is recorded in the handler task of the deadline
+        pass
+    del request.ctx.request_stats
+    labels: Labels = (('method', request.method), ('route', stats.route))
+    registry.observe('http_request_duration_seconds', labels, time.perf_counter() - stats.started)
+    size: Optional[int] = getattr(request.ctx, 'stream_size', None)
+    if size is None:
+        size = len(response.body or b'')
+    registry.observe('http_response_size_bytes', labels, size)
+    registry.observe('db_statements_per_request', labels, stats.statements)
+    registry.observe('db_time_per_request_seconds', labels, stats.db_time)
+    registry.inc('http_requests_total', labels + (('status', str(response.status)),))
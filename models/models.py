@@ -1,8 +1,11 @@
 import datetime
-from sqlalchemy import INTEGER, NCHAR, NVARCHAR, DATE, DATETIME, TEXT, Column, CheckConstraint, ForeignKey
+from functools import lru_cache
+from sqlalchemy import BLOB, INTEGER, NCHAR, NVARCHAR, DATE, DATETIME, TEXT, Column, CheckConstraint, ForeignKey, Index
+from sqlalchemy import select
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.engine import create_engine
-from typing import Any, Dict
+from sqlalchemy.engine import Row, create_engine
+from sqlalchemy.sql.selectable import Select
+from typing import Any, Dict, Iterable, List, Tuple
 from uuid import uuid4
 
 Base = declarative_base()
@@ -17,7 +20,30 @@ class BaseModel(Base):
     created_by = Column(NVARCHAR(50), nullable=False)
 
     def to_dict(self) -> Dict[str, Any]:
-        return {col.name: getattr(self, col.name) for col in self.__table__.columns}
+        return {key: getattr(self, key) for key in self.column_keys()}
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def column_keys(cls) -> Tuple[str, ...]:
+        return tuple(col.name for col in cls.__table__.columns)
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def select_columns(cls) -> Select:
+        """
+        Core select of the columns of the table. Its rows are plain tuples in the order of `column_keys`, converted
+        with `row_dict`/`row_dicts` without hydrating ORM objects into the identity map of the session.
+        """
+        return select(*cls.__table__.columns)
+
+    @classmethod
+    def row_dict(cls, row: Row) -> Dict[str, Any]:
+        return dict(zip(cls.column_keys(), row))
+
+    @classmethod
+    def row_dicts(cls, rows: Iterable[Row]) -> List[Dict[str, Any]]:
+        keys: Tuple[str, ...] = cls.column_keys()
+        return [dict(zip(keys, row)) for row in rows]
 
 
 class BaseMapModel(BaseModel):
@@ -49,8 +75,14 @@ class EmailType(BaseMapModel):
 
 class Person(BaseModel):
     __tablename__ = 'person'
-    registration_number = Column(INTEGER(), nullable=False)
-    membership_id = Column(NVARCHAR(30), nullable=False)
+    # Only the sequences issue the numbers, the indexes make a duplicate written around them fail
+    __table_args__ = (
+        Index('ix_person_registration_number', 'registration_number', unique=True),
+        Index('ix_person_membership_id', 'membership_id', unique=True),
+    )
+    # Numbered from the sequences of `sequences`, clients cannot set them
+    registration_number = Column(INTEGER(), nullable=False, info={'sequence': 'registration_number'})
+    membership_id = Column(NVARCHAR(30), nullable=False, info={'sequence': 'membership_id'})
     name = Column(NVARCHAR(255), nullable=False)
     birthdate = Column(DATE(), nullable=True)
     mother_name = Column(NVARCHAR(255), nullable=True)
@@ -78,6 +110,21 @@ class Organization(BaseModel):
     notes = Column(TEXT(), nullable=True)
 
 
+class OrganizationClosure(Base):
+    """
+    Closure table of the organization hierarchy, one row per (ancestor, descendant) pair including the node itself.
+    """
+    __tablename__ = 'organization_closure'
+    ancestor_id = Column(
+        NCHAR(36), ForeignKey('organization.id', name='fk_organization_closure_ancestor_id'), primary_key=True
+    )
+    descendant_id = Column(
+        NCHAR(36), ForeignKey('organization.id', name='fk_organization_closure_descendant_id'), primary_key=True,
+        index=True
+    )
+    depth = Column(INTEGER(), nullable=False)
+
+
 class Address(BaseModel):
     __tablename__ = 'address'
     person_id = Column(NCHAR(36), ForeignKey('person.id', name='fk_address_person_id'), nullable=True)
@@ -118,6 +165,10 @@ class Email(BaseModel):
 
 class Membership(BaseModel):
     __tablename__ = "membership"
+    __table_args__ = (
+        Index('ix_membership_organization_person_event', 'organization_id', 'person_id', 'event_date'),
+        Index('ix_membership_person_event', 'person_id', 'event_date'),
+    )
     person_id = Column(NCHAR(36), ForeignKey('person.id', name='fk_email_person_id'), nullable=False)
     organization_id = Column(NCHAR(36), ForeignKey('organization.id', name='fk_email_organization_id'), nullable=False)
     active_flag = Column(NCHAR(1), CheckConstraint("active_flag in ('Y', 'N')", name='chk_active_flag'), nullable=False)
@@ -126,5 +177,97 @@ class Membership(BaseModel):
     notes = Column(TEXT(), nullable=True)
 
 
+class MembershipStatistic(Base):
+    """
+    Materialized member counts per organization, membership fee category and event month ('YYYY-MM'). Every
+    (organization, person) pair is counted once, as active or inactive by its latest membership event and in the
+    month of that event, so the counts of all months add up to the current members of the organization.
+    """
+    __tablename__ = "membership_statistic"
+    organization_id = Column(
+        NCHAR(36), ForeignKey('organization.id', name='fk_membership_statistic_organization_id'), primary_key=True
+    )
+    membership_fee_category_id = Column(
+        NCHAR(36), ForeignKey('membership_fee_category.id', name='fk_membership_statistic_membership_fee_category_id'),
+        primary_key=True
+    )
+    event_month = Column(NCHAR(7), primary_key=True)
+    active_count = Column(INTEGER(), nullable=False, default=0)
+    inactive_count = Column(INTEGER(), nullable=False, default=0)
+
+
+class CacheInvalidation(Base):
+    """
+    Cache tags invalidated by committed writes, polled by every worker process to keep their caches coherent.
+    """
+    __tablename__ = "cache_invalidation"
+    # Pruning may empty the table, ids must not be reused afterwards or pollers skip the new rows
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = Column(INTEGER(), primary_key=True, autoincrement=True)
+    tag = Column(NVARCHAR(255), nullable=False)
+    origin = Column(INTEGER(), nullable=False)
+    created_on = Column(DATETIME(), nullable=False, index=True)
+
+
+class ChangeLog(Base):
+    """
+    Rows written by committed transactions in commit order, read by the change feed. SQLite serializes writers, so
+    ids grow in commit order.
+    """
+    __tablename__ = "change_log"
+    # Readers keep the last id they have seen, ids must not be reused if the log is ever pruned
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = Column(INTEGER(), primary_key=True, autoincrement=True)
+    entity = Column(NVARCHAR(50), nullable=False)
+    entity_id = Column(NCHAR(36), nullable=False)
+    created_on = Column(DATETIME(), nullable=False)
+
+
+class IdempotencyKey(Base):
+    """
+    Responses of POST requests sent with an `Idempotency-Key` header, replayed when the request is retried. A row
+    without status is a request still in progress.
+    """
+    __tablename__ = "idempotency_key"
+    key = Column(NVARCHAR(255), primary_key=True)
+    request_hash = Column(NCHAR(64), nullable=False)
+    status = Column(INTEGER(), nullable=True)
+    content_type = Column(NVARCHAR(100), nullable=True)
+    body = Column(BLOB(), nullable=True)
+    expires_on = Column(DATETIME(), nullable=False, index=True)
+
+
+class Job(Base):
+    """
+    Background jobs run by the job runner of the workers. `progress_done` of a running job is also the checkpoint a
+    resumed job continues from.
+    """
+    __tablename__ = "job"
+    id = Column(NCHAR(36), primary_key=True)
+    kind = Column(NVARCHAR(50), nullable=False)
+    params = Column(TEXT(), nullable=False)
+    status = Column(
+        NVARCHAR(20), CheckConstraint("status in ('queued', 'running', 'succeeded', 'failed')", name='chk_job_status'),
+        nullable=False, index=True
+    )
+    progress_done = Column(INTEGER(), nullable=False, default=0)
+    progress_total = Column(INTEGER(), nullable=True)
+    result = Column(TEXT(), nullable=True)
+    error = Column(TEXT(), nullable=True)
+    owner = Column(NVARCHAR(50), nullable=True)
+    created_on = Column(DATETIME(), nullable=False)
+    started_on = Column(DATETIME(), nullable=True)
+    finished_on = Column(DATETIME(), nullable=True)
+
+
+class NumberSequence(Base):
+    """
+    Next unallocated value of the number sequences, handed out to the workers in blocks.
+    """
+    __tablename__ = "number_sequence"
+    name = Column(NVARCHAR(50), primary_key=True)
+    next_value = Column(INTEGER(), nullable=False)
+
+
 if __name__ == '__main__':
     print(Base.metadata.create_all(bind=db_engine))
@@ -0,0 +1,65 @@
+import asyncio
+from queries.prepared import execute, Statement
+from sqlalchemy.engine import Row
+from sqlalchemy.engine.url import URL
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from typing import List, Optional, Sequence
+
+
+class ParallelReader:
+    """
+    Runs independent queries at the same time, each on its own pooled connection. SQLite executes the statements
+    of different connections on different threads, so the wall-clock time approaches the slowest query instead of
+    the sum.
+
+    SQLite cannot share a snapshot between connections: every statement reads the latest committed state when it
+    starts, so the results of one call may straddle a concurrent commit. Only use it for reads that tolerate that.
+    """
+
+    def __init__(self, engine: AsyncEngine) -> None:
+        self.engine: AsyncEngine = engine
+
+    async def _read(self, stmt: Statement) -> List[Row]:
+        async with self.engine.connect() as conn:
+            return (await execute(conn, stmt)).all()
+
+    async def read_all(self, statements: Sequence[Statement]) -> List[List[Row]]:
+        return list(await asyncio.gather(*(self._read(stmt) for stmt in statements)))
+
+
+parallel_reader: Optional[ParallelReader] = None
+
+
+def enable_parallel_reads(url: URL, pool_size: int, echo: bool = False) -> AsyncEngine:
+    """
+    Switches `read_all` to parallel execution on a dedicated pool of read connections.
+
+    :param url: database URL of the application engine
+    :param pool_size: number of pooled read connections, the maximum number of statements running at the same time
+    :param echo: log the statements like the application engine
+    :return: `AsyncEngine` object of the read pool, to be instrumented like the main engine
+    """
+    global parallel_reader
+    engine: AsyncEngine = create_async_engine(
+        url, echo=echo, poolclass=AsyncAdaptedQueuePool, pool_size=pool_size, max_overflow=0
+    )
+    parallel_reader = ParallelReader(engine)
+    return engine
+
+
+async def read_all(session: AsyncSession, statements: Sequence[Statement]) -> List[List[Row]]:
+    """
+    Executes independent queries and returns their rows in order. Without parallel reads, or when `session` already
+    has an open transaction whose writes the queries must see, the queries run one after another in a single
+    transaction of `session`, which gives a consistent snapshot.
+
+    :param session: `AsyncSession` object
+    :param statements: queries to run, `Select` objects or prepared queries with their parameters
+    :return: list of the result rows of every query
+    """
+    if parallel_reader is not None and not session.in_transaction():
+        return await parallel_reader.read_all(statements)
+    async with session.begin():
+        conn: AsyncConnection = await session.connection()
+        return [(await execute(conn, stmt)).all() for stmt in statements]
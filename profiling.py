@@ -0,0 +1,233 @@
+import asyncio
+import cProfile
+import datetime
+import io
+import itertools
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from admin import is_admin
+from metrics import route_label
+from routes.streaming import defer_to_stream_end
+from sanic.request import Request
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+MODES = ("sample", "cprofile")
+
+
+class StackSampler(threading.Thread):
+    """
+    Statistical profiler of a single asyncio task. A background thread records the stack of the task every
+    `interval` seconds: the live stack of the event loop thread while the task is running, and the chain of awaited
+    coroutines while it is suspended, so time spent waiting for aiosqlite shows up as well. While the task waits for
+    the task returned by `subtask` (the handler task of a deadline), the stack continues with the stack of that task.
+    """
+
+    def __init__(
+            self, task: asyncio.Task, loop_thread_id: int, interval: float,
+            subtask: Callable[[], Optional[asyncio.Task]] = lambda: None
+    ) -> None:
+        super().__init__(name="stack-sampler", daemon=True)
+        self.task: asyncio.Task = task
+        self.loop_thread_id: int = loop_thread_id
+        self.interval: float = interval
+        self.subtask: Callable[[], Optional[asyncio.Task]] = subtask
+        self.samples: Counter = Counter()
+        self._stopped: threading.Event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            stack: List[str] = self.stack()
+            if stack:
+                self.samples[";".join(stack)] += 1
+
+    def stack(self) -> List[str]:
+        stack: List[str] = task_stack(self.task, self.loop_thread_id)
+        subtask: Optional[asyncio.Task] = self.subtask()
+        if subtask is not None and not subtask.done():
+            stack = [frame for frame in stack if not frame.startswith("<awaiting")]
+            stack += task_stack(subtask, self.loop_thread_id)
+        return stack
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+    def collapsed(self) -> str:
+        """
+        Samples in the collapsed stack format understood by flamegraph.pl and speedscope.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def task_stack(task: asyncio.Task, loop_thread_id: int) -> List[str]:
+    """
+    Stack of a task, outermost frame first.
+    """
+    coro = task.get_coro()
+    outer_frame = getattr(coro, "cr_frame", None)
+    if outer_frame is None:
+        return []
+    if getattr(coro, "cr_running", False):
+        frame = sys._current_frames().get(loop_thread_id)
+        frames: List[str] = []
+        while frame is not None:
+            frames.append(_frame_label(frame))
+            if frame is outer_frame:
+                return frames[::-1]
+            frame = frame.f_back
+    stack: List[str] = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            stack.append(f"<awaiting {type(coro).__name__}>")
+            break
+        stack.append(_frame_label(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return stack
+
+
+class ProfileStore:
+    """
+    Keeps the last `capacity` request profiles of this worker together with the sampling settings.
+    """
+
+    def __init__(self, capacity: int, rate: float, mode: str, interval: float) -> None:
+        self.profiles: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+        self.rate: float = rate
+        self.mode: str = mode
+        self.interval: float = interval
+        self._ids = itertools.count(1)
+        self.cprofile_lock: threading.Lock = threading.Lock()
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def get(self, profile_id: int) -> Optional[Dict[str, Any]]:
+        return next((profile for profile in self.profiles if profile["id"] == profile_id), None)
+
+
+profile_store = ProfileStore(
+    capacity=int(os.environ.get("PROFILE_HISTORY", 20)),
+    rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+    mode=os.environ.get("PROFILE_MODE", "sample"),
+    interval=float(os.environ.get("PROFILE_INTERVAL_MS", 2)) / 1000,
+)
+
+
+def profile_mode(request: Request) -> Optional[str]:
+    """
+    Decides whether a request is profiled: always when an admin sends the `X-Profile: sample|cprofile` header,
+    otherwise for a random `rate` fraction of the requests.
+
+    :param request: `Request` object
+    :return: profiling mode or None
+    """
+    requested: Optional[str] = request.headers.get("X-Profile")
+    if requested and is_admin(request):
+        return requested if requested in MODES else "sample"
+    if profile_store.rate and random.random() < profile_store.rate:
+        return profile_store.mode
+    return None
+
+
+async def start_profiling(request: Request) -> None:
+    mode: Optional[str] = profile_mode(request)
+    if mode is None:
+        return
+    # cProfile hooks the whole event loop thread, the handler task of the deadline included, so only one request is
+    # traced at a time and concurrent requests fall back to the sampler
+    if mode == "cprofile" and profile_store.cprofile_lock.acquire(blocking=False):
+        request.ctx.profiler = cProfile.Profile()
+        request.ctx.profiler.enable()
+    else:
+        request.ctx.profiler = StackSampler(
+            asyncio.current_task(), threading.get_ident(), profile_store.interval,
+            lambda: getattr(request.ctx, "handler_task", None),
+        )
+        request.ctx.profiler.start()
+    request.ctx.profile_started = time.perf_counter()
+    # Response middleware does not run when the client disconnects and the connection task is cancelled
+    request.ctx.profile_task = asyncio.current_task()
+    request.ctx.profile_callback = lambda task: _stop_profiler(request)
+    request.ctx.profile_task.add_done_callback(request.ctx.profile_callback)
+
+
+def _stop_profiler(request: Request) -> Optional[Any]:
+    profiler = getattr(request.ctx, "profiler", None)
+    if profiler is None:
+        return None
+    del request.ctx.profiler
+    request.ctx.profile_task.remove_done_callback(request.ctx.profile_callback)
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profile_store.cprofile_lock.release()
+    else:
+        profiler.stop()
+    return profiler
+
+
+async def stop_profiling(request: Request, response) -> None:
+    if getattr(request.ctx, "profiler", None) is None:
+        return
+    if not hasattr(request.ctx, "profile_id"):
+        # The header goes out with the first chunk of a streamed response, the profile is stored at its end
+        request.ctx.profile_id = profile_store.next_id()
+        response.headers["X-Profile-Id"] = str(request.ctx.profile_id)
+        if defer_to_stream_end(request, stop_profiling, response):
+            return
+    profiler = _stop_profiler(request)
+    if profiler is None:
+        return
+    profile_store.profiles.append({
+        "id": request.ctx.profile_id,
+        "profiled_on": datetime.datetime.now().isoformat(),
+        "method": request.method,
+        "path": request.path,
+        "route": route_label(request),
+        "status": response.status,
+        "duration_ms": round((time.perf_counter() - request.ctx.profile_started) * 1000, 3),
+        "mode": "cprofile" if isinstance(profiler, cProfile.Profile) else "sample",
+        "profiler": profiler,
+    })
+
+
+def render_profile(profile: Dict[str, Any], output_format: str) -> Optional[bytes]:
+    """
+    Renders a stored profile as `pstats` (marshalled stats, loadable with `pstats.Stats`), `collapsed` (flamegraph
+    input) or `text`. Returns None for formats the profile cannot be rendered in.
+
+    :param profile: stored profile
+    :param output_format: pstats, collapsed or text
+    :return: rendered profile
+    """
+    profiler = profile["profiler"]
+    if isinstance(profiler, cProfile.Profile):
+        if output_format == "pstats":
+            profiler.create_stats()
+            return marshal.dumps(profiler.stats)
+        if output_format == "text":
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(50)
+            return stream.getvalue().encode()
+        return None
+    if output_format in ("collapsed", "text"):
+        return profiler.collapsed().encode()
+    return None
+
+
+def profile_summary(profile: Dict[str, Any]) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {key: value for key, value in profile.items() if key != "profiler"}
+    if isinstance(profile["profiler"], StackSampler):
+        summary["samples"] = sum(profile["profiler"].samples.values())
+    return summary
@@ -0,0 +1,70 @@
+from sqlalchemy.engine import Compiled, Dialect, Result
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+from sqlalchemy.sql.selectable import Select
+from typing import Any, Dict, List, NamedTuple, Union
+
+
+class PreparedQuery:
+    """
+    Query with `bindparam` placeholders, compiled once per dialect. Executing the compiled form skips building the
+    statement, computing its cache key and looking it up in the statement cache on every call; only the parameters
+    change between executions. The statement must not need per-call rendering (no `IN` lists of variable length).
+    """
+
+    def __init__(self, statement: Select) -> None:
+        self.statement: Select = statement
+        self.compiled: Dict[Dialect, Compiled] = {}
+        prepared_queries.append(self)
+
+    def compile(self, dialect: Dialect) -> Compiled:
+        compiled: Compiled = self.compiled.get(dialect)
+        if compiled is None:
+            compiled = self.compiled[dialect] = self.statement.compile(dialect=dialect)
+        return compiled
+
+    def __call__(self, **params: Any) -> 'BoundQuery':
+        return BoundQuery(self, params)
+
+
+class BoundQuery(NamedTuple):
+    query: PreparedQuery
+    params: Dict[str, Any]
+
+
+Statement = Union[Select, BoundQuery]
+
+prepared_queries: List[PreparedQuery] = []
+
+
+def prepare_queries(engine: AsyncEngine) -> None:
+    """
+    Compiles every prepared query for the dialect of `engine`, so no request pays for the first compilation.
+
+    :param engine: `AsyncEngine` object the queries are executed on
+    """
+    for query in prepared_queries:
+        query.compile(engine.dialect)
+
+
+async def execute(conn: AsyncConnection, stmt: Statement) -> Result:
+    """
+    Executes a query, in its compiled form when it is prepared.
+
+    :param conn: `AsyncConnection` object
+    :param stmt: `Select` object or prepared query with its parameters, e.g. `prepared_person(pk=pk)`
+    :return: `Result` object
+    """
+    if isinstance(stmt, BoundQuery):
+        return await conn.execute(stmt.query.compile(conn.dialect), stmt.params)
+    return await conn.execute(stmt)
+
+
+async def fetch(session: AsyncSession, stmt: Statement) -> Result:
+    """
+    Executes a query on the connection of the current transaction of `session`.
+
+    :param session: `AsyncSession` object
+    :param stmt: `Select` object or prepared query with its parameters
+    :return: `Result` object
+    """
+    return await execute(await session.connection(), stmt)
@@ -1,8 +1,9 @@
 from models.models import (
-    Address, AddressType, Email, EmailType, Gender, Membership, MembershipFeeCategory, Organization, Person, Phone,
-    PhoneType
+    Address, AddressType, Email, EmailType, Gender, Membership, MembershipFeeCategory, MembershipStatistic,
+    Organization, OrganizationClosure, Person, Phone, PhoneType
 )
-from sqlalchemy import select
+from queries.prepared import PreparedQuery
+from sqlalchemy import bindparam, exists, func, select, tuple_
 from sqlalchemy.orm import aliased
 from sqlalchemy.orm.util import AliasedClass
 from sqlalchemy.sql import and_
@@ -47,6 +48,27 @@ query_parent_organizations: Select = select(
     Organization.name.label('organization_name'),
 ).where(and_(Organization.organization_parent_id.is_(None), Organization.termination_date.is_(None)))
 
+query_organization_subtree: Select = select(
+    Organization.id.label('organization_id'),
+    Organization.name.label('organization_name'),
+    Organization.organization_parent_id.label('parent_organization_id'),
+    OrganizationClosure.depth,
+    Organization.accepts_members_flag,
+    Organization.establishment_date,
+    Organization.termination_date,
+).join(OrganizationClosure, OrganizationClosure.descendant_id == Organization.id).order_by(
+    OrganizationClosure.depth, Organization.name
+)
+
+query_organization_ancestors: Select = select(
+    Organization.id.label('organization_id'),
+    Organization.name.label('organization_name'),
+    Organization.organization_parent_id.label('parent_organization_id'),
+    OrganizationClosure.depth,
+).join(OrganizationClosure, OrganizationClosure.ancestor_id == Organization.id).order_by(
+    OrganizationClosure.depth.desc()
+)
+
 query_person_address: Select = select(
     Address.id,
     Address.person_id,
@@ -131,6 +153,59 @@ query_organization_membership: Select = select(
     Membership.notes,
 ).join(Person)
 
+query_organization_descendant_membership: Select = select(
+    Membership.id,
+    Membership.person_id,
+    Person.name.label('person_name'),
+    Membership.organization_id,
+    Organization.name.label('organization_name'),
+    OrganizationClosure.depth,
+    Membership.active_flag,
+    Membership.inactivity_status_id,
+    Membership.event_date,
+    Membership.notes,
+).join(Person).join(Organization).join(
+    OrganizationClosure, OrganizationClosure.descendant_id == Membership.organization_id
+)
+
+later_membership: AliasedClass = aliased(Membership, name='later_membership')
+
+# The latest membership event up to `as_of_date` of every (organization, person) pair: the pair has no later event up
+# to that date. Checked per event on the (organization, person, event_date) index instead of ranking all events with a
+# window function, so a page of the events ordered by id costs only the events of the page.
+query_latest_membership_events: Select = select(
+    Membership.id,
+    Membership.person_id,
+    Person.name.label('person_name'),
+    Membership.organization_id,
+    Organization.name.label('organization_name'),
+    Membership.active_flag,
+    Membership.inactivity_status_id,
+    Membership.event_date,
+    Membership.notes,
+).join(Person).join(Organization).where(
+    Membership.event_date <= bindparam('as_of_date'),
+    ~exists().where(
+        later_membership.organization_id == Membership.organization_id,
+        later_membership.person_id == Membership.person_id,
+        later_membership.event_date <= bindparam('as_of_date'),
+        tuple_(later_membership.event_date, later_membership.created_on, later_membership.id)
+        > tuple_(Membership.event_date, Membership.created_on, Membership.id),
+    ),
+)
+
+query_membership_statistics: Select = select(
+    MembershipStatistic.membership_fee_category_id,
+    MembershipFeeCategory.name.label('membership_fee_category_name'),
+    MembershipStatistic.event_month,
+    func.sum(MembershipStatistic.active_count).label('active_count'),
+    func.sum(MembershipStatistic.inactive_count).label('inactive_count'),
+).join(MembershipFeeCategory).group_by(
+    MembershipStatistic.membership_fee_category_id, MembershipFeeCategory.name, MembershipStatistic.event_month
+).having(
+    func.sum(MembershipStatistic.active_count) + func.sum(MembershipStatistic.inactive_count) > 0
+).order_by(MembershipStatistic.event_month, MembershipFeeCategory.name)
+
 query_gender: Select = select(
     Gender.id.label('value'),
     Gender.name.label('label'),
@@ -200,3 +275,49 @@ query_phone_type_map: Select = select(
     PhoneType.created_on,
     PhoneType.created_by,
 )
+
+# Parameterized forms of the queries above executed per request, compiled once per dialect
+prepared_person: PreparedQuery = PreparedQuery(query_person.where(Person.id == bindparam('pk')))
+prepared_person_address: PreparedQuery = PreparedQuery(query_person_address.where(Address.person_id == bindparam('pk')))
+prepared_person_email: PreparedQuery = PreparedQuery(query_person_email.where(Email.person_id == bindparam('pk')))
+prepared_person_phone: PreparedQuery = PreparedQuery(query_person_phone.where(Phone.person_id == bindparam('pk')))
+prepared_person_membership: PreparedQuery = PreparedQuery(
+    query_person_membership.where(Membership.person_id == bindparam('pk'))
+)
+prepared_organization: PreparedQuery = PreparedQuery(query_organization.where(Organization.id == bindparam('pk')))
+prepared_organization_address: PreparedQuery = PreparedQuery(
+    query_organization_address.where(Address.organization_id == bindparam('pk'))
+)
+prepared_organization_email: PreparedQuery = PreparedQuery(
+    query_organization_email.where(Email.organization_id == bindparam('pk'))
+)
+prepared_organization_phone: PreparedQuery = PreparedQuery(
+    query_organization_phone.where(Phone.organization_id == bindparam('pk'))
+)
+prepared_organization_membership: PreparedQuery = PreparedQuery(
+    query_organization_membership.where(Membership.organization_id == bindparam('pk'))
+)
+prepared_organization_subtree: PreparedQuery = PreparedQuery(
+    query_organization_subtree.where(OrganizationClosure.ancestor_id == bindparam('pk'))
+)
+prepared_organization_subtree_max_depth: PreparedQuery = PreparedQuery(query_organization_subtree.where(
+    OrganizationClosure.ancestor_id == bindparam('pk'), OrganizationClosure.depth <= bindparam('max_depth')
+))
+prepared_organization_ancestors: PreparedQuery = PreparedQuery(
+    query_organization_ancestors.where(OrganizationClosure.descendant_id == bindparam('pk'))
+)
+prepared_organization_descendant_membership: PreparedQuery = PreparedQuery(
+    query_organization_descendant_membership.where(OrganizationClosure.ancestor_id == bindparam('pk'))
+)
+prepared_membership_statistics: PreparedQuery = PreparedQuery(
+    query_membership_statistics.where(MembershipStatistic.organization_id == bindparam('pk'))
+)
+prepared_membership_statistics_rollup: PreparedQuery = PreparedQuery(query_membership_statistics.join(
+    OrganizationClosure, OrganizationClosure.descendant_id == MembershipStatistic.organization_id
+).where(OrganizationClosure.ancestor_id == bindparam('pk')))
+prepared_parent_organizations: PreparedQuery = PreparedQuery(query_parent_organizations)
+prepared_gender: PreparedQuery = PreparedQuery(query_gender)
+prepared_membership_fee_category: PreparedQuery = PreparedQuery(query_membership_fee_category)
+prepared_address_type: PreparedQuery = PreparedQuery(query_address_type)
+prepared_email_type: PreparedQuery = PreparedQuery(query_email_type)
+prepared_phone_type: PreparedQuery = PreparedQuery(query_phone_type)
@@ -0,0 +1,69 @@
+from contextvars import ContextVar, Token
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from typing import List, Optional
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    """
+    Context manager recording the SQL statements executed in the current context while it is active. The context is
+    copied into the greenlets of the asyncio extension, so statements of concurrent requests are never mixed up.
+
+    Usage:
+        with QueryCounter() as counter:
+            await handler(request, pk)
+        counter.check(10, 'GET /people/<pk:str>')
+    """
+
+    def __init__(self) -> None:
+        self.statements: List[str] = []
+        self._token: Optional[Token] = None
+
+    def __enter__(self) -> 'QueryCounter':
+        self._token = _query_counter_ctx.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            _query_counter_ctx.reset(self._token)
+        except ValueError:
+            # Exited at the end of a streamed response, in the handler task of the deadline; the counter stays set
+            # only in the copied context of that task
+            pass
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def check(self, budget: int, label: str = 'Block') -> None:
+        """
+        Raises `QueryBudgetExceeded` listing the recorded statements when more than `budget` were executed.
+
+        :param budget: maximum number of statements
+        :param label: name of the checked code in the error message
+        """
+        if self.count > budget:
+            listing: str = '\n'.join(f'{i:>3}. {statement}' for i, statement in enumerate(self.statements, 1))
+            raise QueryBudgetExceeded(f'{label} executed {self.count} statements, budget is {budget}:\n{listing}')
+
+
+_query_counter_ctx: ContextVar[Optional[QueryCounter]] = ContextVar('query_counter', default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    counter: Optional[QueryCounter] = _query_counter_ctx.get()
+    if counter is not None:
+        counter.statements.append(' '.join(statement.split()))
+
+
+def count_queries(engine: AsyncEngine) -> None:
+    """
+    Hooks `QueryCounter` into the engine.
+
+    :param engine: `AsyncEngine` object used by the application
+    """
+    event.listen(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
@@ -1,14 +1,18 @@
+from cache import invalidate, owner_tags
+from change_feed import record_changes
 from models.models import Address
+from routes.streaming import json_rows
 from sanic import Blueprint
 from sanic.request import Request
 from sanic.response import json, HTTPResponse
 from sanic.views import HTTPMethodView
-from sqlalchemy import select, update
-from sqlalchemy.engine import Result
+from sqlalchemy import update
+from sqlalchemy.engine import Result, Row
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.selectable import Select
 from sqlalchemy.sql.dml import Update
-from typing import Any, Dict, List
+from typing import Any, Dict, Optional
+from validation import validate_insert, validate_update
 
 
 class AddressView(HTTPMethodView):
@@ -24,14 +28,14 @@ class AddressView(HTTPMethodView):
         """
         session: AsyncSession = request.ctx.session
         async with session.begin():
-            stmt: Select = select(Address).where(Address.id == pk)
+            stmt: Select = Address.select_columns().where(Address.id == pk)
             result: Result = await session.execute(stmt)
-            address: Address = result.scalar()
+            address: Row = result.first()
 
         if not address:
             return json(dict())
 
-        return json(address.to_dict(), default=str)
+        return json(Address.row_dict(address), default=str)
 
     @staticmethod
     async def patch(request: Request, pk: str) -> HTTPResponse:
@@ -42,38 +46,32 @@ class AddressView(HTTPMethodView):
         :param pk: primary key of address table
         :return: JSON object with results
         """
+        changes: Dict[str, Any] = validate_update(Address, request.json)
+        payload: Dict[str, Any] = {k: v for k, v in changes.items() if k not in ['id', 'created_on', 'created_by']}
         session: AsyncSession = request.ctx.session
-        payload: Dict[str, Any] = {k: v for k, v in request.json.items() if k not in ['id', 'created_on', 'created_by']}
         async with session.begin():
+            invalidate(session, f'address:{pk}', *owner_tags(payload))
+            record_changes(session, 'address', pk)
             stmt: Update = update(Address).where(Address.id == pk).values(**payload)
             await session.execute(stmt)
         async with session.begin():
-            stmt: Select = select(Address).where(Address.id == pk)
+            stmt: Select = Address.select_columns().where(Address.id == pk)
             result: Result = await session.execute(stmt)
-            address: Address = result.scalar()
-        return json(address.to_dict(), default=str)
+            address: Row = result.first()
+        return json(Address.row_dict(address), default=str)
 
 
 class AddressesView(HTTPMethodView):
 
     @staticmethod
-    async def get(request: Request) -> HTTPResponse:
+    async def get(request: Request) -> Optional[HTTPResponse]:
         """
-        Gets address collection from database.
+        Gets address collection from database, streamed in chunks.
 
         :param request: `Request` object
         :return: JSON object with results
         """
-        session: AsyncSession = request.ctx.session
-        async with session.begin():
-            stmt: Select = select(Address)
-            results: Result = await session.execute(stmt)
-            addresses: List[Address] = results.scalars().fetchall()
-
-        if not addresses:
-            return json(dict())
-
-        return json([row.to_dict() for row in addresses], default=str)
+        return await json_rows(request, Address.select_columns(), empty=dict())
 
     @staticmethod
     async def post(request: Request) -> HTTPResponse:
@@ -83,10 +81,12 @@ class AddressesView(HTTPMethodView):
         :param request: `Request` object
         :return: JSON with id and timestamp
         """
+        payload: Dict[str, Any] = validate_insert(Address, request.json)
         session: AsyncSession = request.ctx.session
         async with session.begin():
-            address: Address = Address(**request.json)
+            address: Address = Address(**payload)
             session.add_all([address])
+            invalidate(session, *owner_tags(payload))
         json_data: Dict[str, Any] = address.to_dict()
         return json(json_data, default=str)
 
@@ -0,0 +1,154 @@
+from admin import admin_only
+from cache import response_cache
+from profiling import MODES, profile_store, profile_summary, render_profile
+from sanic import Blueprint
+from sanic.exceptions import InvalidUsage, NotFound
+from sanic.request import Request
+from sanic.response import json, empty, raw, HTTPResponse
+from sanic.views import HTTPMethodView
+from slow_query import slow_query_log
+from typing import Any, Dict, Optional
+
+
+class SlowQueriesView(HTTPMethodView):
+    decorators = [admin_only]
+
+    @staticmethod
+    async def get(request: Request) -> HTTPResponse:
+        """
+        Gets the slow query log of this worker, newest first.
+
+        :param request: `Request` object
+        :return: JSON object with results
+        """
+        return json({
+            "threshold_ms": slow_query_log.threshold * 1000,
+            "suppressed": slow_query_log.suppressed,
+            "entries": list(reversed(slow_query_log.entries)),
+        })
+
+    @staticmethod
+    async def delete(request: Request) -> HTTPResponse:
+        """
+        Clears the slow query log of this worker.
+
+        :param request: `Request` object
+        :return: empty response
+        """
+        slow_query_log.entries.clear()
+        slow_query_log.suppressed = 0
+        return empty()
+
+
+class CacheView(HTTPMethodView):
+    decorators = [admin_only]
+
+    @staticmethod
+    async def get(request: Request) -> HTTPResponse:
+        """
+        Gets the response cache statistics of this worker.
+
+        :param request: `Request` object
+        :return: JSON object with results
+        """
+        return json({
+            "entries": len(response_cache.entries),
+            "bytes": response_cache.size,
+            "max_entries": response_cache.max_entries,
+            "max_bytes": response_cache.max_bytes,
+            "ttl": response_cache.ttl,
+            "hits": response_cache.hits,
+            "misses": response_cache.misses,
+            "evictions": response_cache.evictions,
+            "invalidations": response_cache.invalidations,
+        })
+
+    @staticmethod
+    async def delete(request: Request) -> HTTPResponse:
+        """
+        Drops every entry of the response cache of this worker.
+
+        :param request: `Request` object
+        :return: empty response
+        """
+        response_cache.clear()
+        return empty()
+
+
+class ProfilesView(HTTPMethodView):
+    decorators = [admin_only]
+
+    @staticmethod
+    async def get(request: Request) -> HTTPResponse:
+        """
+        Gets the profiling settings and the profiles stored by this worker, newest first.
+
+        :param request: `Request` object
+        :return: JSON object with results
+        """
+        return json({
+            "rate": profile_store.rate,
+            "mode": profile_store.mode,
+            "profiles": [profile_summary(profile) for profile in reversed(profile_store.profiles)],
+        })
+
+    @staticmethod
+    async def put(request: Request) -> HTTPResponse:
+        """
+        Changes the sampled fraction of requests (`rate`) and the profiler used for them (`mode`) on this worker.
+
+        :param request: `Request` object
+        :return: JSON object with the new settings
+        """
+        payload: Dict[str, Any] = request.json or {}
+        rate: float = payload.get("rate", profile_store.rate)
+        mode: str = payload.get("mode", profile_store.mode)
+        if not isinstance(rate, (int, float)) or not 0 <= rate <= 1:
+            raise InvalidUsage("rate must be a number between 0 and 1")
+        if mode not in MODES:
+            raise InvalidUsage(f"mode must be one of {', '.join(MODES)}")
+        profile_store.rate, profile_store.mode = rate, mode
+        return json({"rate": profile_store.rate, "mode": profile_store.mode})
+
+    @staticmethod
+    async def delete(request: Request) -> HTTPResponse:
+        """
+        Drops the profiles stored by this worker.
+
+        :param request: `Request` object
+        :return: empty response
+        """
+        profile_store.profiles.clear()
+        return empty()
+
+
+class ProfileView(HTTPMethodView):
+    decorators = [admin_only]
+
+    @staticmethod
+    async def get(request: Request, pk: int) -> HTTPResponse:
+        """
+        Downloads a profile. `format` is `pstats` (default) or `text` for cProfile profiles and `collapsed` (default)
+        or `text` for sampled ones.
+
+        :param request: `Request` object
+        :param pk: profile id
+        :return: profile data
+        """
+        profile: Optional[Dict[str, Any]] = profile_store.get(pk)
+        if profile is None:
+            raise NotFound(f"Profile {pk} not found")
+        output_format: str = request.args.get("format", "pstats" if profile["mode"] == "cprofile" else "collapsed")
+        body: Optional[bytes] = render_profile(profile, output_format)
+        if body is None:
+            raise InvalidUsage(f"Profile {pk} cannot be rendered as {output_format}")
+        if output_format == "pstats":
+            return raw(body, headers={"Content-Disposition": f'attachment; filename="profile-{pk}.pstats"'})
+        return raw(body, content_type="text/plain; charset=utf-8")
+
+
+bp_admin = Blueprint("admin", url_prefix="/admin/")
+bp_admin.add_route(SlowQueriesView.as_view(), "/slow-queries")
+bp_admin.add_route(CacheView.as_view(), "/cache")
+bp_admin.add_route(ProfilesView.as_view(), "/profiles")
+bp_admin.add_route(ProfileView.as_view(), "/profiles/<pk:int>")
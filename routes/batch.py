@@ -0,0 +1,152 @@
+import json as json_module
+import re
+from idempotency import IdempotentSession
+from inspect import isawaitable
+from sanic import Blueprint
+from sanic.exceptions import InvalidUsage, SanicException
+from sanic.log import logger
+from sanic.request import Request
+from sanic.response import json, HTTPResponse
+from sanic.views import HTTPMethodView
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, List, Optional
+
+MAX_OPERATIONS: int = 100
+
+# "$<operation index>.<key>.<key>...", replaced by a value of the response body of an earlier operation
+REFERENCE = re.compile(r'^\$(\d+)((?:\.[^.]+)*)$')
+
+
+class BatchSession(AsyncSession):
+    """
+    Session shared by the operations of a batch. The batch owns the transaction, so the `session.begin()` blocks of
+    the dispatched views only flush, which assigns ids and surfaces errors at the operation that caused them.
+    """
+
+    def begin(self, **kw):
+        if self.in_transaction():
+            return _FlushOnExit(self)
+        return super().begin(**kw)
+
+
+class _FlushOnExit:
+
+    def __init__(self, session: AsyncSession) -> None:
+        self.session: AsyncSession = session
+
+    async def __aenter__(self) -> '_FlushOnExit':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> bool:
+        if exc_type is None:
+            await self.session.flush()
+        return False
+
+
+class OperationFailed(Exception):
+
+    def __init__(self, index: int, status: int, message: Any) -> None:
+        super().__init__(message)
+        self.index: int = index
+        self.status: int = status
+        self.message: Any = message
+
+
+def resolve_references(value: Any, results: List[Dict[str, Any]]) -> Any:
+    """
+    Replaces `$<index>.<key>...` strings in an operation with values from the responses of earlier operations, for
+    example `"$0.id"` with the id of the row created by the first operation. Keys index lists when they are numbers.
+    """
+    if isinstance(value, dict):
+        return {k: resolve_references(v, results) for k, v in value.items()}
+    if isinstance(value, list):
+        return [resolve_references(v, results) for v in value]
+    if not isinstance(value, str):
+        return value
+    match = REFERENCE.match(value)
+    if match is None:
+        return value
+    index: int = int(match.group(1))
+    if index >= len(results):
+        raise InvalidUsage(f"{value} refers to an operation that has not run yet")
+    resolved: Any = results[index]['body']
+    for key in match.group(2).split('.')[1:]:
+        try:
+            resolved = resolved[int(key)] if isinstance(resolved, list) else resolved[key]
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise InvalidUsage(f"{value} does not match the response of operation {index}")
+    return resolved
+
+
+async def run_operation(
+        request: Request, session: AsyncSession, index: int, operation: Dict[str, Any], results: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    method: str = str(operation.get('method', 'GET')).upper()
+    path: str = '/'.join(str(resolve_references(part, results)) for part in str(operation.get('path', '')).split('/'))
+    if not path.startswith('/') or path.rstrip('/') == '/batch' or path.startswith('/ws/'):
+        raise OperationFailed(index, 400, f"Operation path {path!r} cannot be batched")
+    route, handler, params = request.app.router.get(path.split('?')[0], method, None)
+    sub_request: Request = Request(path.encode(), request.headers, request.version, method, None, request.app)
+    sub_request.route = route
+    sub_request.parsed_json = resolve_references(operation.get('body'), results)
+    sub_request.ctx.session = session
+    sub_request.ctx.in_batch = True
+    response = handler(sub_request, **params)
+    if isawaitable(response):
+        response = await response
+    body: Any = response.body.decode() if response.body else None
+    if body and response.content_type.startswith('application/json'):
+        body = json_module.loads(body)
+    if response.status >= 400:
+        raise OperationFailed(index, response.status, body)
+    return {'status': response.status, 'body': body}
+
+
+class BatchView(HTTPMethodView):
+
+    @staticmethod
+    async def post(request: Request) -> HTTPResponse:
+        """
+        Runs a list of `{"method", "path", "body"}` operations in order, in a single transaction, with the views of
+        the individual endpoints. Paths and bodies may refer to the responses of earlier operations with
+        `$<index>.<key>...` strings. When an operation fails, the whole batch is rolled back and the response names the
+        failed operation.
+
+        :param request: `Request` object
+        :return: JSON object with the status and body of every operation
+        """
+        payload: Any = request.json
+        operations: Optional[List[Dict[str, Any]]] = payload.get('operations') if isinstance(payload, dict) else None
+        if not isinstance(operations, list) or not all(isinstance(operation, dict) for operation in operations):
+            raise InvalidUsage("operations must be a list of objects")
+        if len(operations) > MAX_OPERATIONS:
+            raise InvalidUsage(f"A batch can run at most {MAX_OPERATIONS} operations")
+
+        # An idempotent batch runs in the transaction of the request, which is committed with the stored response
+        own_session: bool = not isinstance(request.ctx.session, IdempotentSession)
+        session: AsyncSession = (
+            BatchSession(request.ctx.session.bind, expire_on_commit=False) if own_session else request.ctx.session
+        )
+        results: List[Dict[str, Any]] = []
+        try:
+            async with session.begin():
+                for index, operation in enumerate(operations):
+                    try:
+                        results.append(await run_operation(request, session, index, operation, results))
+                    except OperationFailed:
+                        raise
+                    except SanicException as e:
+                        raise OperationFailed(index, e.status_code, str(e))
+                    except Exception as e:
+                        logger.exception("Batch operation %s failed: %s", index, e)
+                        raise OperationFailed(index, 500, "Internal Server Error")
+        except OperationFailed as e:
+            return json({'failed_operation': e.index, 'status': e.status, 'message': e.message}, status=e.status)
+        finally:
+            if own_session:
+                await session.close()
+        return json({'results': results})
+
+
+bp_batch = Blueprint("batch", url_prefix="/batch")
+bp_batch.add_route(BatchView.as_view(), "/")
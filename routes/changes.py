@@ -0,0 +1,86 @@
+import asyncio
+import json
+from change_feed import ENTITY_MODELS, change_head, load_changes
+from change_stream import Subscriber, change_stream
+from sanic import Blueprint
+from sanic.exceptions import InvalidUsage
+from sanic.request import Request
+from sanic.response import json as json_response, HTTPResponse
+from sanic.views import HTTPMethodView
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, FrozenSet, Iterable, Optional
+
+MAX_CHANGES: int = 1000
+
+
+class ChangesView(HTTPMethodView):
+
+    @staticmethod
+    async def get(request: Request) -> HTTPResponse:
+        """
+        Gets the rows changed since the `since` token, grouped by entity. Without `since` only the current token is
+        returned, the starting point after a full download. Clients pass the returned token on the next call and
+        call again right away while `has_more` is true.
+
+        :param request: `Request` object
+        :return: JSON object with results
+        """
+        session: AsyncSession = request.ctx.session
+        since = request.args.get('since')
+        if since is None:
+            return json_response({'token': await change_head(session), 'has_more': False, 'changes': {}})
+        try:
+            since = int(since)
+            limit: int = min(int(request.args.get('limit', MAX_CHANGES)), MAX_CHANGES)
+        except ValueError:
+            raise InvalidUsage("since and limit must be integers")
+        if since < 0 or limit < 1:
+            raise InvalidUsage("since must not be negative and limit must be positive")
+        return json_response(await load_changes(session, since, limit), default=str)
+
+
+def _entity_filter(entities: Iterable[str]) -> FrozenSet[str]:
+    return frozenset(entity for entity in entities if entity in ENTITY_MODELS)
+
+
+async def change_socket(request: Request, ws) -> None:
+    """
+    Pushes change events `{"entity", "id", "version"}` as rows are written. The `entity` and `organization` query
+    parameters, repeatable, restrict the events; a JSON message `{"entities": [...], "organizations": [...]}`
+    replaces the filters. The first message is `{"type": "hello", "version"}`, the version to pass to `/changes` to
+    fetch the rows; `{"type": "reset", "version"}` means events were dropped because the client read too slowly.
+
+    :param request: `Request` object
+    :param ws: websocket connection
+    """
+    subscriber = Subscriber(
+        _entity_filter(request.args.getlist('entity', [])), frozenset(request.args.getlist('organization', [])),
+        change_stream.queue_size
+    )
+    # Subscribed before the hello is sent, so events published meanwhile are queued behind it
+    subscriber.sent_version = change_stream.version
+    change_stream.subscribers.add(subscriber)
+    sender: Optional[asyncio.Task] = None
+    try:
+        await ws.send(json.dumps({'type': 'hello', 'version': subscriber.sent_version}))
+        sender = asyncio.get_running_loop().create_task(subscriber.send_all(ws))
+        while True:
+            message = await ws.recv()
+            try:
+                filters: Dict[str, Any] = json.loads(message)
+                subscriber.entities = _entity_filter(filters.get('entities') or [])
+                subscriber.organizations = frozenset(filters.get('organizations') or [])
+            except (ValueError, TypeError, AttributeError):
+                await ws.close(1003, 'Expected {"entities": [...], "organizations": [...]}')
+                return
+    finally:
+        change_stream.subscribers.discard(subscriber)
+        if sender is not None:
+            sender.cancel()
+
+
+bp_changes = Blueprint("changes", url_prefix="/changes")
+bp_changes.add_route(ChangesView.as_view(), "/")
+
+bp_change_stream = Blueprint("change_stream", url_prefix="/ws")
+bp_change_stream.add_websocket_route(change_socket, "/changes")
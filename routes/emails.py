@@ -1,14 +1,18 @@
+from cache import invalidate, owner_tags
+from change_feed import record_changes
 from models.models import Email
+from routes.streaming import json_rows
 from sanic import Blueprint
 from sanic.request import Request
 from sanic.response import json, HTTPResponse
 from sanic.views import HTTPMethodView
-from sqlalchemy import select, update
-from sqlalchemy.engine import Result
+from sqlalchemy import update
+from sqlalchemy.engine import Result, Row
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.selectable import Select
 from sqlalchemy.sql.dml import Update
-from typing import Any, Dict, List
+from typing import Any, Dict, Optional
+from validation import validate_insert, validate_update
 
 
 class EmailView(HTTPMethodView):
@@ -24,14 +28,14 @@ class EmailView(HTTPMethodView):
         """
         session: AsyncSession = request.ctx.session
         async with session.begin():
-            stmt: Select = select(Email).where(Email.id == pk)
+            stmt: Select = Email.select_columns().where(Email.id == pk)
             result: Result = await session.execute(stmt)
-            email: Email = result.scalar()
+            email: Row = result.first()
 
         if not email:
             return json(dict())
 
-        return json(email.to_dict(), default=str)
+        return json(Email.row_dict(email), default=str)
 
     @staticmethod
     async def patch(request: Request, pk: str) -> HTTPResponse:
@@ -42,38 +46,32 @@ class EmailView(HTTPMethodView):
         :param pk: primary key of email table
         :return: JSON object with results
         """
+        changes: Dict[str, Any] = validate_update(Email, request.json)
+        payload: Dict[str, Any] = {k: v for k, v in changes.items() if k not in ['id', 'created_on', 'created_by']}
         session: AsyncSession = request.ctx.session
-        payload: Dict[str, Any] = {k: v for k, v in request.json.items() if k not in ['id', 'created_on', 'created_by']}
         async with session.begin():
+            invalidate(session, f'email:{pk}', *owner_tags(payload))
+            record_changes(session, 'email', pk)
             stmt: Update = update(Email).where(Email.id == pk).values(**payload)
             await session.execute(stmt)
         async with session.begin():
-            stmt: Select = select(Email).where(Email.id == pk)
+            stmt: Select = Email.select_columns().where(Email.id == pk)
             result: Result = await session.execute(stmt)
-            email: Email = result.scalar()
-        return json(email.to_dict(), default=str)
+            email: Row = result.first()
+        return json(Email.row_dict(email), default=str)
 
 
 class EmailsView(HTTPMethodView):
 
     @staticmethod
-    async def get(request: Request) -> HTTPResponse:
+    async def get(request: Request) -> Optional[HTTPResponse]:
         """
-        Gets email collection from database.
+        Gets email collection from database, streamed in chunks.
 
         :param request: `Request` object
         :return: JSON object with results
         """
-        session: AsyncSession = request.ctx.session
-        async with session.begin():
-            stmt: Select = select(Email)
-            results: Result = await session.execute(stmt)
-            emails: List[Email] = results.scalars().fetchall()
-
-        if not emails:
-            return json(dict())
-
-        return json([row.to_dict() for row in emails], default=str)
+        return await json_rows(request, Email.select_columns(), empty=dict())
 
     @staticmethod
     async def post(request: Request) -> HTTPResponse:
@@ -83,10 +81,12 @@ class EmailsView(HTTPMethodView):
         :param request: `Request` object
         :return: JSON with id and timestamp
         """
+        payload: Dict[str, Any] = validate_insert(Email, request.json)
         session: AsyncSession = request.ctx.session
         async with session.begin():
-            email: Email = Email(**request.json)
+            email: Email = Email(**payload)
             session.add_all([email])
+            invalidate(session, *owner_tags(payload))
         json_data: Dict[str, Any] = email.to_dict()
         return json(json_data, default=str)
 
@@ -0,0 +1,89 @@
+import os
+from admin import admin_only
+from jobs import JOB_KINDS, export_path, job_runner, load_job
+from sanic import Blueprint
+from sanic.compat import open_async
+from sanic.exceptions import InvalidUsage, NotFound
+from sanic.request import Request
+from sanic.response import json, HTTPResponse
+from sanic.views import HTTPMethodView
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, Optional
+
+DOWNLOAD_CHUNK: int = 64 * 1024
+
+
+class JobsView(HTTPMethodView):
+    decorators = [admin_only]
+
+    @staticmethod
+    async def post(request: Request) -> HTTPResponse:
+        """
+        Queues a background job `{"kind", "params"}`. Kinds are `export` (`entity`), `import` (`entity`, `rows`),
+        `rebuild_membership_statistics` and `rebuild_organization_closure`.
+
+        :param request: `Request` object
+        :return: JSON object with the queued job
+        """
+        payload: Any = request.json
+        if not isinstance(payload, dict) or payload.get('kind') not in JOB_KINDS:
+            raise InvalidUsage(f"kind must be one of {', '.join(sorted(JOB_KINDS))}")
+        params: Any = payload.get('params', {})
+        if not isinstance(params, dict):
+            raise InvalidUsage("params must be an object")
+        session: AsyncSession = request.ctx.session
+        async with session.begin():
+            job_id: str = await job_runner.enqueue(session, payload['kind'], params)
+        job_runner.wake()
+        return json(await load_job(session, job_id), status=202, default=str)
+
+
+class JobView(HTTPMethodView):
+    decorators = [admin_only]
+
+    @staticmethod
+    async def get(request: Request, pk: str) -> HTTPResponse:
+        """
+        Gets the status, progress and result of a background job.
+
+        :param request: `Request` object
+        :param pk: job id
+        :return: JSON object with results
+        """
+        job: Optional[Dict[str, Any]] = await load_job(request.ctx.session, pk)
+        if job is None:
+            raise NotFound(f"Job {pk} not found")
+        return json(job, default=str)
+
+
+class JobResultView(HTTPMethodView):
+    decorators = [admin_only]
+
+    @staticmethod
+    async def get(request: Request, pk: str) -> None:
+        """
+        Downloads the rows written by a finished export job as JSON lines, streamed in chunks.
+
+        :param request: `Request` object
+        :param pk: job id
+        """
+        job: Optional[Dict[str, Any]] = await load_job(request.ctx.session, pk)
+        path: str = export_path(pk)
+        if job is None or job['kind'] != 'export' or job['status'] != 'succeeded' or not os.path.exists(path):
+            raise NotFound(f"Job {pk} has no export to download")
+        response = await request.respond(
+            content_type='application/x-ndjson', headers={'Content-Disposition': f'attachment; filename="{pk}.jsonl"'}
+        )
+        async with await open_async(path, mode='rb') as file:
+            while True:
+                chunk: bytes = await file.read(DOWNLOAD_CHUNK)
+                if not chunk:
+                    break
+                await response.send(chunk)
+        await response.eof()
+
+
+bp_jobs = Blueprint("jobs", url_prefix="/jobs")
+bp_jobs.add_route(JobsView.as_view(), "/")
+bp_jobs.add_route(JobView.as_view(), "/<pk:str>")
+bp_jobs.add_route(JobResultView.as_view(), "/<pk:str>/result")
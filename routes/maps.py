@@ -1,27 +1,29 @@
 import data_types.data_types as t
-import datetime
 import models.models as m
 import queries.queries as q
 import uuid
+from cache import invalidate
+from change_feed import record_changes
 from sanic import Blueprint
 from sanic.request import Request
 from sanic.response import json, HTTPResponse
 from sanic.views import HTTPMethodView
-from sqlalchemy import select, update
+from sqlalchemy import update
 from sqlalchemy.dialects.sqlite import insert, Insert
-from sqlalchemy.engine import Result
+from sqlalchemy.engine import Result, Row
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.selectable import Select
 from sqlalchemy.sql.dml import Update
 from typing import Any, Dict, List
+from validation import validate_insert_rows, validate_update
 
 
-def process_map_item(map_item: t.MapJS) -> t.MapPython:
+def process_map_item(map_item: Dict[str, Any]) -> t.MapPython:
+    """
+    Completes a validated map item, whose `created_on` is already parsed, with a new id.
+    """
     map_item.setdefault('id', str(uuid.uuid1()))
-    return {
-        k: v if k != 'created_on' else datetime.datetime.strptime(v, '%Y-%m-%dT%H:%M:%S.%fZ')
-        for k, v in map_item.items()
-    }
+    return map_item
 
 
 class GenderView(HTTPMethodView):
@@ -37,14 +39,14 @@ class GenderView(HTTPMethodView):
         """
         session: AsyncSession = request.ctx.session
         async with session.begin():
-            stmt: Select = select(self.DBObject).where(self.DBObject.id == pk)
+            stmt: Select = self.DBObject.select_columns().where(self.DBObject.id == pk)
             result: Result = await session.execute(stmt)
-            gender: GenderView.DBObject = result.scalar()
+            gender: Row = result.first()
 
         if not gender:
             return json(dict())
 
-        return json(gender.to_dict(), default=str)
+        return json(self.DBObject.row_dict(gender), default=str)
 
     async def patch(self, request: Request, pk: str) -> HTTPResponse:
         """
@@ -54,16 +56,19 @@ class GenderView(HTTPMethodView):
         :param pk: primary key of gender table
         :return: JSON object with results
         """
+        changes: Dict[str, Any] = validate_update(self.DBObject, request.json)
+        payload: Dict[str, Any] = {k: v for k, v in changes.items() if k not in ['id', 'created_on', 'created_by']}
         session: AsyncSession = request.ctx.session
-        payload: Dict[str, Any] = {k: v for k, v in request.json.items() if k not in ['id', 'created_on', 'created_by']}
         async with session.begin():
+            invalidate(session, 'maps')
+            record_changes(session, self.DBObject.__tablename__, pk)
             stmt: Update = update(self.DBObject).where(self.DBObject.id == pk).values(**payload)
             await session.execute(stmt)
         async with session.begin():
-            stmt: Select = select(self.DBObject).where(self.DBObject.id == pk)
+            stmt: Select = self.DBObject.select_columns().where(self.DBObject.id == pk)
             result: Result = await session.execute(stmt)
-            gender: GenderView.DBObject = result.scalar()
-        return json(gender.to_dict(), default=str)
+            gender: Row = result.first()
+        return json(self.DBObject.row_dict(gender), default=str)
 
 
 class GendersView(HTTPMethodView):
@@ -78,14 +83,14 @@ class GendersView(HTTPMethodView):
         """
         session: AsyncSession = request.ctx.session
         async with session.begin():
-            stmt: Select = select(self.DBObject)
+            stmt: Select = self.DBObject.select_columns()
             results: Result = await session.execute(stmt)
-            genders: List[GenderView.DBObject] = results.scalars().fetchall()
+            genders: List[Row] = results.all()
 
         if not genders:
             return json(dict())
 
-        return json([row.to_dict() for row in genders], default=str)
+        return json(self.DBObject.row_dicts(genders), default=str)
 
     async def post(self, request: Request) -> HTTPResponse:
         """
@@ -94,18 +99,21 @@ class GendersView(HTTPMethodView):
         :param request: `Request` object
         :return: JSON with updated mapping results
         """
+        data: Any = request.json.get('data', []) if isinstance(request.json, dict) else request.json
+        items: List[t.MapPython] = [process_map_item(row) for row in validate_insert_rows(self.DBObject, data, 'data')]
         session: AsyncSession = request.ctx.session
-        items: List[t.MapPython] = [process_map_item(row) for row in request.json.get('data', [])]
         async with session.begin():
+            invalidate(session, 'maps')
+            record_changes(session, self.DBObject.__tablename__, *(item['id'] for item in items))
             for item in items:
                 upsert_stmt: Insert = insert(self.DBObject).values(item).on_conflict_do_update(
                     index_elements=['id'], set_=item
                 )
                 await session.execute(upsert_stmt)
-            stmt: Select = select(self.DBObject)
+            stmt: Select = self.DBObject.select_columns()
             results: Result = await session.execute(stmt)
-            genders: List[GenderView.DBObject] = results.scalars().fetchall()
-        return json([row.to_dict() for row in genders], default=str)
+            genders: List[Row] = results.all()
+        return json(self.DBObject.row_dicts(genders), default=str)
 
 
 class MembershipFeeCategoryView(GenderView):
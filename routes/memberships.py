@@ -1,14 +1,23 @@
+import datetime
+from cache import invalidate, owner_tags
+from change_feed import record_changes
+from membership_statistics import add_member_statistics, MemberPair, membership_pairs
 from models.models import Membership, Organization, Person
+from queries.prepared import fetch, PreparedQuery
+from queries.queries import query_latest_membership_events
+from routes.streaming import json_rows
 from sanic import Blueprint
+from sanic.exceptions import InvalidUsage
 from sanic.request import Request
 from sanic.response import json, HTTPResponse
 from sanic.views import HTTPMethodView
-from sqlalchemy import select, update
+from sqlalchemy import bindparam, func, select, update
 from sqlalchemy.engine import Result, Row
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.sql.selectable import Select
+from sqlalchemy.sql.selectable import Select, Subquery
 from sqlalchemy.sql.dml import Update
-from typing import Any, Dict
+from typing import Any, Dict, Optional, Set
+from validation import validate_insert, validate_update
 
 
 query_membership: Select = select(
@@ -23,6 +32,37 @@ query_membership: Select = select(
     Membership.notes,
 ).join(Person).join(Organization)
 
+prepared_membership: PreparedQuery = PreparedQuery(query_membership.where(Membership.id == bindparam('pk')))
+
+
+def membership_state_stmt(request: Request) -> Select:
+    """
+    Builds the query of the latest membership event per (organization, person) pair, restricted by the optional
+    `person_id` and `organization_id` request arguments.
+
+    :param request: `Request` object
+    :return: `Select` object expecting `as_of_date` parameter
+    """
+    stmt: Select = query_latest_membership_events
+    if 'person_id' in request.args:
+        stmt = stmt.where(Membership.person_id == request.args.get('person_id'))
+    if 'organization_id' in request.args:
+        stmt = stmt.where(Membership.organization_id == request.args.get('organization_id'))
+    return stmt
+
+
+def as_of_date(request: Request) -> datetime.date:
+    """
+    Parses the `date` request argument, defaulting to today.
+
+    :param request: `Request` object
+    :return: date of the requested state
+    """
+    try:
+        return datetime.date.fromisoformat(request.args.get('date', datetime.date.today().isoformat()))
+    except ValueError:
+        raise InvalidUsage("Argument 'date' must be in YYYY-MM-DD format")
+
 
 class MembershipView(HTTPMethodView):
 
@@ -37,8 +77,7 @@ class MembershipView(HTTPMethodView):
         """
         session: AsyncSession = request.ctx.session
         async with session.begin():
-            stmt: Select = query_membership.where(Membership.id == pk)
-            result: Result = await session.execute(stmt)
+            result: Result = await fetch(session, prepared_membership(pk=pk))
             membership: Row = result.first()
 
         if not membership:
@@ -55,33 +94,35 @@ class MembershipView(HTTPMethodView):
         :param pk: primary key of membership table
         :return: JSON object with results
         """
+        changes: Dict[str, Any] = validate_update(Membership, request.json)
+        payload: Dict[str, Any] = {k: v for k, v in changes.items() if k not in ['id', 'created_on', 'created_by']}
         session: AsyncSession = request.ctx.session
-        payload: Dict[str, Any] = {k: v for k, v in request.json.items() if k not in ['id', 'created_on', 'created_by']}
         async with session.begin():
+            invalidate(session, f'membership:{pk}', *owner_tags(payload))
+            record_changes(session, 'membership', pk)
+            pairs: Set[MemberPair] = await membership_pairs(session, pk, payload)
+            await add_member_statistics(session, pairs, -1)
             stmt: Update = update(Membership).where(Membership.id == pk).values(**payload)
             await session.execute(stmt)
+            await add_member_statistics(session, pairs)
         async with session.begin():
-            stmt: Select = select(Membership).where(Membership.id == pk)
+            stmt: Select = Membership.select_columns().where(Membership.id == pk)
             result: Result = await session.execute(stmt)
-            membership: Membership = result.scalar()
-        return json(membership.to_dict(), default=str)
+            membership: Row = result.first()
+        return json(Membership.row_dict(membership), default=str)
 
 
 class MembershipsView(HTTPMethodView):
 
     @staticmethod
-    async def get(request: Request) -> HTTPResponse:
+    async def get(request: Request) -> Optional[HTTPResponse]:
         """
-        Gets membership collection from database.
+        Gets membership collection from database, streamed in chunks.
 
         :param request: `Request` object
         :return: JSON object with results
         """
-        session: AsyncSession = request.ctx.session
-        async with session.begin():
-            results: Result = await session.execute(query_membership)
-
-        return json(list(map(dict, results)), default=str)
+        return await json_rows(request, query_membership)
 
     @staticmethod
     async def post(request: Request) -> HTTPResponse:
@@ -91,14 +132,63 @@ class MembershipsView(HTTPMethodView):
         :param request: `Request` object
         :return: JSON with id and timestamp
         """
+        payload: Dict[str, Any] = validate_insert(Membership, request.json)
         session: AsyncSession = request.ctx.session
+        pairs: Set[MemberPair] = {(payload['organization_id'], payload['person_id'])}
         async with session.begin():
-            membership: Membership = Membership(**request.json)
+            await add_member_statistics(session, pairs, -1)
+            membership: Membership = Membership(**payload)
             session.add_all([membership])
+            invalidate(session, *owner_tags(payload))
+            await session.flush()
+            await add_member_statistics(session, pairs)
         json_data: Dict[str, Any] = membership.to_dict()
         return json(json_data, default=str)
 
 
+class MembershipStatusView(HTTPMethodView):
+
+    @staticmethod
+    async def get(request: Request) -> Optional[HTTPResponse]:
+        """
+        Gets the membership state of every (organization, person) pair as of `date` argument (default today),
+        optionally filtered by `person_id`, `organization_id` and `active_flag` arguments. Streamed in chunks.
+
+        :param request: `Request` object
+        :return: JSON object with results
+        """
+        stmt: Select = membership_state_stmt(request)
+        if 'active_flag' in request.args:
+            stmt = stmt.where(stmt.selected_columns.active_flag == request.args.get('active_flag'))
+        return await json_rows(request, stmt, {'as_of_date': as_of_date(request)})
+
+
+class MembershipHeadcountView(HTTPMethodView):
+
+    @staticmethod
+    async def get(request: Request) -> HTTPResponse:
+        """
+        Gets the number of active and inactive members per organization as of `date` argument (default today).
+
+        :param request: `Request` object
+        :return: JSON object with results
+        """
+        session: AsyncSession = request.ctx.session
+        state: Subquery = membership_state_stmt(request).subquery('membership_state')
+        stmt: Select = select(
+            state.c.organization_id,
+            state.c.organization_name,
+            func.count().filter(state.c.active_flag == 'Y').label('active_count'),
+            func.count().filter(state.c.active_flag == 'N').label('inactive_count'),
+        ).group_by(state.c.organization_id, state.c.organization_name).order_by(state.c.organization_name)
+        async with session.begin():
+            results: Result = await session.execute(stmt, {'as_of_date': as_of_date(request)})
+
+        return json(list(map(dict, results)), default=str)
+
+
 bp_memberships = Blueprint("memberships", url_prefix="/memberships/")
 bp_memberships.add_route(MembershipView.as_view(), '/<pk:str>')
 bp_memberships.add_route(MembershipsView.as_view(), '/')
+bp_memberships.add_route(MembershipStatusView.as_view(), '/status')
+bp_memberships.add_route(MembershipHeadcountView.as_view(), '/headcount')
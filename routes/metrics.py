@@ -0,0 +1,22 @@
+from metrics import registry
+from sanic import Blueprint
+from sanic.request import Request
+from sanic.response import text, HTTPResponse
+from sanic.views import HTTPMethodView
+
+
+class MetricsView(HTTPMethodView):
+
+    @staticmethod
+    async def get(request: Request) -> HTTPResponse:
+        """
+        Gets request and database metrics of this worker in Prometheus text format.
+
+        :param request: `Request` object
+        :return: Prometheus text exposition
+        """
+        return text(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+bp_metrics = Blueprint("metrics", url_prefix="/metrics")
+bp_metrics.add_route(MetricsView.as_view(), "/")
@@ -1,21 +1,31 @@
 import data_types.data_types as t
 import models.models as m
+from cache import cached_response, invalidate, row_tags
+from change_feed import record_changes
+from hierarchy import insert_organization_node, move_organization_node
 from math import ceil
+from membership_statistics import add_member_statistics, MemberPair, membership_pairs
+from parallel_reads import read_all
+from queries.prepared import BoundQuery, fetch, PreparedQuery
 from queries.queries import (
-    query_organization_address, query_organization_email, query_organization_phone, query_organization_membership,
-    query_organization, query_address_type, query_email_type, query_phone_type, query_organization_count,
-    query_parent_organizations
+    prepared_organization_address, prepared_organization_email, prepared_organization_phone,
+    prepared_organization_membership, prepared_organization, prepared_address_type, prepared_email_type,
+    prepared_phone_type, prepared_parent_organizations, prepared_organization_subtree,
+    prepared_organization_subtree_max_depth, prepared_organization_ancestors,
+    prepared_organization_descendant_membership, prepared_membership_statistics, prepared_membership_statistics_rollup,
+    query_organization, query_organization_count
 )
+from routes.streaming import json_rows
 from sanic import Blueprint
 from sanic.request import Request
 from sanic.response import json, HTTPResponse
 from sanic.views import HTTPMethodView
 from sqlalchemy import update
-from sqlalchemy.engine import Result, Row
+from sqlalchemy.engine import Result
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.sql.selectable import Select
 from sqlalchemy.sql.dml import Update
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Set
+from validation import validate_changes, validate_insert
 
 
 def process_organization_data(data: t.OrganizationJS) -> t.Organization:
@@ -34,7 +44,58 @@ def process_phone_data(data: List[t.OrganizationPhoneJS]) -> List[t.Organization
     pass
 
 
+EMPTY_ORGANIZATION_RESULT: t.OrganizationResult = {
+    "organization": dict(),
+    "address": list(),
+    "email": list(),
+    "phone": list(),
+    "membership": list(),
+    "parent_organizations": list(),
+    "address_type": list(),
+    "email_type": list(),
+    "phone_type": list(),
+}
+
+
+async def fetch_organization(session: AsyncSession, pk: str) -> Optional[t.OrganizationResult]:
+    """
+    Reads an organization together with contacts, memberships and the organization mappings.
+
+    :param session: `AsyncSession` object without an open transaction
+    :param pk: primary key of organization table
+    :return: organization data, None when the organization does not exist
+    """
+    (
+        organization, address, email, phone, membership, parent_organizations, address_type, email_type, phone_type
+    ) = await read_all(session, [
+        prepared_organization(pk=pk),
+        prepared_organization_address(pk=pk),
+        prepared_organization_email(pk=pk),
+        prepared_organization_phone(pk=pk),
+        prepared_organization_membership(pk=pk),
+        prepared_parent_organizations(),
+        prepared_address_type(),
+        prepared_email_type(),
+        prepared_phone_type(),
+    ])
+    if not organization:
+        return None
+
+    return {
+        "organization": dict(organization[0]),
+        "address": list(map(dict, address)),
+        "email": list(map(dict, email)),
+        "phone": list(map(dict, phone)),
+        "membership": list(map(dict, membership)),
+        "parent_organizations": list(map(dict, parent_organizations)),
+        "address_type": list(map(dict, address_type)),
+        "email_type": list(map(dict, email_type)),
+        "phone_type": list(map(dict, phone_type)),
+    }
+
+
 class OrganizationView(HTTPMethodView):
+    decorators = [cached_response]
 
     @staticmethod
     async def get(request: Request, pk: str) -> HTTPResponse:
@@ -45,52 +106,18 @@ class OrganizationView(HTTPMethodView):
         :param pk: primary key of organization table
         :return: JSON object with results
         """
-        session: AsyncSession = request.ctx.session
-        async with session.begin():
-            organization_stmt: Select = query_organization.where(m.Organization.id == pk)
-            organization_result: Result = await session.execute(organization_stmt)
-            organization: Row = organization_result.first()
-
-            address_stmt: Select = query_organization_address.where(m.Address.organization_id == pk)
-            address_result: Result = await session.execute(address_stmt)
-
-            email_stmt: Select = query_organization_email.where(m.Email.organization_id == pk)
-            email_result: Result = await session.execute(email_stmt)
-
-            phone_stmt: Select = query_organization_phone.where(m.Phone.organization_id == pk)
-            phone_result: Result = await session.execute(phone_stmt)
-
-            membership_stmt: Select = query_organization_membership.where(m.Membership.organization_id == pk)
-            membership_result: Result = await session.execute(membership_stmt)
-
-            parent_organizations: Result = await session.execute(query_parent_organizations)
-            address_type_result: Result = await session.execute(query_address_type)
-            email_type_result: Result = await session.execute(query_email_type)
-            phone_type_result: Result = await session.execute(query_phone_type)
-
-        if not organization:
-            return json({
-                "organization": dict(),
-                "address": list(),
-                "email": list(),
-                "phone": list(),
-                "membership": list(),
-                "parent_organizations": list(),
-                "address_type": list(),
-                "email_type": list(),
-                "phone_type": list(),
-            })
-
-        result_dict: t.OrganizationResult = {
-            "organization": dict(organization),
-            "address": list(map(dict, address_result)),
-            "email": list(map(dict, email_result)),
-            "phone": list(map(dict, phone_result)),
-            "membership": list(map(dict, membership_result)),
-            "parent_organizations": list(map(dict, parent_organizations)),
-            "address_type": list(map(dict, address_type_result)),
-            "email_type": list(map(dict, email_type_result)),
-            "phone_type": list(map(dict, phone_type_result)),
+        result_dict: Optional[t.OrganizationResult] = await fetch_organization(request.ctx.session, pk)
+        if not result_dict:
+            return json(EMPTY_ORGANIZATION_RESULT)
+
+        request.ctx.cache_tags = {
+            f'organization:{pk}', 'maps', 'parent_organizations',
+            *row_tags('organization', [result_dict['organization']], 'parent_organization_id'),
+            *row_tags('address', result_dict['address']),
+            *row_tags('email', result_dict['email']),
+            *row_tags('phone', result_dict['phone']),
+            *row_tags('membership', result_dict['membership']),
+            *row_tags('person', result_dict['membership'], 'person_id'),
         }
 
         return json(result_dict, default=str)
@@ -104,75 +131,40 @@ class OrganizationView(HTTPMethodView):
         :param pk: primary key of organization table
         :return: JSON object with results
         """
+        payload: t.OrganizationResult = validate_changes(t.OrganizationResult, request.json)
         session: AsyncSession = request.ctx.session
-        payload: t.OrganizationResult = request.json
         async with session.begin():
+            invalidate(session, f'organization:{pk}', 'parent_organizations')
+            record_changes(session, 'organization', pk)
+            if 'organization_parent_id' in payload['organization']:
+                await move_organization_node(session, pk, payload['organization']['organization_parent_id'])
             organization_stmt: Update = update(m.Organization).where(m.Organization.id == pk).values(
                 **payload['organization']
             )
             await session.execute(organization_stmt)
 
             for item in payload['address']:
+                record_changes(session, 'address', pk)
                 address_stmt: Update = update(m.Address).where(m.Address.id == pk).values(**item)
                 await session.execute(address_stmt)
             for item in payload['email']:
+                record_changes(session, 'email', pk)
                 email_stmt: Update = update(m.Email).where(m.Email.id == pk).values(**item)
                 await session.execute(email_stmt)
             for item in payload['phone']:
+                record_changes(session, 'phone', pk)
                 phone_stmt: Update = update(m.Phone).where(m.Phone.id == pk).values(**item)
                 await session.execute(phone_stmt)
             for item in payload['membership']:
+                record_changes(session, 'membership', pk)
+                pairs: Set[MemberPair] = await membership_pairs(session, pk, item)
+                await add_member_statistics(session, pairs, -1)
                 membership_stmt: Update = update(m.Membership).where(m.Membership.id == pk).values(**item)
                 await session.execute(membership_stmt)
+                await add_member_statistics(session, pairs)
 
-        async with session.begin():
-            organization_stmt: Select = query_organization.where(m.Organization.id == pk)
-            organization_result: Result = await session.execute(organization_stmt)
-            organization: Row = organization_result.first()
-
-            address_stmt: Select = query_organization_address.where(m.Address.organization_id == pk)
-            address_result: Result = await session.execute(address_stmt)
-
-            email_stmt: Select = query_organization_email.where(m.Email.organization_id == pk)
-            email_result: Result = await session.execute(email_stmt)
-
-            phone_stmt: Select = query_organization_phone.where(m.Phone.organization_id == pk)
-            phone_result: Result = await session.execute(phone_stmt)
-
-            membership_stmt: Select = query_organization_membership.where(m.Membership.organization_id == pk)
-            membership_result: Result = await session.execute(membership_stmt)
-
-            parent_organizations: Result = await session.execute(query_parent_organizations)
-            address_type_result: Result = await session.execute(query_address_type)
-            email_type_result: Result = await session.execute(query_email_type)
-            phone_type_result: Result = await session.execute(query_phone_type)
-
-        if not organization:
-            return json({
-                "organization": dict(),
-                "address": list(),
-                "email": list(),
-                "phone": list(),
-                "membership": list(),
-                "parent_organizations": list(),
-                "address_type": list(),
-                "email_type": list(),
-                "phone_type": list(),
-            })
-
-        result_dict: t.OrganizationResult = {
-            "organization": dict(organization),
-            "address": list(map(dict, address_result)),
-            "email": list(map(dict, email_result)),
-            "phone": list(map(dict, phone_result)),
-            "membership": list(map(dict, membership_result)),
-            "parent_organizations": list(map(dict, parent_organizations)),
-            "address_type": list(map(dict, address_type_result)),
-            "email_type": list(map(dict, email_type_result)),
-            "phone_type": list(map(dict, phone_type_result)),
-        }
-
-        return json(result_dict, default=str)
+        result_dict: Optional[t.OrganizationResult] = await fetch_organization(session, pk)
+        return json(result_dict or EMPTY_ORGANIZATION_RESULT, default=str)
 
 
 class OrganizationsView(HTTPMethodView):
@@ -209,14 +201,107 @@ class OrganizationsView(HTTPMethodView):
         :param request: `Request` object
         :return: JSON with id and timestamp
         """
+        payload: Dict[str, Any] = validate_insert(m.Organization, request.json)
         session: AsyncSession = request.ctx.session
         async with session.begin():
-            organization: m.Organization = m.Organization(**request.json)
+            organization: m.Organization = m.Organization(**payload)
             session.add_all([organization])
+            invalidate(session, 'parent_organizations')
+            await session.flush()
+            await insert_organization_node(session, organization.id, organization.organization_parent_id)
         json_data: Dict[str, Any] = organization.to_dict()
         return json(json_data, default=str)
 
 
+class OrganizationSubtreeView(HTTPMethodView):
+
+    @staticmethod
+    async def get(request: Request, pk: str) -> HTTPResponse:
+        """
+        Gets the organization and all of its sub-organizations, optionally limited by `max_depth` argument.
+
+        :param request: `Request` object
+        :param pk: primary key of organization table
+        :return: JSON object with results
+        """
+        session: AsyncSession = request.ctx.session
+        if 'max_depth' in request.args:
+            stmt: BoundQuery = prepared_organization_subtree_max_depth(
+                pk=pk, max_depth=int(request.args.get('max_depth'))
+            )
+        else:
+            stmt: BoundQuery = prepared_organization_subtree(pk=pk)
+        async with session.begin():
+            results: Result = await fetch(session, stmt)
+
+        return json(list(map(dict, results)), default=str)
+
+
+class OrganizationAncestorsView(HTTPMethodView):
+
+    @staticmethod
+    async def get(request: Request, pk: str) -> HTTPResponse:
+        """
+        Gets the chain of parent organizations from the root down to the organization itself.
+
+        :param request: `Request` object
+        :param pk: primary key of organization table
+        :return: JSON object with results
+        """
+        session: AsyncSession = request.ctx.session
+        async with session.begin():
+            results: Result = await fetch(session, prepared_organization_ancestors(pk=pk))
+
+        return json(list(map(dict, results)), default=str)
+
+
+class OrganizationMembershipsView(HTTPMethodView):
+
+    @staticmethod
+    async def get(request: Request, pk: str) -> Optional[HTTPResponse]:
+        """
+        Gets membership data of the organization and all of its sub-organizations, streamed in chunks.
+
+        :param request: `Request` object
+        :param pk: primary key of organization table
+        :return: JSON object with results
+        """
+        return await json_rows(request, prepared_organization_descendant_membership.statement, {'pk': pk})
+
+
+class OrganizationStatisticsView(HTTPMethodView):
+
+    @staticmethod
+    async def get(request: Request, pk: str) -> HTTPResponse:
+        """
+        Gets active and inactive member counts of the organization per membership fee category and month of their
+        latest membership event.
+        With `rollup=Y` argument the counts of all sub-organizations are included.
+
+        :param request: `Request` object
+        :param pk: primary key of organization table
+        :return: JSON object with results
+        """
+        session: AsyncSession = request.ctx.session
+        rollup: bool = request.args.get('rollup', 'N') == 'Y'
+        query: PreparedQuery = prepared_membership_statistics_rollup if rollup else prepared_membership_statistics
+        async with session.begin():
+            results: Result = await fetch(session, query(pk=pk))
+            statistics: List[Dict[str, Any]] = list(map(dict, results))
+
+        return json({
+            "organization_id": pk,
+            "rollup": rollup,
+            "active_count": sum(row['active_count'] for row in statistics),
+            "inactive_count": sum(row['inactive_count'] for row in statistics),
+            "statistics": statistics,
+        }, default=str)
+
+
 bp_organization = Blueprint("organizations", url_prefix="/organizations/")
 bp_organization.add_route(OrganizationView.as_view(), '/<pk:str>')
 bp_organization.add_route(OrganizationsView.as_view(), '/')
+bp_organization.add_route(OrganizationSubtreeView.as_view(), '/<pk:str>/subtree')
+bp_organization.add_route(OrganizationAncestorsView.as_view(), '/<pk:str>/ancestors')
+bp_organization.add_route(OrganizationMembershipsView.as_view(), '/<pk:str>/memberships')
+bp_organization.add_route(OrganizationStatisticsView.as_view(), '/<pk:str>/stats')
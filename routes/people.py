@@ -1,22 +1,84 @@
 import data_types.data_types as t
 import models.models as m
+from cache import cached_response, invalidate, row_tags
+from change_feed import record_changes
 from math import ceil
+from membership_statistics import add_member_statistics, add_person_statistics, MemberPair, membership_pairs
+from parallel_reads import read_all
 from queries.queries import (
-    query_person_address, query_person_email, query_person_phone, query_person, query_person_membership, query_gender,
-    query_membership_fee_category, query_address_type, query_email_type, query_phone_type, query_people_count
+    prepared_person_address, prepared_person_email, prepared_person_phone, prepared_person, prepared_person_membership,
+    prepared_gender, prepared_membership_fee_category, prepared_address_type, prepared_email_type, prepared_phone_type,
+    query_person, query_people_count
 )
 from sanic import Blueprint
 from sanic.request import Request
 from sanic.response import json, HTTPResponse
 from sanic.views import HTTPMethodView
+from sequences import fill_sequence_columns
 from sqlalchemy import update
-from sqlalchemy.engine import Result, Row
+from sqlalchemy.engine import Result
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.sql.selectable import Select
 from sqlalchemy.sql.dml import Update
+from typing import Any, Dict, Optional, Set
+from validation import validate_changes, validate_insert
+
+
+EMPTY_PERSON_RESULT: t.PersonResult = {
+    "person": dict(),
+    "address": list(),
+    "email": list(),
+    "phone": list(),
+    "membership": list(),
+    "gender_type": list(),
+    "membership_fee_type": list(),
+    "address_type": list(),
+    "email_type": list(),
+    "phone_type": list(),
+}
+
+
+async def fetch_person(session: AsyncSession, pk: str) -> Optional[t.PersonResult]:
+    """
+    Reads a person together with contacts, memberships and the person mappings.
+
+    :param session: `AsyncSession` object without an open transaction
+    :param pk: primary key of person table
+    :return: person data, None when the person does not exist
+    """
+    (
+        person, address, email, phone, membership, gender_type, membership_fee_type, address_type, email_type,
+        phone_type
+    ) = await read_all(session, [
+        prepared_person(pk=pk),
+        prepared_person_address(pk=pk),
+        prepared_person_email(pk=pk),
+        prepared_person_phone(pk=pk),
+        prepared_person_membership(pk=pk),
+        prepared_gender(),
+        prepared_membership_fee_category(),
+        prepared_address_type(),
+        prepared_email_type(),
+        prepared_phone_type(),
+    ])
+    if not person:
+        return None
+
+    return {
+        "person": dict(person[0]),
+        "address": list(map(dict, address)),
+        "email": list(map(dict, email)),
+        "phone": list(map(dict, phone)),
+        "membership": list(map(dict, membership)),
+        "gender_type": list(map(dict, gender_type)),
+        "membership_fee_type": list(map(dict, membership_fee_type)),
+        "address_type": list(map(dict, address_type)),
+        "email_type": list(map(dict, email_type)),
+        "phone_type": list(map(dict, phone_type)),
+    }
 
 
 class PersonView(HTTPMethodView):
+    decorators = [cached_response]
 
     @staticmethod
     async def get(request: Request, pk: str) -> HTTPResponse:
@@ -27,55 +89,17 @@ class PersonView(HTTPMethodView):
         :param pk: primary key of person table
         :return: JSON object with results
         """
-        session: AsyncSession = request.ctx.session
-        async with session.begin():
-            person_stmt: Select = query_person.where(m.Person.id == pk)
-            person_result: Result = await session.execute(person_stmt)
-            person: Row = person_result.first()
-
-            address_stmt: Select = query_person_address.where(m.Address.person_id == pk)
-            address_result: Result = await session.execute(address_stmt)
-
-            email_stmt: Select = query_person_email.where(m.Email.person_id == pk)
-            email_result: Result = await session.execute(email_stmt)
-
-            phone_stmt: Select = query_person_phone.where(m.Phone.person_id == pk)
-            phone_result: Result = await session.execute(phone_stmt)
-
-            membership_stmt: Select = query_person_membership.where(m.Membership.person_id == pk)
-            membership_result: Result = await session.execute(membership_stmt)
-
-            gender_type_result: Result = await session.execute(query_gender)
-            membership_fee_type_result: Result = await session.execute(query_membership_fee_category)
-            address_type_result: Result = await session.execute(query_address_type)
-            email_type_result: Result = await session.execute(query_email_type)
-            phone_type_result: Result = await session.execute(query_phone_type)
-
-        if not person:
-            return json({
-                "person": dict(),
-                "address": list(),
-                "email": list(),
-                "phone": list(),
-                "membership": list(),
-                "gender_type": list(),
-                "membership_fee_type": list(),
-                "address_type": list(),
-                "email_type": list(),
-                "phone_type": list(),
-            })
-
-        result_dict: t.PersonResult = {
-            "person": dict(person),
-            "address": list(map(dict, address_result)),
-            "email": list(map(dict, email_result)),
-            "phone": list(map(dict, phone_result)),
-            "membership": list(map(dict, membership_result)),
-            "gender_type": list(map(dict, gender_type_result)),
-            "membership_fee_type": list(map(dict, membership_fee_type_result)),
-            "address_type": list(map(dict, address_type_result)),
-            "email_type": list(map(dict, email_type_result)),
-            "phone_type": list(map(dict, phone_type_result)),
+        result_dict: Optional[t.PersonResult] = await fetch_person(request.ctx.session, pk)
+        if not result_dict:
+            return json(EMPTY_PERSON_RESULT)
+
+        request.ctx.cache_tags = {
+            f'person:{pk}', 'maps',
+            *row_tags('address', result_dict['address']),
+            *row_tags('email', result_dict['email']),
+            *row_tags('phone', result_dict['phone']),
+            *row_tags('membership', result_dict['membership']),
+            *row_tags('organization', result_dict['membership'], 'organization_id'),
         }
 
         return json(result_dict, default=str)
@@ -89,76 +113,41 @@ class PersonView(HTTPMethodView):
         :param pk: primary key of person table
         :return: JSON object with results
         """
+        payload: t.PersonResult = validate_changes(t.PersonResult, request.json)
         session: AsyncSession = request.ctx.session
-        payload: t.PersonResult = request.json
         async with session.begin():
+            invalidate(session, f'person:{pk}')
+            record_changes(session, 'person', pk)
+            fee_category_changed: bool = 'membership_fee_category_id' in payload['person']
+            if fee_category_changed:
+                await add_person_statistics(session, pk, -1)
             person_stmt: Update = update(m.Person).where(m.Person.id == pk).values(**payload['person'])
             await session.execute(person_stmt)
+            if fee_category_changed:
+                await add_person_statistics(session, pk)
 
             for item in payload['address']:
+                record_changes(session, 'address', pk)
                 address_stmt: Update = update(m.Address).where(m.Address.id == pk).values(**item)
                 await session.execute(address_stmt)
             for item in payload['email']:
+                record_changes(session, 'email', pk)
                 email_stmt: Update = update(m.Email).where(m.Email.id == pk).values(**item)
                 await session.execute(email_stmt)
             for item in payload['phone']:
+                record_changes(session, 'phone', pk)
                 phone_stmt: Update = update(m.Phone).where(m.Phone.id == pk).values(**item)
                 await session.execute(phone_stmt)
             for item in payload['membership']:
+                record_changes(session, 'membership', pk)
+                pairs: Set[MemberPair] = await membership_pairs(session, pk, item)
+                await add_member_statistics(session, pairs, -1)
                 membership_stmt: Update = update(m.Membership).where(m.Membership.id == pk).values(**item)
                 await session.execute(membership_stmt)
+                await add_member_statistics(session, pairs)
 
-        async with session.begin():
-            person_stmt: Select = query_person.where(m.Person.id == pk)
-            person_result: Result = await session.execute(person_stmt)
-            person: Row = person_result.first()
-
-            address_stmt: Select = query_person_address.where(m.Address.person_id == pk)
-            address_result: Result = await session.execute(address_stmt)
-
-            email_stmt: Select = query_person_email.where(m.Email.person_id == pk)
-            email_result: Result = await session.execute(email_stmt)
-
-            phone_stmt: Select = query_person_phone.where(m.Phone.person_id == pk)
-            phone_result: Result = await session.execute(phone_stmt)
-
-            membership_stmt: Select = query_person_membership.where(m.Membership.person_id == pk)
-            membership_result: Result = await session.execute(membership_stmt)
-
-            gender_type_result: Result = await session.execute(query_gender)
-            membership_fee_type_result: Result = await session.execute(query_membership_fee_category)
-            address_type_result: Result = await session.execute(query_address_type)
-            email_type_result: Result = await session.execute(query_email_type)
-            phone_type_result: Result = await session.execute(query_phone_type)
-
-        if not person:
-            return json({
-                "person": dict(),
-                "address": list(),
-                "email": list(),
-                "phone": list(),
-                "membership": list(),
-                "gender_type": list(),
-                "membership_fee_type": list(),
-                "address_type": list(),
-                "email_type": list(),
-                "phone_type": list(),
-            })
-
-        result_dict: t.PersonResult = {
-            "person": dict(person),
-            "address": list(map(dict, address_result)),
-            "email": list(map(dict, email_result)),
-            "phone": list(map(dict, phone_result)),
-            "membership": list(map(dict, membership_result)),
-            "gender_type": list(map(dict, gender_type_result)),
-            "membership_fee_type": list(map(dict, membership_fee_type_result)),
-            "address_type": list(map(dict, address_type_result)),
-            "email_type": list(map(dict, email_type_result)),
-            "phone_type": list(map(dict, phone_type_result)),
-        }
-
-        return json(result_dict, default=str)
+        result_dict: Optional[t.PersonResult] = await fetch_person(session, pk)
+        return json(result_dict or EMPTY_PERSON_RESULT, default=str)
 
 
 class PeopleView(HTTPMethodView):
@@ -195,9 +184,11 @@ class PeopleView(HTTPMethodView):
         :param request: `Request` object
         :return: JSON with id and timestamp
         """
+        payload: Dict[str, Any] = validate_insert(m.Person, request.json)
         session: AsyncSession = request.ctx.session
+        await fill_sequence_columns(session, m.Person, [payload])
         async with session.begin():
-            person: m.Person = m.Person(**request.json)
+            person: m.Person = m.Person(**payload)
             session.add_all([person])
         json_data: t.Person = person.to_dict()
         return json(json_data, default=str)
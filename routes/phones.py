@@ -1,14 +1,18 @@
+from cache import invalidate, owner_tags
+from change_feed import record_changes
 from models.models import Phone
+from routes.streaming import json_rows
 from sanic import Blueprint
 from sanic.request import Request
 from sanic.response import json, HTTPResponse
 from sanic.views import HTTPMethodView
-from sqlalchemy import select, update
-from sqlalchemy.engine import Result
+from sqlalchemy import update
+from sqlalchemy.engine import Result, Row
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.selectable import Select
 from sqlalchemy.sql.dml import Update
-from typing import Any, Dict, List
+from typing import Any, Dict, Optional
+from validation import validate_insert, validate_update
 
 
 class PhoneView(HTTPMethodView):
@@ -24,14 +28,14 @@ class PhoneView(HTTPMethodView):
         """
         session: AsyncSession = request.ctx.session
         async with session.begin():
-            stmt: Select = select(Phone).where(Phone.id == pk)
+            stmt: Select = Phone.select_columns().where(Phone.id == pk)
             result: Result = await session.execute(stmt)
-            phone: Phone = result.scalar()
+            phone: Row = result.first()
 
         if not phone:
             return json(dict())
 
-        return json(phone.to_dict(), default=str)
+        return json(Phone.row_dict(phone), default=str)
 
     @staticmethod
     async def patch(request: Request, pk: str) -> HTTPResponse:
@@ -42,38 +46,32 @@ class PhoneView(HTTPMethodView):
         :param pk: primary key of phone table
         :return: JSON object with results
         """
+        changes: Dict[str, Any] = validate_update(Phone, request.json)
+        payload: Dict[str, Any] = {k: v for k, v in changes.items() if k not in ['id', 'created_on', 'created_by']}
         session: AsyncSession = request.ctx.session
-        payload: Dict[str, Any] = {k: v for k, v in request.json.items() if k not in ['id', 'created_on', 'created_by']}
         async with session.begin():
+            invalidate(session, f'phone:{pk}', *owner_tags(payload))
+            record_changes(session, 'phone', pk)
             stmt: Update = update(Phone).where(Phone.id == pk).values(**payload)
             await session.execute(stmt)
         async with session.begin():
-            stmt: Select = select(Phone).where(Phone.id == pk)
+            stmt: Select = Phone.select_columns().where(Phone.id == pk)
             result: Result = await session.execute(stmt)
-            phone: Phone = result.scalar()
-        return json(phone.to_dict(), default=str)
+            phone: Row = result.first()
+        return json(Phone.row_dict(phone), default=str)
 
 
 class PhonesView(HTTPMethodView):
 
     @staticmethod
-    async def get(request: Request) -> HTTPResponse:
+    async def get(request: Request) -> Optional[HTTPResponse]:
         """
-        Gets phone collection from database.
+        Gets phone collection from database, streamed in chunks.
 
         :param request: `Request` object
         :return: JSON object with results
         """
-        session: AsyncSession = request.ctx.session
-        async with session.begin():
-            stmt: Select = select(Phone)
-            results: Result = await session.execute(stmt)
-            phones: List[Phone] = results.scalars().fetchall()
-
-        if not phones:
-            return json(dict())
-
-        return json([row.to_dict() for row in phones], default=str)
+        return await json_rows(request, Phone.select_columns(), empty=dict())
 
     @staticmethod
     async def post(request: Request) -> HTTPResponse:
@@ -83,10 +81,12 @@ class PhonesView(HTTPMethodView):
         :param request: `Request` object
         :return: JSON with id and timestamp
         """
+        payload: Dict[str, Any] = validate_insert(Phone, request.json)
         session: AsyncSession = request.ctx.session
         async with session.begin():
-            phone: Phone = Phone(**request.json)
+            phone: Phone = Phone(**payload)
             session.add_all([phone])
+            invalidate(session, *owner_tags(payload))
         json_data: Dict[str, Any] = phone.to_dict()
         return json(json_data, default=str)
 
@@ -0,0 +1,137 @@
+import os
+from sanic.log import logger
+from sanic.request import Request
+from sanic.response import json, json_dumps, HTTPResponse
+from sqlalchemy import bindparam
+from sqlalchemy.engine import Result, Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.sql.selectable import Select
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Rows read, converted and sent at a time; bounds the memory of a collection read
+STREAM_CHUNK: int = int(os.environ.get("STREAM_CHUNK", 1000))
+
+
+async def read_chunks(
+        session: AsyncSession, stmt: Select, params: Optional[Dict[str, Any]] = None, size: int = STREAM_CHUNK
+) -> AsyncIterator[Tuple[Tuple[str, ...], List[Row]]]:
+    """
+    Reads the rows of a query ordered by its `id` column in chunks of at most `size` row tuples. Every chunk is a
+    query of its own that continues after the id of the last row (keyset paging) in a short transaction, so no cursor
+    or SQLite read lock is held between the chunks and writers are never blocked by a slow reader.
+
+    :param session: `AsyncSession` object without an open transaction, or the session of a batch
+    :param stmt: `Select` object with a unique `id` column
+    :param params: parameters of the statement
+    :param size: number of rows per chunk
+    :return: async iterator of the column keys and rows of each chunk
+    """
+    key: ColumnElement = stmt.selected_columns.id
+    chunk_stmt: Select = stmt.order_by(key).limit(size)
+    next_stmt: Select = stmt.where(key > bindparam('keyset_after')).order_by(key).limit(size)
+    chunk_params: Dict[str, Any] = dict(params or {})
+    while True:
+        async with session.begin():
+            result: Result = await session.execute(chunk_stmt, chunk_params)
+            keys: Tuple[str, ...] = tuple(result.keys())
+            rows: List[Row] = result.all()
+        yield keys, rows
+        if len(rows) < size:
+            return
+        chunk_stmt = next_stmt
+        chunk_params['keyset_after'] = rows[-1]._mapping[key]
+
+
+def defer_to_stream_end(request: Request, middleware: Callable[[Request, Any], Awaitable[None]], response) -> bool:
+    """
+    Postpones a response middleware of a streamed response until the stream has ended. `request.respond` runs the
+    response middleware when the stream starts, before the rows are read and sent, which is too early to record the
+    metrics of the request, stop its profiler or release its resources. Middleware that only sets headers must not
+    be postponed, they are sent with the first chunk.
+
+    :param request: `Request` object
+    :param middleware: response middleware, called again with `request` and `response` at the end of the stream
+    :param response: response passed to the middleware
+    :return: False when the response is not a stream in progress and the middleware must do its work right away
+    """
+    postponed: Optional[List[Tuple[Callable, Any]]] = getattr(request.ctx, 'stream_end_middleware', None)
+    if postponed is None:
+        return False
+    postponed.append((middleware, response))
+    return True
+
+
+async def _run_stream_end_middleware(request: Request) -> None:
+    postponed: List[Tuple[Callable, Any]] = request.ctx.stream_end_middleware
+    del request.ctx.stream_end_middleware
+    for middleware, response in postponed:
+        try:
+            await middleware(request, response)
+        except Exception:
+            logger.exception("Exception occurred in one of the postponed response middleware handlers")
+
+
+def _dicts(keys: Tuple[str, ...], rows: List[Row]) -> List[Dict[str, Any]]:
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def _json_items(keys: Tuple[str, ...], rows: List[Row]) -> str:
+    # The objects of a chunk without the brackets of the list
+    return json_dumps(_dicts(keys, rows), default=str)[1:-1]
+
+
+async def json_rows(
+        request: Request, stmt: Select, params: Optional[Dict[str, Any]] = None, empty: Any = None
+) -> Optional[HTTPResponse]:
+    """
+    Responds with the rows of a query as a JSON list of objects ordered by id. A result that fits into one chunk is
+    returned as a regular response; a larger one is streamed chunk by chunk (chunked transfer encoding) on a session
+    of its own, because the request session is closed by the response middleware when the stream starts. The response
+    middleware postponed with `defer_to_stream_end` runs once the stream has ended, failed or was cancelled. Inside a
+    batch the rows are read on the batch session and returned as a regular response.
+
+    :param request: `Request` object
+    :param stmt: `Select` object with a unique `id` column
+    :param params: parameters of the statement
+    :param empty: body returned instead of an empty list
+    :return: JSON response, or `None` when the response was streamed
+    """
+    session: AsyncSession = request.ctx.session
+    if getattr(request.ctx, 'in_batch', False):
+        rows: List[Dict[str, Any]] = []
+        async for keys, chunk in read_chunks(session, stmt, params):
+            rows.extend(_dicts(keys, chunk))
+        return json(rows if rows or empty is None else empty, default=str)
+
+    # Closed on every exit, including the cancellation of the handler when the client disconnects
+    async with AsyncSession(session.bind) as stream_session:
+        chunks: AsyncIterator[Tuple[Tuple[str, ...], List[Row]]] = read_chunks(stream_session, stmt, params)
+        try:
+            # The first chunk is read before the response starts, so errors still produce an error response
+            keys, rows = await chunks.__anext__()
+            if len(rows) < STREAM_CHUNK:
+                body: Any = _dicts(keys, rows) if rows or empty is None else empty
+                return json(body, default=str)
+            request.ctx.stream_end_middleware = []
+            # Bytes of the body for the request metrics, a streamed response has no body of its own
+            request.ctx.stream_size = 0
+            response = await request.respond(content_type='application/json')
+            await _send(request, response, '[' + _json_items(keys, rows))
+            async for keys, rows in chunks:
+                if rows:
+                    await _send(request, response, ',' + _json_items(keys, rows))
+            await _send(request, response, ']')
+            await response.eof()
+        finally:
+            await chunks.aclose()
+            if hasattr(request.ctx, 'stream_end_middleware'):
+                await _run_stream_end_middleware(request)
+    return None
+
+
+async def _send(request: Request, response, data: str) -> None:
+    encoded: bytes = data.encode()
+    request.ctx.stream_size += len(encoded)
+    await response.send(encoded)
+
@@ -0,0 +1,188 @@
+import asyncio
+import os
+from metrics import registry
+from models.models import NumberSequence, Person
+from sanic import Sanic
+from sqlalchemy import INTEGER, Index, bindparam, cast, exists, func, inspect, literal, select, update
+from sqlalchemy.dialects.sqlite import insert as upsert, Insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+from sqlalchemy.sql.dml import Update
+from sqlalchemy.sql.selectable import Select
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+MEMBERSHIP_ID_PREFIX: str = os.environ.get("MEMBERSHIP_ID_PREFIX", "M")
+MEMBERSHIP_ID_DIGITS: int = int(os.environ.get("MEMBERSHIP_ID_DIGITS", 10))
+
+
+class SequenceDefinition(NamedTuple):
+    # Stored value of a number of the sequence
+    format: Callable[[int], Any]
+    # Highest number already used, the sequence starts after it
+    query_last_value: Select
+
+
+SEQUENCES: Dict[str, SequenceDefinition] = {
+    'registration_number': SequenceDefinition(int, select(func.max(Person.registration_number))),
+    'membership_id': SequenceDefinition(
+        lambda value: f'{MEMBERSHIP_ID_PREFIX}{value:0{MEMBERSHIP_ID_DIGITS}d}',
+        select(func.max(cast(func.substr(Person.membership_id, len(MEMBERSHIP_ID_PREFIX) + 1), INTEGER))).where(
+            Person.membership_id.op('GLOB')(f'{MEMBERSHIP_ID_PREFIX}[0-9]*')
+        ),
+    ),
+}
+
+allocate_block_stmt: Update = update(NumberSequence).where(
+    NumberSequence.name == bindparam('sequence_name')
+).values(next_value=NumberSequence.next_value + bindparam('block_size')).execution_options(synchronize_session=False)
+
+query_next_value: Select = select(NumberSequence.next_value).where(NumberSequence.name == bindparam('sequence_name'))
+
+
+def _seed_sequence_stmt(name: str) -> Insert:
+    # The sequence starts after the highest number already used; the scan only runs while the sequence is missing
+    return upsert(NumberSequence).from_select(
+        ['name', 'next_value'],
+        select(
+            literal(name), func.coalesce(SEQUENCES[name].query_last_value.scalar_subquery(), 0) + 1
+        ).where(~exists().where(NumberSequence.name == name)),
+    ).on_conflict_do_nothing()
+
+
+seed_sequence_stmts: Dict[str, Insert] = {name: _seed_sequence_stmt(name) for name in SEQUENCES}
+
+
+class SequenceAllocator:
+    """
+    Hands out the numbers of the sequences of `SEQUENCES` from blocks of `block_size` numbers (hi/lo allocation).
+    A worker reserves a block by moving `next_value` of the sequence forward in a short transaction of its own,
+    which SQLite serializes across workers, then issues the numbers of the block from memory. Numbers never
+    collide, but they are not gapless: the rest of the blocks of a stopped worker is never issued.
+
+    A session with an open transaction may already hold the SQLite write lock, which a separate connection would
+    wait for; its numbers are reserved in that transaction instead, exactly as many as needed, and are released
+    again when it rolls back.
+    """
+
+    def __init__(self, block_size: int) -> None:
+        self.block_size: int = block_size
+        self.blocks: Dict[str, Tuple[int, int]] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.allocated_blocks: int = 0
+        # Sequences known to exist in the database, their blocks are reserved without seeding them first
+        self.seeded: Set[str] = set()
+
+    async def next_values(self, session: AsyncSession, name: str, count: int) -> List[int]:
+        """
+        Issues `count` numbers of the sequence `name`.
+
+        :param session: `AsyncSession` object of the request or job
+        :param name: name of the sequence in `SEQUENCES`
+        :param count: number of values needed
+        :return: list of unique numbers
+        """
+        if session.in_transaction():
+            start: int = await self.allocate(await session.connection(), name, count)
+            return list(range(start, start + count))
+        values: List[int] = []
+        async with self.locks.setdefault(name, asyncio.Lock()):
+            while len(values) < count:
+                start, end = self.blocks.get(name, (0, 0))
+                if start == end:
+                    size: int = max(self.block_size, count - len(values))
+                    async with session.bind.begin() as conn:
+                        start = await self.allocate(conn, name, size, seed=name not in self.seeded)
+                    self.seeded.add(name)
+                    end = start + size
+                    self.allocated_blocks += 1
+                taken: int = min(end - start, count - len(values))
+                values.extend(range(start, start + taken))
+                self.blocks[name] = (start + taken, end)
+        return values
+
+    @staticmethod
+    async def allocate(conn: AsyncConnection, name: str, size: int, seed: bool = True) -> int:
+        """
+        Reserves `size` numbers of the sequence in the transaction of `conn`. A missing sequence is created first,
+        starting after the highest number already used. Seeding is an INSERT, so SQLite takes the write lock when
+        the statement starts, before it scans for that number, as BEGIN IMMEDIATE would for a new transaction: no
+        other worker can issue a number between the scan and the creation of the sequence.
+
+        :param seed: False when the sequence is known to exist
+        :return: first reserved number
+        """
+        if seed:
+            await conn.execute(seed_sequence_stmts[name])
+        await conn.execute(allocate_block_stmt, {'sequence_name': name, 'block_size': size})
+        return (await conn.execute(query_next_value, {'sequence_name': name})).scalar() - size
+
+
+sequence_allocator = SequenceAllocator(block_size=int(os.environ.get("SEQUENCE_BLOCK_SIZE", 100)))
+
+registry.counter('sequence_blocks_allocated_total', 'Blocks of sequence numbers reserved by the worker.', lambda: {
+    (): sequence_allocator.allocated_blocks
+})
+
+
+async def fill_sequence_columns(session: AsyncSession, model: Any, rows: List[Dict[str, Any]]) -> None:
+    """
+    Numbers the new rows of `model` that come without a value for a column backed by a sequence (columns with a
+    `sequence` in their `info`). Call it before the transaction inserting the rows, so no write lock is held while
+    a block is reserved.
+
+    :param session: `AsyncSession` object of the request or job
+    :param model: model class of the rows
+    :param rows: column values of the new rows, completed in place
+    """
+    for column in model.__table__.columns:
+        name: Optional[str] = column.info.get('sequence')
+        if name is None:
+            continue
+        missing: List[Dict[str, Any]] = [row for row in rows if row.get(column.name) is None]
+        if missing:
+            values: List[int] = await sequence_allocator.next_values(session, name, len(missing))
+            for row, value in zip(missing, values):
+                row[column.name] = SEQUENCES[name].format(value)
+
+
+def _duplicates_stmt(index: Index) -> Select:
+    columns = list(index.columns)
+    return select(*columns).group_by(*columns).having(func.count() > 1).limit(5)
+
+
+async def _create_unique_index(conn: AsyncConnection, index: Index) -> None:
+    existing: Set[str] = {
+        existing['name'] for existing in await conn.run_sync(
+            lambda sync_conn: inspect(sync_conn).get_indexes(index.table.name)
+        )
+    }
+    if index.name in existing:
+        return
+    duplicates: List[str] = [', '.join(map(str, row)) for row in await conn.execute(_duplicates_stmt(index))]
+    if duplicates:
+        raise RuntimeError(
+            f"Cannot create the unique index {index.name}: {index.table.name}."
+            f"{', '.join(column.name for column in index.columns)} has duplicate values "
+            f"({'; '.join(duplicates)}{'; ...' if len(duplicates) == 5 else ''}). Renumber the duplicate rows "
+            f"before starting the server."
+        )
+    await conn.run_sync(index.create)
+
+
+def connect_sequences(app: Sanic, engine: AsyncEngine) -> None:
+    """
+    Creates the sequence table and the unique indexes of the numbered columns once in the main process. The
+    sequences themselves are created by their first allocation. A numbered column that already holds duplicate
+    values stops the server with the duplicates instead of the bare constraint error of the index.
+
+    :param app: `Sanic` application
+    :param engine: `AsyncEngine` object used by the application
+    """
+    async def create_sequence_table(app: Sanic, loop) -> None:
+        async with engine.begin() as conn:
+            await conn.run_sync(NumberSequence.__table__.create, checkfirst=True)
+            for index in Person.__table__.indexes:
+                await _create_unique_index(conn, index)
+        # Workers are forked after this point and must not inherit pooled connections
+        await engine.dispose()
+
+    app.register_listener(create_sequence_table, "main_process_start")
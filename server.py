@@ -1,44 +1,107 @@
+import os
+from admission import admit_request, release_request
+from cache_bus import connect_invalidation_bus
+from change_feed import connect_change_log
+from change_stream import connect_change_stream
 from contextvars import ContextVar
 from cors import add_cors_headers
+from deadlines import apply_deadlines, interrupt_on_deadline
+from group_commit import connect_group_commit, group_commit_writer, GroupCommitSession
+from hierarchy import connect_organization_closure
+from idempotency import connect_idempotency_keys, IdempotentSession
+from jobs import connect_job_runner
+from membership_statistics import connect_membership_statistics
+from metrics import instrument_engine, record_request_metrics, start_request_metrics
 from options import setup_options
+from parallel_reads import enable_parallel_reads
+from profiling import start_profiling, stop_profiling
+from queries.prepared import prepare_queries
 from routes.addresses import bp_address
+from routes.admin import bp_admin
+from routes.batch import bp_batch
+from routes.changes import bp_change_stream, bp_changes
 from routes.emails import bp_email
+from routes.jobs import bp_jobs
 from routes.maps import bp_address_type, bp_email_type, bp_gender, bp_membership_fee_category, bp_phone_type, \
     bp_person_mapping, bp_organization_mapping, bp_mapping
 from routes.memberships import bp_memberships
+from routes.metrics import bp_metrics
 from routes.organizations import bp_organization
 from routes.people import bp_person
 from routes.phones import bp_phone
 from sanic import Sanic
 from sanic.request import Request
+from sequences import connect_sequences
+from slow_query import log_slow_queries
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 app = Sanic("MembershipManagementSystem")
-bind = create_async_engine("sqlite+aiosqlite:///dev.db", echo=True)
+bind = create_async_engine(
+    os.environ.get("DATABASE_URL", "sqlite+aiosqlite:///dev.db"), echo=os.environ.get("SQL_ECHO", "Y") == "Y"
+)
 _base_model_session_ctx = ContextVar("session")
+instrument_engine(bind)
+prepare_queries(bind)
+log_slow_queries(bind)
+interrupt_on_deadline(bind)
+if os.environ.get("PARALLEL_READS", "N") == "Y":
+    read_bind = enable_parallel_reads(bind.url, int(os.environ.get("PARALLEL_READ_POOL_SIZE", 8)), bind.echo)
+    instrument_engine(read_bind)
+    prepare_queries(read_bind)
+    log_slow_queries(read_bind)
+    interrupt_on_deadline(read_bind)
+connect_invalidation_bus(app, bind)
+connect_change_log(app, bind)
+connect_organization_closure(app, bind)
+connect_membership_statistics(app, bind)
+connect_change_stream(app, bind)
+connect_group_commit(app, bind)
+connect_job_runner(app, bind)
+connect_sequences(app, bind)
+
+# Registered first so they wrap every other middleware (response middleware runs in reverse order)
+app.register_middleware(start_request_metrics, "request")
+app.register_middleware(record_request_metrics, "response")
+app.register_middleware(admit_request, "request")
+app.register_middleware(release_request, "response")
+connect_idempotency_keys(app, bind)
+app.register_middleware(start_profiling, "request")
+app.register_middleware(stop_profiling, "response")
 
 
 @app.middleware("request")
 async def inject_session(request: Request) -> None:
-    request.ctx.session = sessionmaker(bind, AsyncSession, expire_on_commit=False)()
+    if hasattr(request.ctx, "idempotency_key"):
+        session_class = IdempotentSession
+    elif group_commit_writer.enabled and request.method != "GET":
+        session_class = GroupCommitSession
+    else:
+        session_class = AsyncSession
+    request.ctx.session = sessionmaker(bind, session_class, expire_on_commit=False)()
     request.ctx.session_ctx_token = _base_model_session_ctx.set(request.ctx.session)
 
 
 @app.middleware("response")
 async def close_session(request: Request, response) -> None:
     if hasattr(request.ctx, "session_ctx_token"):
-        _base_model_session_ctx.reset(request.ctx.session_ctx_token)
+        try:
+            _base_model_session_ctx.reset(request.ctx.session_ctx_token)
+        except ValueError:
+            # Responses streamed with `request.respond` run the response middleware in the handler task of the deadline
+            pass
         await request.ctx.session.close()
 
 
 app.blueprint([
     bp_gender, bp_membership_fee_category, bp_address_type, bp_phone_type, bp_email_type, bp_person, bp_organization,
-    bp_address, bp_email, bp_phone, bp_memberships, bp_person_mapping, bp_organization_mapping, bp_mapping
+    bp_address, bp_email, bp_phone, bp_memberships, bp_person_mapping, bp_organization_mapping, bp_mapping, bp_metrics,
+    bp_admin, bp_changes, bp_change_stream, bp_batch, bp_jobs
 ])
 
 # Add OPTIONS handlers to any route that is missing it
 app.register_listener(setup_options, "before_server_start")
+app.register_listener(apply_deadlines, "before_server_start")
 
 # Fill in CORS headers
 app.register_middleware(add_cors_headers, "response")
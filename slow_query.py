@@ -0,0 +1,126 @@
+import datetime
+import os
+import time
+from collections import deque
+from metrics import current_route, registry
+from sanic.log import logger
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+registry.counter('db_slow_statements_total', 'Statements slower than the slow query threshold.')
+
+
+class SlowQueryLog:
+    """
+    Keeps the last `capacity` statements slower than `threshold` seconds. At most `max_per_minute` entries are logged
+    per minute and the query plan of a statement is captured at most once per `explain_interval` seconds.
+    """
+
+    def __init__(self, threshold: float, capacity: int, max_per_minute: int, explain_interval: float) -> None:
+        self.threshold: float = threshold
+        self.max_per_minute: int = max_per_minute
+        self.explain_interval: float = explain_interval
+        self.entries: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+        self.suppressed: int = 0
+        self._window_start: float = 0.0
+        self._window_count: int = 0
+        self._plans: Dict[str, Tuple[float, List[str]]] = {}
+
+    def _allow(self, now: float) -> bool:
+        if now - self._window_start >= 60:
+            self._window_start, self._window_count = now, 0
+        self._window_count += 1
+        return self._window_count <= self.max_per_minute
+
+    def _query_plan(self, cursor_factory, statement: str, parameters: Sequence, now: float) -> List[str]:
+        cached: Optional[Tuple[float, List[str]]] = self._plans.get(statement)
+        if cached is not None and now - cached[0] < self.explain_interval:
+            return cached[1]
+        plan: List[str] = explain_query_plan(cursor_factory, statement, parameters)
+        if len(self._plans) >= 1000:
+            self._plans.clear()
+        self._plans[statement] = (now, plan)
+        return plan
+
+    def record(self, cursor_factory, statement: str, parameters: Sequence, elapsed: float) -> None:
+        now: float = time.monotonic()
+        registry.inc('db_slow_statements_total')
+        if not self._allow(now):
+            self.suppressed += 1
+            return
+        is_query: bool = statement.lstrip().upper().startswith(('SELECT', 'WITH'))
+        entry: Dict[str, Any] = {
+            "logged_on": datetime.datetime.now().isoformat(),
+            "route": current_route(),
+            "duration_ms": round(elapsed * 1000, 3),
+            "statement": statement,
+            "parameters": redact(parameters),
+            "query_plan": self._query_plan(cursor_factory, statement, parameters, now) if is_query else [],
+        }
+        self.entries.append(entry)
+        logger.warning(
+            "Slow query (%.1f ms) on %s: %s\n%s", entry["duration_ms"], entry["route"], statement,
+            "\n".join(entry["query_plan"])
+        )
+
+
+def redact(parameters: Any) -> Any:
+    """
+    Replaces bound values with their type (and length for strings) so no personal data ends up in the log.
+    """
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    if isinstance(parameters, str):
+        return f"<str:{len(parameters)}>"
+    return f"<{type(parameters).__name__}>"
+
+
+def explain_query_plan(cursor_factory, statement: str, parameters: Sequence) -> List[str]:
+    """
+    Runs SQLite `EXPLAIN QUERY PLAN` on a raw DBAPI cursor, bypassing the engine events, and renders the plan tree
+    as indented lines.
+    """
+    try:
+        cursor = cursor_factory()
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        rows = cursor.fetchall()
+        cursor.close()
+    except Exception as e:
+        return [f"EXPLAIN QUERY PLAN failed: {e}"]
+    depth: Dict[int, int] = {0: -1}
+    lines: List[str] = []
+    for node_id, parent_id, _, detail in rows:
+        depth[node_id] = depth.get(parent_id, -1) + 1
+        lines.append(f"{'  ' * depth[node_id]}{detail}")
+    return lines
+
+
+slow_query_log = SlowQueryLog(
+    threshold=float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 100)) / 1000,
+    capacity=int(os.environ.get("SLOW_QUERY_LOG_SIZE", 200)),
+    max_per_minute=int(os.environ.get("SLOW_QUERY_MAX_PER_MINUTE", 60)),
+    explain_interval=float(os.environ.get("SLOW_QUERY_EXPLAIN_INTERVAL", 300)),
+)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault('slow_query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed: float = time.perf_counter() - conn.info['slow_query_start_time'].pop()
+    if elapsed >= slow_query_log.threshold and not executemany:
+        slow_query_log.record(conn.connection.cursor, statement, parameters, elapsed)
+
+
+def log_slow_queries(engine: AsyncEngine) -> None:
+    """
+    Hooks the slow query log into the engine.
+
+    :param engine: `AsyncEngine` object used by the application
+    """
+    event.listen(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
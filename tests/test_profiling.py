@@ -0,0 +1,80 @@
+"""
+Profiles of requests whose handler runs in a task of its own under the deadline of its route class.
+
+Usage: python -m pytest tests
+"""
+import asyncio
+import pytest
+import time
+from benchmarks.load_test import free_port, HttpClient
+from deadlines import apply_deadlines
+from profiling import profile_store, render_profile, start_profiling, stop_profiling
+from sanic import Sanic
+from sanic.request import Request
+from sanic.response import json, HTTPResponse
+from typing import Any, Dict
+
+
+def _spin_in_handler(seconds: float) -> None:
+    started: float = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        pass
+
+
+async def profiled_handler(request: Request) -> HTTPResponse:
+    _spin_in_handler(0.2)
+    await asyncio.sleep(0.05)
+    _spin_in_handler(0.2)
+    return json({})
+
+
+async def _profile_requests(*modes: str) -> Dict[str, Dict[str, Any]]:
+    # Sanic rewrites its request handling once per process, so one app serves the requests of every mode
+    app = Sanic('ProfilingTest')
+    app.add_route(profiled_handler, '/profiled')
+    app.register_middleware(start_profiling, 'request')
+    app.register_middleware(stop_profiling, 'response')
+    app.register_listener(apply_deadlines, 'before_server_start')
+    port: int = free_port()
+    server = await app.create_server(host='127.0.0.1', port=port, return_asyncio_server=True, access_log=False)
+    await server.startup()
+    await server.before_start()
+    await server.after_start()
+    client = HttpClient('127.0.0.1', port)
+    profiles: Dict[str, Dict[str, Any]] = {}
+    try:
+        for mode in modes:
+            profile_store.mode = mode
+            status, _ = await client.request('GET', '/profiled')
+            assert status == 200
+            profiles[mode] = profile_store.profiles[-1]
+    finally:
+        await client.close()
+        await server.before_stop()
+        await server.close()
+        await server.after_stop()
+    return profiles
+
+
+@pytest.fixture(scope='module')
+def profiles() -> Dict[str, Dict[str, Any]]:
+    rate, mode = profile_store.rate, profile_store.mode
+    profile_store.rate = 1.0
+    try:
+        return asyncio.run(_profile_requests('sample', 'cprofile'))
+    finally:
+        profile_store.rate, profile_store.mode = rate, mode
+
+
+def test_sampled_profile_shows_handler_frames(profiles) -> None:
+    stacks: str = render_profile(profiles['sample'], 'collapsed').decode()
+    handler_stacks = [stack for stack in stacks.splitlines() if '_spin_in_handler' in stack]
+    assert handler_stacks, stacks
+    # the handler frames continue the stack of the request task waiting for them
+    assert all('wrapped_handler' in stack and 'profiled_handler' in stack for stack in handler_stacks)
+
+
+def test_cprofile_shows_handler_frames(profiles) -> None:
+    assert profiles['cprofile']['mode'] == 'cprofile'
+    text: str = render_profile(profiles['cprofile'], 'text').decode()
+    assert 'profiled_handler' in text and '_spin_in_handler' in text
@@ -0,0 +1,246 @@
+import data_types.data_types as t
+import datetime
+import models.models as m
+import re
+from sanic.exceptions import InvalidUsage
+from sqlalchemy import CheckConstraint, Column
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, get_args, get_origin, get_type_hints
+
+# "<column> in ('A', 'B', ...)" check constraints, validated as a set of allowed values
+ALLOWED_VALUES = re.compile(r"^\s*(\w+)\s+in\s+\((.*)\)\s*$", re.IGNORECASE)
+
+VALIDATED_MODELS = (
+    m.Gender, m.MembershipFeeCategory, m.AddressType, m.PhoneType, m.EmailType, m.Person, m.Organization, m.Address,
+    m.Email, m.Phone, m.Membership,
+)
+
+# Row types of the PATCH envelopes and the tables their rows are written to
+ROW_MODELS: Dict[Any, Any] = {
+    t.Person: m.Person,
+    t.Organization: m.Organization,
+    t.PersonAddress: m.Address,
+    t.OrganizationAddress: m.Address,
+    t.PersonEmail: m.Email,
+    t.OrganizationEmail: m.Email,
+    t.PersonPhone: m.Phone,
+    t.OrganizationPhone: m.Phone,
+    t.PersonMembership: m.Membership,
+    t.OrganizationMembership: m.Membership,
+}
+
+Check = Callable[[Any], Any]
+
+
+def _parse_date(value: str) -> datetime.date:
+    return datetime.date.fromisoformat(value)
+
+
+def _parse_datetime(value: str) -> datetime.datetime:
+    # JavaScript `toISOString()` marks UTC with a trailing "Z", stored as a naive timestamp like before
+    return datetime.datetime.fromisoformat(value[:-1] if value.endswith('Z') else value)
+
+
+def _allowed_values(column: Column) -> Optional[FrozenSet[str]]:
+    for constraint in (*column.constraints, *column.table.constraints):
+        if isinstance(constraint, CheckConstraint):
+            match = ALLOWED_VALUES.match(str(constraint.sqltext))
+            if match is not None and match.group(1) == column.name:
+                return frozenset(re.findall(r"'([^']*)'", match.group(2)))
+    return None
+
+
+def column_check(column: Column) -> Check:
+    """
+    Builds the check of one column from its type, length, nullability and allowed values. The check returns the
+    value to store, parsing ISO strings of date columns, and raises `ValueError` with the reason of a rejection.
+    """
+    allowed: Optional[FrozenSet[str]] = _allowed_values(column)
+    python_type: type = column.type.python_type
+    length: Optional[int] = getattr(column.type, 'length', None)
+
+    if allowed is not None:
+        message: str = f"must be one of {', '.join(sorted(allowed))}"
+
+        def check(value: Any) -> Any:
+            if value not in allowed:
+                raise ValueError(message)
+            return value
+    elif python_type is str:
+        def check(value: Any) -> Any:
+            if type(value) is not str:
+                raise ValueError("must be a string")
+            if length is not None and len(value) > length:
+                raise ValueError(f"must be at most {length} characters long")
+            return value
+    elif python_type is int:
+        def check(value: Any) -> Any:
+            if type(value) is not int:
+                raise ValueError("must be an integer")
+            return value
+    elif python_type in (datetime.date, datetime.datetime):
+        parse: Callable[[str], Any] = _parse_date if python_type is datetime.date else _parse_datetime
+        message: str = "must be an ISO 8601 date" if python_type is datetime.date else "must be an ISO 8601 timestamp"
+
+        def check(value: Any) -> Any:
+            if type(value) is not str:
+                raise ValueError(message)
+            try:
+                return parse(value)
+            except ValueError:
+                raise ValueError(message)
+    else:
+        def check(value: Any) -> Any:
+            return value
+
+    if not column.nullable:
+        return check
+
+    def nullable_check(value: Any) -> Any:
+        return None if value is None else check(value)
+    return nullable_check
+
+
+def _assigned_by_server(value: Any) -> Any:
+    # Numbers of the sequences are unique only while nothing else writes them
+    raise ValueError("is assigned by the server")
+
+
+class PayloadValidator:
+    """
+    Validator of the JSON payloads written to one table, built once from the column metadata of its model. Inserts
+    must carry every non-nullable column without a default or sequence; updates may carry any subset of the columns.
+    Columns backed by a sequence are rejected in both.
+    """
+
+    def __init__(self, model: Any, partial: bool) -> None:
+        self.model: Any = model
+        self.checks: Dict[str, Check] = {
+            column.name: _assigned_by_server if 'sequence' in column.info else column_check(column)
+            for column in model.__table__.columns
+        }
+        self.required: FrozenSet[str] = frozenset() if partial else frozenset(
+            column.name for column in model.__table__.columns
+            if not column.nullable and column.default is None and column.server_default is None
+            and not column.primary_key and 'sequence' not in column.info
+        )
+
+    def validate(self, payload: Any, path: str, errors: List[str]) -> Dict[str, Any]:
+        if not isinstance(payload, dict):
+            errors.append(f"{path or 'payload'}: must be an object")
+            return {}
+        prefix: str = f'{path}.' if path else ''
+        values: Dict[str, Any] = {}
+        for key, value in payload.items():
+            check: Optional[Check] = self.checks.get(key)
+            if check is None:
+                errors.append(f"{prefix}{key}: unknown field")
+                continue
+            try:
+                values[key] = check(value)
+            except ValueError as e:
+                errors.append(f"{prefix}{key}: {e}")
+        if not self.required.issubset(payload):
+            errors.extend(f"{prefix}{key}: required" for key in sorted(self.required.difference(payload)))
+        return values
+
+    def validate_list(self, rows: Any, path: str, errors: List[str]) -> List[Dict[str, Any]]:
+        if not isinstance(rows, list):
+            errors.append(f"{path}: must be a list")
+            return []
+        return [self.validate(row, f'{path}[{index}]', errors) for index, row in enumerate(rows)]
+
+
+class EnvelopeValidator:
+    """
+    Validator of the PATCH payloads shaped like a `TypedDict` of `data_types`, e.g. `PersonResult`: every key whose
+    type is a row type of `ROW_MODELS` (or a list of them) is required and its rows are validated as updates of the
+    table. Keys of other types are passed through untouched.
+    """
+
+    def __init__(self, typed_dict: Any) -> None:
+        self.fields: Dict[str, Callable[[Any, str, List[str]], Any]] = {}
+        for key, hint in get_type_hints(typed_dict).items():
+            is_list: bool = get_origin(hint) in (list, List)
+            model: Any = ROW_MODELS.get(get_args(hint)[0] if is_list else hint)
+            if model is not None:
+                validator: PayloadValidator = _update_validators[model]
+                self.fields[key] = validator.validate_list if is_list else validator.validate
+
+    def validate(self, payload: Any, errors: List[str]) -> Dict[str, Any]:
+        if not isinstance(payload, dict):
+            errors.append("payload: must be an object")
+            return {}
+        values: Dict[str, Any] = dict(payload)
+        for key, validate in self.fields.items():
+            if key not in payload:
+                errors.append(f"{key}: required")
+            else:
+                values[key] = validate(payload[key], key, errors)
+        return values
+
+
+_insert_validators: Dict[Any, PayloadValidator] = {model: PayloadValidator(model, False) for model in VALIDATED_MODELS}
+_update_validators: Dict[Any, PayloadValidator] = {model: PayloadValidator(model, True) for model in VALIDATED_MODELS}
+_envelope_validators: Dict[Any, EnvelopeValidator] = {
+    typed_dict: EnvelopeValidator(typed_dict) for typed_dict in (t.PersonResult, t.OrganizationResult)
+}
+
+
+def _raise_for(errors: List[str]) -> None:
+    if errors:
+        raise InvalidUsage(f"Invalid payload: {'; '.join(errors)}")
+
+
+def validate_insert(model: Any, payload: Any) -> Dict[str, Any]:
+    """
+    Validates the JSON payload of a new row of `model`.
+
+    :param model: model class of the table
+    :param payload: decoded JSON payload
+    :return: column values, with dates parsed
+    :raises InvalidUsage: listing every rejected field
+    """
+    errors: List[str] = []
+    values: Dict[str, Any] = _insert_validators[model].validate(payload, '', errors)
+    _raise_for(errors)
+    return values
+
+
+def validate_insert_rows(model: Any, rows: Any, path: str) -> List[Dict[str, Any]]:
+    """
+    Validates a list of new rows of `model`, the rejected fields are reported as `<path>[<index>].<field>`.
+    """
+    errors: List[str] = []
+    values: List[Dict[str, Any]] = _insert_validators[model].validate_list(rows, path, errors)
+    _raise_for(errors)
+    return values
+
+
+def validate_update(model: Any, payload: Any) -> Dict[str, Any]:
+    """
+    Validates the JSON payload of changes to a row of `model`.
+
+    :param model: model class of the table
+    :param payload: decoded JSON payload
+    :return: column values, with dates parsed
+    :raises InvalidUsage: listing every rejected field
+    """
+    errors: List[str] = []
+    values: Dict[str, Any] = _update_validators[model].validate(payload, '', errors)
+    _raise_for(errors)
+    return values
+
+
+def validate_changes(typed_dict: Any, payload: Any) -> Dict[str, Any]:
+    """
+    Validates a PATCH payload shaped like `typed_dict` (`PersonResult` or `OrganizationResult`).
+
+    :param typed_dict: `TypedDict` of `data_types` describing the payload
+    :param payload: decoded JSON payload
+    :return: payload with the column values of its rows validated, dates parsed
+    :raises InvalidUsage: listing every rejected field
+    """
+    errors: List[str] = []
+    values: Dict[str, Any] = _envelope_validators[typed_dict].validate(payload, errors)
+    _raise_for(errors)
+    return values